@@ -0,0 +1,168 @@
+# SPDX-FileCopyrightText: 2026 Philippe ENTZMANN <philippe@entzmann.name>
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+"""
+Benchmark of brick publishing: one message at a time vs batched.
+
+Publishes `--messages` messages on a brick's -OUT subject against a local
+nats-server, in NATS core and in JetStream mode, and reports throughput:
+
+- single: `await ctx.publisher_out.publish(...)` per message
+- batched: `await ctx.publish_many(...)` (BatchPublisher)
+
+A scenario ends when every message is on the server: after a client flush
+in NATS core, once every publish ack is received in JetStream mode.
+
+Results are written to report/bench/publish.{md,json} at the repository root.
+
+Usage:
+    cd packages/pac0
+    uv run python bench/bench_publish.py [--messages 20000] [--size 1024]
+        [--batch 100] [--nats-url nats://127.0.0.1:4222]
+
+Without --nats-url, a nats-server with JetStream is started on a free port.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import time
+from contextlib import asynccontextmanager
+from dataclasses import asdict, dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+
+from pac0.shared.esb import SettingsService, declare_stream, init_esb_app
+
+REPORT_DIR = Path(__file__).absolute().parents[3] / "report" / "bench"
+STREAM = "pac0-bench"
+
+
+@dataclass
+class ScenarioResult:
+    name: str
+    mode: str
+    messages: int
+    failed: int
+    elapsed: float
+    throughput: float
+
+
+@asynccontextmanager
+async def nats_server(url: str | None):
+    if url is not None:
+        yield url
+        return
+    from nats.server import run
+
+    async with await run(port=0, jetstream=True) as server:
+        yield f"nats://127.0.0.1:{server.port}"
+
+
+async def run_mode(args, mode: str) -> list[ScenarioResult]:
+    settings = SettingsService(
+        _env_file=None,
+        mode=mode,
+        stream=STREAM,
+        publish_batch=args.batch,
+        publish_max_pending_acks=args.max_pending_acks,
+    )
+    ctx, broker, _ = init_esb_app("bench", settings)
+    payload = b"x" * args.size
+    results = []
+
+    async def scenario(name, publish) -> ScenarioResult:
+        start = time.perf_counter()
+        failed = await publish()
+        # NATS core: wait until the server has received every message
+        await (await broker.connect()).flush()
+        elapsed = time.perf_counter() - start
+        return ScenarioResult(
+            name=name,
+            mode=mode,
+            messages=args.messages,
+            failed=failed,
+            elapsed=elapsed,
+            throughput=args.messages / elapsed if elapsed else 0.0,
+        )
+
+    async def single() -> int:
+        for i in range(args.messages):
+            await ctx.publisher_out.publish(payload, correlation_id=f"c-{i}")
+        return 0
+
+    async def batched() -> int:
+        return len(await ctx.publish_many(payload for _ in range(args.messages)))
+
+    if ctx.jetstream is not None:
+        await declare_stream(broker, ctx.jetstream)
+    async with broker:
+        try:
+            results.append(await scenario("single", single))
+            results.append(await scenario("batched", batched))
+        finally:
+            if ctx.jetstream is not None:
+                await (await broker.connect()).jetstream().delete_stream(STREAM)
+    return results
+
+
+async def run_benchmark(args) -> list[ScenarioResult]:
+    results = []
+    async with nats_server(args.nats_url) as url:
+        os.environ["NATS_URL"] = url
+        for mode in ("core", "jetstream"):
+            results += await run_mode(args, mode)
+    return results
+
+
+def write_report(args, results: list[ScenarioResult]):
+    REPORT_DIR.mkdir(parents=True, exist_ok=True)
+    meta = {
+        "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "messages": args.messages,
+        "size": args.size,
+        "batch": args.batch,
+        "max_pending_acks": args.max_pending_acks,
+    }
+    (REPORT_DIR / "publish.json").write_text(
+        json.dumps({"meta": meta, "results": [asdict(r) for r in results]}, indent=2)
+    )
+
+    lines = [
+        "# Publish benchmark",
+        "",
+        ", ".join(f"{k}: {v}" for k, v in meta.items()),
+        "",
+        "| mode | scenario | messages | failed | seconds | msg/s |",
+        "|------|----------|---------:|-------:|--------:|------:|",
+    ]
+    lines += [
+        f"| {r.mode} | {r.name} | {r.messages} | {r.failed} | {r.elapsed:.2f} "
+        f"| {r.throughput:.0f} |"
+        for r in results
+    ]
+    (REPORT_DIR / "publish.md").write_text("\n".join(lines) + "\n")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--messages", type=int, default=20_000)
+    parser.add_argument("--size", type=int, default=1024)
+    parser.add_argument("--batch", type=int, default=100)
+    parser.add_argument("--max-pending-acks", type=int, default=1000)
+    parser.add_argument("--nats-url", help="use a running nats-server (with JetStream)")
+    args = parser.parse_args()
+
+    results = asyncio.run(run_benchmark(args))
+    write_report(args, results)
+    print((REPORT_DIR / "publish.md").read_text())
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,283 @@
+# SPDX-FileCopyrightText: 2026 Philippe ENTZMANN <philippe@entzmann.name>
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+"""
+Benchmark of the routing path (PEPPOL lookup and route_invoice).
+
+Runs `PeppolLookupService.lookup` and `route_invoice` against the fake DNS
+(peppol_dns_fake) and the SMP stand-in (peppol_smp_fake), both started
+locally with the same participants, and reports throughput and
+p50/p95/p99 latency per scenario:
+
+- cold: distinct recipients, empty caches
+- warm: the same recipients again, caches filled
+- burst: many concurrent lookups of one recipient, empty caches
+- route_many: route_invoice to distinct recipients, empty caches
+- route_warm: route_invoice to the same recipients again
+
+Results are written to report/bench/routing.{md,json} at the repository root.
+
+Usage:
+    cd packages/pac0
+    uv run python bench/bench_routing.py [--participants 10000] [--lookups 2000]
+        [--concurrency 50] [--burst 200] [--smp-latency 0.005] [--asgi]
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import platform
+import socket
+import statistics
+import threading
+import time
+from dataclasses import asdict, dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Awaitable, Callable
+
+import httpx
+
+from pac0.service.peppol_dns_fake.main import DNSServer
+from pac0.service.peppol_smp_fake.main import FaultConfig, SmpRegistry, create_app
+from pac0.service.routage import lib
+from pac0.service.routage.models import InvoiceMessage
+from pac0.service.routage.peppol import PeppolLookupService
+from pac0.shared.peppol import PeppolEnvironment
+
+REPORT_DIR = Path(__file__).absolute().parents[3] / "report" / "bench"
+SML_ZONE = PeppolEnvironment.TEST.value
+
+
+@dataclass
+class ScenarioResult:
+    name: str
+    operations: int
+    errors: int
+    elapsed: float
+    throughput: float
+    p50_ms: float
+    p95_ms: float
+    p99_ms: float
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def sirens(count: int) -> list[str]:
+    return [f"{i:09d}" for i in range(count)]
+
+
+def smp_app(participants: int, latency: float):
+    registry = SmpRegistry()
+    for siren in sirens(participants):
+        registry.add("0009", siren)
+    return create_app(registry, FaultConfig(latency=latency), seed=0)
+
+
+def serve_smp(port: int, participants: int, latency: float):
+    """SMP stand-in over HTTP, in a child process (see --asgi)"""
+    import uvicorn
+
+    uvicorn.run(
+        smp_app(participants, latency), host="127.0.0.1", port=port, log_level="warning"
+    )
+
+
+def wait_for_port(port: int, timeout: float = 60.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.5).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise TimeoutError(f"SMP stand-in not listening on {port}")
+
+
+def percentile(ordered: list[float], p: int) -> float:
+    if len(ordered) < 2:
+        return ordered[0] if ordered else 0.0
+    return statistics.quantiles(ordered, n=100, method="inclusive")[p - 1]
+
+
+async def run_scenario(
+    name: str,
+    operation: Callable[[str], Awaitable[bool]],
+    recipients: list[str],
+    concurrency: int,
+) -> ScenarioResult:
+    """run `operation` once per recipient with at most `concurrency` in flight"""
+    latencies: list[float] = []
+    errors = 0
+    queue = iter(recipients)
+
+    async def worker():
+        nonlocal errors
+        for recipient in queue:
+            start = time.perf_counter()
+            ok = await operation(recipient)
+            latencies.append(time.perf_counter() - start)
+            errors += not ok
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return ScenarioResult(
+        name=name,
+        operations=len(latencies),
+        errors=errors,
+        elapsed=elapsed,
+        throughput=len(latencies) / elapsed if elapsed else 0.0,
+        p50_ms=percentile(latencies, 50) * 1000,
+        p95_ms=percentile(latencies, 95) * 1000,
+        p99_ms=percentile(latencies, 99) * 1000,
+    )
+
+
+async def run_benchmark(args, smp_url: str, dns_port: int, app=None) -> list[ScenarioResult]:
+    def new_service() -> PeppolLookupService:
+        service = PeppolLookupService(
+            environment=PeppolEnvironment.TEST,
+            dns_nameservers=["127.0.0.1"],
+            dns_port=dns_port,
+        )
+        if app is not None:
+            service._client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app))
+        return service
+
+    recipients = sirens(min(args.lookups, args.participants))
+    results = []
+
+    async with new_service() as service:
+
+        async def lookup(siren: str) -> bool:
+            return (await service.lookup_by_siren(siren)).success
+
+        results.append(await run_scenario("cold", lookup, recipients, args.concurrency))
+        results.append(await run_scenario("warm", lookup, recipients, args.concurrency))
+
+        await service.clear_cache()
+        burst = [recipients[0]] * args.burst
+        results.append(await run_scenario("burst", lookup, burst, args.burst))
+
+    async with new_service() as service:
+        lib.set_peppol_service(service)
+
+        async def route(siren: str) -> bool:
+            result = await lib.route_invoice(
+                InvoiceMessage(
+                    invoice_id=f"INV-{siren}",
+                    sender_siren="111111111",
+                    recipient_siren=siren,
+                    payload="<Invoice/>",
+                )
+            )
+            return result.error_code is None
+
+        try:
+            results.append(
+                await run_scenario("route_many", route, recipients, args.concurrency)
+            )
+            results.append(
+                await run_scenario("route_warm", route, recipients, args.concurrency)
+            )
+        finally:
+            lib.set_peppol_service(None)
+
+    return results
+
+
+def write_report(args, results: list[ScenarioResult]):
+    REPORT_DIR.mkdir(parents=True, exist_ok=True)
+    meta = {
+        "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "participants": args.participants,
+        "lookups": args.lookups,
+        "concurrency": args.concurrency,
+        "burst": args.burst,
+        "smp_latency": args.smp_latency,
+        "transport": "asgi" if args.asgi else "http",
+    }
+    (REPORT_DIR / "routing.json").write_text(
+        json.dumps({"meta": meta, "results": [asdict(r) for r in results]}, indent=2)
+    )
+
+    lines = [
+        "# Routing benchmark",
+        "",
+        ", ".join(f"{k}: {v}" for k, v in meta.items()),
+        "",
+        "| scenario | ops | errors | ops/s | p50 ms | p95 ms | p99 ms |",
+        "|----------|----:|-------:|------:|-------:|-------:|-------:|",
+    ]
+    lines += [
+        f"| {r.name} | {r.operations} | {r.errors} | {r.throughput:.0f} "
+        f"| {r.p50_ms:.2f} | {r.p95_ms:.2f} | {r.p99_ms:.2f} |"
+        for r in results
+    ]
+    (REPORT_DIR / "routing.md").write_text("\n".join(lines) + "\n")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--participants", type=int, default=10_000)
+    parser.add_argument("--lookups", type=int, default=2_000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--burst", type=int, default=200)
+    parser.add_argument("--smp-latency", type=float, default=0.005)
+    parser.add_argument(
+        "--asgi",
+        action="store_true",
+        help="call the SMP stand-in in process (no HTTP server)",
+    )
+    args = parser.parse_args()
+
+    smp_port = free_port()
+    smp_url = f"http://127.0.0.1:{smp_port}"
+
+    dns = DNSServer(host="127.0.0.1", port=0)
+    dns.add_peppol_participants(SML_ZONE, "0009", sirens(args.participants), smp_url)
+    dns.start()
+    dns_thread = threading.Thread(target=dns.serve_forever, daemon=True)
+    dns_thread.start()
+
+    smp_process = None
+    app = None
+    try:
+        if args.asgi:
+            app = smp_app(args.participants, args.smp_latency)
+        else:
+            smp_process = multiprocessing.Process(
+                target=serve_smp,
+                args=(smp_port, args.participants, args.smp_latency),
+                daemon=True,
+            )
+            smp_process.start()
+            wait_for_port(smp_port)
+
+        results = asyncio.run(run_benchmark(args, smp_url, dns.port, app))
+    finally:
+        if smp_process is not None:
+            smp_process.terminate()
+            smp_process.join()
+        dns.running = False
+        dns_thread.join()
+        dns.stop()
+
+    write_report(args, results)
+    print((REPORT_DIR / "routing.md").read_text())
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
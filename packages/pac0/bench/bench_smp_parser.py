@@ -0,0 +1,171 @@
+# SPDX-FileCopyrightText: 2026 Philippe ENTZMANN <philippe@entzmann.name>
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+"""
+Micro-benchmark of the SMP ServiceMetadata parser.
+
+Compares the previous ElementTree implementation (full tree, then one walk
+per field) with the single-pass incremental parser of
+`pac0.service.routage.peppol`.
+
+Usage:
+    cd packages/pac0
+    uv run python bench/bench_smp_parser.py [--processes 1 10 100] [--repeat 5]
+"""
+
+import argparse
+import timeit
+import xml.etree.ElementTree as ET
+from typing import Optional
+
+from pac0.service.routage.peppol import PeppolEndpoint, parse_smp_endpoint
+
+NS_SMP = "http://busdox.org/serviceMetadata/publishing/1.0/"
+NS_WSA = "http://www.w3.org/2005/08/addressing"
+NS_DS = "http://www.w3.org/2000/09/xmldsig#"
+
+PROCESS = """
+        <Process>
+          <ProcessIdentifier scheme="cenbii-procid-ubl">urn:fdc:peppol.eu:2017:poacc:billing:01:1.0</ProcessIdentifier>
+          <ServiceEndpointList>
+            <Endpoint transportProfile="{profile}">
+              <EndpointReference xmlns="{wsa}">
+                <Address>https://ap{index}.example.com/as4</Address>
+              </EndpointReference>
+              <RequireBusinessLevelSignature>false</RequireBusinessLevelSignature>
+              <ServiceActivationDate>2025-01-01T00:00:00Z</ServiceActivationDate>
+              <ServiceExpirationDate>2030-01-01T00:00:00Z</ServiceExpirationDate>
+              <Certificate>{certificate}</Certificate>
+              <ServiceDescription>Access point {index}</ServiceDescription>
+              <TechnicalContactUrl>https://ap{index}.example.com/contact</TechnicalContactUrl>
+            </Endpoint>
+          </ServiceEndpointList>
+        </Process>"""
+
+SIGNATURE = """
+  <Signature xmlns="{ds}">
+    <SignedInfo><Reference URI=""><DigestValue>{digest}</DigestValue></Reference></SignedInfo>
+    <SignatureValue>{value}</SignatureValue>
+    <KeyInfo><X509Data><X509Certificate>{certificate}</X509Certificate></X509Data></KeyInfo>
+  </Signature>"""
+
+
+def build_smp_response(processes: int, as4_position: str = "last") -> bytes:
+    """SignedServiceMetadata document with `processes` endpoints, one being AS4"""
+    certificate = "MIIF" + "A" * 1800
+    as4_index = processes - 1 if as4_position == "last" else 0
+    body = "".join(
+        PROCESS.format(
+            profile="peppol-transport-as4-v2_0"
+            if i == as4_index
+            else "busdox-transport-as2-ver1p0",
+            wsa=NS_WSA,
+            index=i,
+            certificate=certificate,
+        )
+        for i in range(processes)
+    )
+    signature = SIGNATURE.format(
+        ds=NS_DS, digest="B" * 44, value="C" * 344, certificate=certificate
+    )
+    xml = (
+        f'<?xml version="1.0" encoding="UTF-8"?>\n'
+        f'<SignedServiceMetadata xmlns="{NS_SMP}">\n'
+        f"  <ServiceMetadata><ServiceInformation><ProcessList>{body}\n"
+        f"  </ProcessList></ServiceInformation></ServiceMetadata>{signature}\n"
+        f"</SignedServiceMetadata>\n"
+    )
+    return xml.encode("utf-8")
+
+
+def legacy_parse_smp_response(xml_content: str) -> Optional[PeppolEndpoint]:
+    """previous `PeppolLookupService._parse_smp_response` implementation"""
+    namespaces = {"smp": NS_SMP, "wsa": NS_WSA}
+
+    try:
+        root = ET.fromstring(xml_content)
+
+        endpoint = root.find(
+            './/smp:Endpoint[@transportProfile="peppol-transport-as4-v2_0"]',
+            namespaces,
+        )
+
+        if endpoint is None:
+            for elem in root.iter():
+                if "Endpoint" in elem.tag:
+                    if elem.get("transportProfile") == "peppol-transport-as4-v2_0":
+                        endpoint = elem
+                        break
+
+        if endpoint is None:
+            return None
+
+        address = None
+        for child in endpoint.iter():
+            if "Address" in child.tag:
+                address = child.text
+                break
+
+        certificate = None
+        for child in endpoint.iter():
+            if "Certificate" in child.tag:
+                certificate = child.text
+                break
+
+        description = None
+        for child in endpoint.iter():
+            if "ServiceDescription" in child.tag:
+                description = child.text
+                break
+
+        if address is None or certificate is None:
+            return None
+
+        return PeppolEndpoint(
+            address=address,
+            certificate=certificate,
+            transport_profile="peppol-transport-as4-v2_0",
+            service_description=description,
+        )
+
+    except ET.ParseError:
+        return None
+
+
+def bench(label: str, fn, repeat: int) -> float:
+    """best time per call in microseconds"""
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    best = min(timer.repeat(repeat=repeat, number=number)) / number
+    return best * 1e6
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--processes", type=int, nargs="+", default=[1, 10, 100])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(
+        f"{'processes':>9} {'AS4':>6} {'size':>9} "
+        f"{'legacy µs':>10} {'stream µs':>10} {'speedup':>8}"
+    )
+    for processes in args.processes:
+        for position in ("first", "last"):
+            content = build_smp_response(processes, position)
+            text = content.decode("utf-8")
+            expected = legacy_parse_smp_response(text)
+            assert parse_smp_endpoint(content) == expected
+
+            legacy = bench("legacy", lambda: legacy_parse_smp_response(text), args.repeat)
+            stream = bench("stream", lambda: parse_smp_endpoint(content), args.repeat)
+            print(
+                f"{processes:>9} {position:>6} {len(content):>9} "
+                f"{legacy:>10.1f} {stream:>10.1f} {legacy / stream:>7.2f}x"
+            )
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -2,13 +2,40 @@
 #
 # SPDX-License-Identifier: GPL-3.0-or-later
 
-from pac0.shared.esb import init_esb_app
+import os
+
+from faststream.nats import NatsMessage
+
+from pac0.shared.esb import decode_envelope, forward, init_esb_app, routing_headers
 
 
 ctx, broker, app = init_esb_app("annuaire-local")
 
+# SIREN des destinataires inscrits chez cette PA (ANNUAIRE_LOCAL_SIRENS,
+# séparés par des virgules), en attendant l'annuaire
+LOCAL_SIRENS = {
+    siren.strip()
+    for siren in os.environ.get("ANNUAIRE_LOCAL_SIRENS", "").split(",")
+    if siren.strip()
+}
+
+
+def is_local(recipient: str) -> bool:
+    """Destinataire inscrit dans l'annuaire local (un SIRET par son SIREN)."""
+    return recipient.strip()[:9] in LOCAL_SIRENS
+
 
-@broker.subscriber(ctx.subject_in, ctx.queue)
-async def process(message):
-    await ctx.publisher_out.publish(message, correlation_id=message.correlation_id)
+@ctx.subscriber(ctx.subject_in)
+async def process(message: NatsMessage):
+    # corps transmis sans décodage, la décision voyage dans l'en-tête
+    # Pac0-Local-Recipient (lu par gestion_cycle_vie)
+    routing = routing_headers(message)
+    if not routing.recipient_siren:
+        # producteur sans en-têtes de routage: destinataire lu dans le corps
+        body = await decode_envelope(message)
+        routing.recipient_siren = body.get("recipient_siren") if isinstance(body, dict) else None
+    if not routing.recipient_siren:
+        raise ValueError("Facture sans destinataire (recipient_siren)")
+    routing.local_recipient = is_local(routing.recipient_siren)
+    await forward(ctx.publisher_out, message, routing=routing)
     # await publisher_err.publish(message, correlation_id=message.correlation_id)
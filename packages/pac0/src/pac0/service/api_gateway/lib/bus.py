@@ -8,10 +8,13 @@ from fastapi import FastAPI
 from faststream.nats.fastapi import NatsMessage, NatsRouter
 from pac0.service.api_gateway.lib import trace
 from pac0.service.api_gateway.lib.common import global_state
+from pac0.service.api_gateway.lib.invoices import SUBJECT_OUT
 from pac0.shared.esb import get_nats_url
 
 router = NatsRouter(get_nats_url())
 
+publisher_out = router.publisher(SUBJECT_OUT)
+
 
 @router.after_startup
 async def test(app: FastAPI):
@@ -0,0 +1,46 @@
+# SPDX-FileCopyrightText: 2026 Philippe ENTZMANN <philippe@entzmann.name>
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from typing import Any, Optional
+
+from pac0.service.routage.models import InvoiceMessage
+from pac0.shared.blob import BlobStore, check_in
+from pac0.shared.esb import RoutingHeaders, publish_envelope
+
+SUBJECT_OUT = "api-gateway-OUT"
+
+
+async def publish_invoice(
+    publisher: Any,
+    invoice: InvoiceMessage,
+    store: Optional[BlobStore] = None,
+    correlation_id: Optional[str] = None,
+    content_type: str = "application/xml",
+) -> dict:
+    """
+    Publie une facture sur api-gateway-OUT.
+
+    Avec un stockage de documents (`app.state.blob_store`), le document est
+    déposé une seule fois (claim-check): les briques suivantes, dont
+    gestion_cycle_vie, ne transmettent que sa référence `payload_ref`.
+
+    Returns:
+        Corps publié (forme InvoiceMessage)
+    """
+    message = invoice.model_dump()
+    if store is not None:
+        message = await check_in(store, message, content_type=content_type)
+    await publish_envelope(
+        publisher,
+        message,
+        RoutingHeaders(
+            invoice_id=invoice.invoice_id,
+            sender_siren=invoice.sender_siren,
+            recipient_siren=invoice.recipient_siren,
+            document_type=invoice.document_type,
+            stage=SUBJECT_OUT,
+        ),
+        correlation_id=correlation_id,
+    )
+    return message
@@ -4,7 +4,9 @@
 
 from fastapi import FastAPI
 from pac0.service.api_gateway.lib.api import router as router_api
+from pac0.service.api_gateway.lib.bus import publisher_out
 from pac0.service.api_gateway.lib.bus import router as router_bus
+from pac0.shared.blob import blob_store_from_env
 
 app = FastAPI()
 
@@ -13,3 +15,7 @@ app.include_router(router_api)
 
 app.state.rank = "dev"
 app.state.broker = router_bus.broker
+# publication des factures (lib.invoices.publish_invoice)
+app.state.publisher_out = publisher_out
+# documents déposés dans le stockage, les messages n'en portent que la référence
+app.state.blob_store = blob_store_from_env(router_bus.broker)
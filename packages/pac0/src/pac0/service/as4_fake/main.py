@@ -0,0 +1,178 @@
+# SPDX-FileCopyrightText: 2026 Philippe ENTZMANN <philippe@entzmann.name>
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+"""
+Local AS4 receiver stand-in.
+
+Accepts AS4 user messages (SOAP envelope + gzip payload, multipart/related)
+as sent by `As4Transmitter`, checks them, keeps the received invoices in
+memory and answers with a synchronous ebMS receipt (or an ebMS error), so
+that the outbound transmission can be exercised without a real access point.
+
+Environment:
+    AS4_LATENCY      added latency in seconds
+    AS4_ERROR_RATE   fraction of messages answered with an ebMS error
+    AS4_SEED         random seed of the fault injection
+"""
+
+import asyncio
+import gzip
+import os
+import random
+import uuid
+import xml.etree.ElementTree as ET
+from dataclasses import asdict, dataclass
+from datetime import datetime, timezone
+from typing import Optional
+from xml.sax.saxutils import escape
+
+from fastapi import FastAPI, Request, Response
+
+from pac0.service.routage.as4 import EBMS_NS, SOAP_NS, parse_multipart
+
+SOAP_CONTENT_TYPE = "application/soap+xml; charset=UTF-8"
+
+
+@dataclass
+class FaultConfig:
+    """Latency and error injection settings."""
+
+    latency: float = 0.0
+    error_rate: float = 0.0
+
+    @classmethod
+    def from_env(cls) -> "FaultConfig":
+        return cls(
+            latency=float(os.environ.get("AS4_LATENCY", "0")),
+            error_rate=float(os.environ.get("AS4_ERROR_RATE", "0")),
+        )
+
+
+@dataclass
+class ReceivedMessage:
+    """An AS4 user message accepted by the stand-in."""
+
+    message_id: str
+    conversation_id: str
+    action: str
+    final_recipient: str
+    payload: bytes
+
+
+def signal_xml(ref_to_message_id: str, error: Optional[tuple[str, str]] = None) -> str:
+    """ebMS signal message: receipt, or error (code, description)."""
+    timestamp = datetime.now(timezone.utc).isoformat(timespec="milliseconds")
+    if error is None:
+        content = "<eb:Receipt/>"
+    else:
+        code, description = error
+        content = (
+            f'<eb:Error errorCode="{code}" severity="failure" '
+            f'refToMessageInError="{escape(ref_to_message_id)}">'
+            f"<eb:Description>{escape(description)}</eb:Description></eb:Error>"
+        )
+    return (
+        f'<env:Envelope xmlns:env="{SOAP_NS}" xmlns:eb="{EBMS_NS}">'
+        '<env:Header><eb:Messaging env:mustUnderstand="true"><eb:SignalMessage>'
+        f"<eb:MessageInfo><eb:Timestamp>{timestamp}</eb:Timestamp>"
+        f"<eb:MessageId>{uuid.uuid4()}@as4-fake</eb:MessageId>"
+        f"<eb:RefToMessageId>{escape(ref_to_message_id)}</eb:RefToMessageId>"
+        f"</eb:MessageInfo>{content}"
+        "</eb:SignalMessage></eb:Messaging></env:Header><env:Body/></env:Envelope>"
+    )
+
+
+def read_user_message(body: bytes, content_type: str) -> ReceivedMessage:
+    """
+    Parse and check an AS4 user message.
+
+    Raises:
+        ValueError: malformed message (missing header, payload or compression)
+    """
+    envelope, attachments = parse_multipart(body, content_type)
+    user_message = ET.fromstring(envelope).find(f".//{{{EBMS_NS}}}UserMessage")
+    if user_message is None:
+        raise ValueError("no ebMS UserMessage")
+
+    def text(path: str) -> str:
+        return user_message.findtext(path.replace("eb:", f"{{{EBMS_NS}}}")) or ""
+
+    part = user_message.find(f"{{{EBMS_NS}}}PayloadInfo/{{{EBMS_NS}}}PartInfo")
+    if part is None:
+        raise ValueError("no PartInfo")
+    content_id = part.get("href", "").removeprefix("cid:")
+    if content_id not in attachments:
+        raise ValueError(f"missing payload {content_id}")
+
+    properties = {
+        prop.get("name"): prop.text or ""
+        for prop in user_message.iter(f"{{{EBMS_NS}}}Property")
+    }
+    payload = attachments[content_id]
+    if properties.get("CompressionType") == "application/gzip":
+        payload = gzip.decompress(payload)
+
+    return ReceivedMessage(
+        message_id=text("eb:MessageInfo/eb:MessageId"),
+        conversation_id=text("eb:CollaborationInfo/eb:ConversationId"),
+        action=text("eb:CollaborationInfo/eb:Action"),
+        final_recipient=properties.get("finalRecipient", ""),
+        payload=payload,
+    )
+
+
+def create_app(faults: Optional[FaultConfig] = None, seed: Optional[int] = None) -> FastAPI:
+    """Build the AS4 receiver stand-in application."""
+    app = FastAPI()
+    app.state.faults = faults or FaultConfig()
+    app.state.random = random.Random(seed)
+    app.state.received = []
+
+    @app.get("/healthcheck")
+    async def healthcheck(request: Request):
+        return {"status": "OK", "received": len(request.app.state.received)}
+
+    @app.get("/_admin/faults")
+    async def get_faults(request: Request):
+        return asdict(request.app.state.faults)
+
+    @app.put("/_admin/faults")
+    async def set_faults(request: Request, faults: FaultConfig):
+        request.app.state.faults = faults
+        return asdict(faults)
+
+    @app.post("/as4")
+    async def receive(request: Request):
+        faults: FaultConfig = request.app.state.faults
+        if faults.latency > 0:
+            await asyncio.sleep(faults.latency)
+
+        body = await request.body()
+        try:
+            message = read_user_message(body, request.headers.get("content-type", ""))
+        except (ValueError, ET.ParseError, OSError) as e:
+            # EBMS:0004 Other (message rejected)
+            return Response(
+                signal_xml("", ("EBMS:0004", str(e))), media_type=SOAP_CONTENT_TYPE
+            )
+
+        if request.app.state.random.random() < faults.error_rate:
+            return Response(
+                signal_xml(message.message_id, ("EBMS:0004", "injected error")),
+                media_type=SOAP_CONTENT_TYPE,
+            )
+
+        request.app.state.received.append(message)
+        return Response(signal_xml(message.message_id), media_type=SOAP_CONTENT_TYPE)
+
+    return app
+
+
+def app_from_env() -> FastAPI:
+    """Application configured from the environment (see module docstring)."""
+    seed = os.environ.get("AS4_SEED")
+    return create_app(FaultConfig.from_env(), int(seed) if seed else None)
+
+
+app = app_from_env()
@@ -2,7 +2,9 @@
 #
 # SPDX-License-Identifier: GPL-3.0-or-later
 
-from pac0.shared.esb import init_esb_app
+from faststream.nats import NatsMessage
+
+from pac0.shared.esb import forward, init_esb_app
 
 
 ctx, broker, app = init_esb_app("controle-formats")
@@ -10,7 +12,8 @@ ctx, broker, app = init_esb_app("controle-formats")
 publisher = ctx.broker.publisher("test")
 
 
-@broker.subscriber(ctx.subject_in, ctx.queue)
-async def process(message):
-    await ctx.publisher_out.publish(message, correlation_id=message.correlation_id)
+@ctx.subscriber(ctx.subject_in)
+async def process(message: NatsMessage):
+    # corps et en-têtes transmis sans décodage
+    await forward(ctx.publisher_out, message)
     # await publisher_err.publish(message, correlation_id=message.correlation_id)
@@ -2,7 +2,15 @@
 #
 # SPDX-License-Identifier: GPL-3.0-or-later
 
-from pac0.shared.esb import init_esb_app
+from faststream.nats import NatsMessage
+
+from pac0.shared.esb import (
+    forward,
+    get_shard_count,
+    init_esb_app,
+    routing_headers,
+    sharded_subject,
+)
 
 
 ctx, broker, app = init_esb_app("gestion-cycle-vie")
@@ -33,59 +41,69 @@ SUBJECT_08_ERR = "transmission-fiscale-ERR"
 SUBJECT_09_ERR = "gestion-cycle-vie-ERR"
 
 
-publisher_03_IN = broker.publisher(SUBJECT_03_IN)
-publisher_04_IN = broker.publisher(SUBJECT_04_IN)
-publisher_05_IN = broker.publisher(SUBJECT_05_IN)
-publisher_06_IN = broker.publisher(SUBJECT_06_IN)
-publisher_07_IN = broker.publisher(SUBJECT_07_IN)
-publisher_08_IN = broker.publisher(SUBJECT_08_IN)
-
-publisher_err = broker.publisher(SUBJECT_09_ERR)
-
+publisher_03_IN = ctx.publisher(SUBJECT_03_IN)
+publisher_04_IN = ctx.publisher(SUBJECT_04_IN)
+publisher_05_IN = ctx.publisher(SUBJECT_05_IN)
+publisher_06_IN = ctx.publisher(SUBJECT_06_IN)
+publisher_07_IN = ctx.publisher(SUBJECT_07_IN)
+publisher_08_IN = ctx.publisher(SUBJECT_08_IN)
 
-@broker.subscriber(SUBJECT_01_OUT, ctx.queue)
-async def process_01_to_03(message):
-    await publisher_03_IN.publish(message, correlation_id=message.correlation_id)
+publisher_err = ctx.publisher(SUBJECT_09_ERR)
 
+# routage partitionné par destinataire (ROUTAGE_SHARDS)
+ROUTAGE_SHARDS = get_shard_count("routage")
 
-@broker.subscriber(SUBJECT_03_OUT, ctx.queue)
-async def process_03_to_04(message):
-    await publisher_04_IN.publish(message, correlation_id=message.correlation_id)
 
+@ctx.subscriber(SUBJECT_01_OUT)
+async def process_01_to_03(message: NatsMessage):
+    await forward(publisher_03_IN, message, stage=SUBJECT_03_IN)
 
-@broker.subscriber(SUBJECT_04_OUT, ctx.queue)
-async def process_04_to_05(message):
-    await publisher_05_IN.publish(message, correlation_id=message.correlation_id)
 
+@ctx.subscriber(SUBJECT_03_OUT)
+async def process_03_to_04(message: NatsMessage):
+    await forward(publisher_04_IN, message, stage=SUBJECT_04_IN)
 
-@broker.subscriber(SUBJECT_05_OUT, ctx.queue)
-async def process_05_to_06(message):
-    await publisher_06_IN.publish(message, correlation_id=message.correlation_id)
 
-
-@broker.subscriber(SUBJECT_06_OUT, ctx.queue)
-async def process_06_to_07(message):
-    # TODO: ne faire le routage que si non présent dans l'annuaire
-    # TODO: trouver `dans_annuaire_local` dans `message`
-    dans_annuaire_local = True
-    # soit on passe à 07 ou à 08
-    next_publisher = publisher_07_IN if not dans_annuaire_local else publisher_08_IN
-    await next_publisher.publish(message, correlation_id=message.correlation_id)
+@ctx.subscriber(SUBJECT_04_OUT)
+async def process_04_to_05(message: NatsMessage):
+    await forward(publisher_05_IN, message, stage=SUBJECT_05_IN)
 
 
-@broker.subscriber(SUBJECT_07_OUT, ctx.queue)
-async def process_07_to_08(message):
-    await publisher_08_IN.publish(message, correlation_id=message.correlation_id)
+@ctx.subscriber(SUBJECT_05_OUT)
+async def process_05_to_06(message: NatsMessage):
+    await forward(publisher_06_IN, message, stage=SUBJECT_06_IN)
 
 
-@broker.subscriber(SUBJECT_01_ERR, ctx.queue)
-@broker.subscriber(SUBJECT_02_ERR, ctx.queue)
-@broker.subscriber(SUBJECT_03_ERR, ctx.queue)
-@broker.subscriber(SUBJECT_04_ERR, ctx.queue)
-@broker.subscriber(SUBJECT_05_ERR, ctx.queue)
-@broker.subscriber(SUBJECT_06_ERR, ctx.queue)
-@broker.subscriber(SUBJECT_07_ERR, ctx.queue)
-@broker.subscriber(SUBJECT_08_ERR, ctx.queue)
+@ctx.subscriber(SUBJECT_06_OUT)
+async def process_06_to_07(message: NatsMessage):
+    # ne faire le routage que si non présent dans l'annuaire
+    # (en-tête posé par l'annuaire local, le corps n'est pas décodé)
+    routing = routing_headers(message)
+    if routing.local_recipient is None or not routing.recipient_siren:
+        raise ValueError(
+            "En-têtes Pac0-Local-Recipient et Pac0-Recipient-Siren requis (annuaire-local)"
+        )
+    # soit on passe à 07 ou à 08
+    if routing.local_recipient:
+        await forward(publisher_08_IN, message, stage=SUBJECT_08_IN)
+    else:
+        subject = sharded_subject(SUBJECT_07_IN, routing.recipient_siren, ROUTAGE_SHARDS)
+        await forward(publisher_07_IN, message, stage=SUBJECT_07_IN, subject=subject)
+
+
+@ctx.subscriber(SUBJECT_07_OUT)
+async def process_07_to_08(message: NatsMessage):
+    await forward(publisher_08_IN, message, stage=SUBJECT_08_IN)
+
+
+@ctx.subscriber(SUBJECT_01_ERR)
+@ctx.subscriber(SUBJECT_02_ERR)
+@ctx.subscriber(SUBJECT_03_ERR)
+@ctx.subscriber(SUBJECT_04_ERR)
+@ctx.subscriber(SUBJECT_05_ERR)
+@ctx.subscriber(SUBJECT_06_ERR)
+@ctx.subscriber(SUBJECT_07_ERR)
+@ctx.subscriber(SUBJECT_08_ERR)
 async def process_err(message):
     # TODO: common err behaviour
     ...
@@ -0,0 +1,60 @@
+# SPDX-FileCopyrightText: 2026 Philippe ENTZMANN <philippe@entzmann.name>
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+"""
+Toutes les briques dans un seul processus (mode mémoire de l'ESB).
+
+Les briques échangent par le bus en mémoire (pac0.shared.esb.LocalBroker)
+au lieu de NATS; l'API de l'api_gateway est servie par ce processus.
+
+    uv run fastapi run src/pac0/service/monolith/main.py
+"""
+
+import importlib
+import os
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI
+
+# avant l'import des briques: init_esb_app lit le mode à l'import
+os.environ["ESB_MODE"] = "memory"
+
+from pac0.service.api_gateway.lib.api import router as router_api  # noqa: E402
+from pac0.service.api_gateway.lib.common import global_state  # noqa: E402
+from pac0.service.api_gateway.lib.invoices import SUBJECT_OUT  # noqa: E402
+from pac0.shared.blob import blob_store_from_env  # noqa: E402
+from pac0.shared.esb import get_local_broker, serve_local  # noqa: E402
+
+BRICKS = [
+    "controle_formats",
+    "validation_metier",
+    "conversion_formats",
+    "annuaire-local",
+    "routage",
+    "transmission_fiscale",
+    "gestion_cycle_vie",
+]
+
+bricks = {name: importlib.import_module(f"pac0.service.{name}.main") for name in BRICKS}
+bus = get_local_broker()
+
+
+@bus.subscriber("healthcheck_resp")
+async def healthcheck_resp_sub():
+    global_state["healthcheck_resp"].append("xx")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    async with serve_local(*(brick.app for brick in bricks.values())):
+        yield
+
+
+app = FastAPI(lifespan=lifespan)
+app.include_router(router_api)
+
+app.state.rank = "dev"
+app.state.broker = bus
+app.state.publisher_out = bus.publisher(SUBJECT_OUT)
+app.state.blob_store = blob_store_from_env()
@@ -10,14 +10,21 @@ This script creates a DNS service that responds to dig queries.
 Supports A, AAAA, TXT, and NAPTR records.
 """
 
+import csv
 import socket
 import struct
 import threading
 from dataclasses import dataclass
-from typing import Dict, List, Optional, Tuple
+from typing import Dict, Iterable, List, Optional, Tuple
 import time
 import os
 
+from pac0.shared.peppol import (
+    PeppolEnvironment,
+    SmlHashScheme,
+    compute_sml_hostnames,
+)
+
 # DNS Constants
 DNS_PORT = 53
 DNS_HEADER_SIZE = 12
@@ -412,13 +419,90 @@ class DNSServer:
 
         return bytes(data)
 
+    def add_peppol_participants(
+        self,
+        sml_zone: str,
+        scheme_id: str,
+        participant_ids: Iterable[str],
+        smp_url: str,
+        hash_scheme: SmlHashScheme = SmlHashScheme.MD5,
+        ttl: int = 300,
+    ) -> int:
+        """
+        Register the NAPTR record of many PEPPOL participants at once.
+
+        All participants point to the same SMP and share a single record
+        list, so that a directory extract of millions of SIRENs stays cheap.
+
+        Returns:
+            Number of hostnames added
+        """
+        shared = [
+            DNSResourceRecord(
+                name="",
+                rtype=QTYPE_NAPTR,
+                rclass=QCLASS_IN,
+                ttl=ttl,
+                rdata=self._build_naptr_data(
+                    order=100,
+                    preference=10,
+                    flags="U",
+                    services="Meta:SMP",
+                    regexp=f"!^.*$!{smp_url}!",
+                    replacement=".",
+                ),
+            )
+        ]
+        hostnames = compute_sml_hostnames(
+            sml_zone, scheme_id, participant_ids, hash_scheme
+        )
+        self.records.update(dict.fromkeys(hostnames, shared))
+        return len(hostnames)
+
+    def load_peppol_registry(
+        self,
+        path: str,
+        sml_zone: str,
+        smp_url: str,
+        hash_scheme: SmlHashScheme = SmlHashScheme.MD5,
+    ) -> int:
+        """
+        Register every participant of an SMP stand-in registry file
+        (see peppol_smp_fake), all pointing to `smp_url`.
+
+        Returns:
+            Number of hostnames added
+        """
+        by_scheme: Dict[str, List[str]] = {}
+        with open(path, newline="", encoding="utf-8") as f:
+            for row in csv.reader(f):
+                if not row or row[0] == "scheme_id" or row[0].startswith("#"):
+                    continue
+                by_scheme.setdefault(row[0], []).append(row[1])
+        return sum(
+            self.add_peppol_participants(sml_zone, scheme_id, ids, smp_url, hash_scheme)
+            for scheme_id, ids in by_scheme.items()
+        )
+
     def _find_records(self, name: str, qtype: int) -> List[DNSResourceRecord]:
         """Find matching DNS records for a query."""
         # Exact match
         if name in self.records:
             matching = [r for r in self.records[name] if r.rtype == qtype]
             if matching:
-                return matching
+                # Records shared between names (see add_peppol_participants)
+                return [
+                    rr
+                    if rr.name == name
+                    else DNSResourceRecord(
+                        name=name,
+                        rtype=rr.rtype,
+                        rclass=rr.rclass,
+                        ttl=rr.ttl,
+                        rdata=rr.rdata,
+                    )
+                    for rr in matching
+                ]
 
         # Wildcard match for subdomains of .test
         if name.endswith(".test") and "test" in self.records:
@@ -525,6 +609,8 @@ class DNSServer:
             self.port += 1000
             self.socket.bind((self.host, self.port))
 
+        # port=0: the OS picked a free port
+        self.port = self.socket.getsockname()[1]
         self.running = True
         print(f"DNS Server started on {self.host}:{self.port}")
         print("Supported domains:")
@@ -538,27 +624,30 @@ class DNSServer:
         self.start()
 
         try:
-            while self.running:
-                try:
-                    # Set timeout to allow checking self.running
-                    self.socket.settimeout(1.0)
-                    data, addr = self.socket.recvfrom(MAX_DNS_PACKET_SIZE)
-
-                    # Handle query in a separate thread for concurrency
-                    response = self._handle_query(data, addr)
-                    if response:
-                        self.socket.sendto(response, addr)
-
-                except socket.timeout:
-                    continue
-                except Exception as e:
-                    print(f"Error in main loop: {e}")
-
+            self.serve_forever()
         except KeyboardInterrupt:
             print("\nShutting down DNS server...")
         finally:
             self.stop()
 
+    def serve_forever(self):
+        """Answer queries until `running` is cleared (server must be started)."""
+        while self.running:
+            try:
+                # Set timeout to allow checking self.running
+                self.socket.settimeout(1.0)
+                data, addr = self.socket.recvfrom(MAX_DNS_PACKET_SIZE)
+
+                # Handle query in a separate thread for concurrency
+                response = self._handle_query(data, addr)
+                if response:
+                    self.socket.sendto(response, addr)
+
+            except socket.timeout:
+                continue
+            except Exception as e:
+                print(f"Error in main loop: {e}")
+
     def stop(self):
         """Stop the DNS server."""
         self.running = False
@@ -574,6 +663,17 @@ def main():
     port = int(os.environ.get("PORT", "5353"))
     server = DNSServer(host="127.0.0.1", port=port)
 
+    # Participants of the SMP stand-in (see peppol_smp_fake)
+    registry = os.environ.get("PEPPOL_REGISTRY")
+    if registry:
+        count = server.load_peppol_registry(
+            registry,
+            sml_zone=os.environ.get("PEPPOL_SML_ZONE", PeppolEnvironment.TEST.value),
+            smp_url=os.environ["PEPPOL_SMP_URL"],
+            hash_scheme=SmlHashScheme(os.environ.get("PEPPOL_SML_HASH", "md5")),
+        )
+        print(f"{count} PEPPOL participants loaded from {registry}")
+
     # You can also run it on all interfaces with:
     # server = DNSServer(host='0.0.0.0', port=5353)
 
@@ -0,0 +1,306 @@
+# SPDX-FileCopyrightText: 2026 Philippe ENTZMANN <philippe@entzmann.name>
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+"""
+Local SMP stand-in.
+
+Serves real PEPPOL ServiceGroup / ServiceMetadata XML documents for
+participants bulk-loaded from a registry file, so that `PeppolLookupService`
+can be exercised (and benchmarked) end to end without the PEPPOL network.
+
+Registry file (CSV, one participant per line, header optional):
+
+    scheme_id,participant_id,document_types,endpoint
+    0009,123456789,invoice_ubl|credit_note,https://ap.example.com/as4
+
+`document_types` are keys of `PEPPOL_DOCUMENT_TYPES` or full document type
+identifiers separated by `|`; empty means every known document type.
+`endpoint` defaults to `SMP_DEFAULT_ENDPOINT`.
+
+Environment:
+    SMP_REGISTRY          registry file to load at startup
+    SMP_DEFAULT_ENDPOINT  AS4 endpoint of participants without one
+    SMP_LATENCY           added latency in seconds
+    SMP_LATENCY_JITTER    random extra latency in seconds (uniform)
+    SMP_ERROR_RATE        fraction of requests answered 500
+    SMP_UNAVAILABLE_RATE  fraction of requests answered 503
+    SMP_CACHE_MAX_AGE     Cache-Control max-age of the answers
+    SMP_SEED              random seed of the fault injection
+"""
+
+import asyncio
+import csv
+import os
+import random
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Iterable, Optional
+from urllib.parse import quote
+from xml.sax.saxutils import escape, quoteattr
+
+from fastapi import FastAPI, Request, Response
+
+from pac0.service.routage.peppol import AS4_TRANSPORT_PROFILE, PEPPOL_DOCUMENT_TYPES
+
+PARTICIPANT_ID_SCHEME = "iso6523-actorid-upis"
+DEFAULT_ENDPOINT = "https://ap.example.com/as4"
+# base64 placeholder (decodable, not a real X.509 certificate)
+DEFAULT_CERTIFICATE = "cGFjMCBmYWtlIHNtcCBjZXJ0aWZpY2F0ZQ=="
+
+SMP_NS = "http://busdox.org/serviceMetadata/publishing/1.0/"
+IDS_NS = "http://busdox.org/transport/identifiers/1.0/"
+WSA_NS = "http://www.w3.org/2005/08/addressing"
+
+
+@dataclass
+class FaultConfig:
+    """Latency and error injection settings."""
+
+    latency: float = 0.0
+    latency_jitter: float = 0.0
+    error_rate: float = 0.0
+    unavailable_rate: float = 0.0
+    cache_max_age: int = 3600
+
+    @classmethod
+    def from_env(cls) -> "FaultConfig":
+        return cls(
+            latency=float(os.environ.get("SMP_LATENCY", "0")),
+            latency_jitter=float(os.environ.get("SMP_LATENCY_JITTER", "0")),
+            error_rate=float(os.environ.get("SMP_ERROR_RATE", "0")),
+            unavailable_rate=float(os.environ.get("SMP_UNAVAILABLE_RATE", "0")),
+            cache_max_age=int(os.environ.get("SMP_CACHE_MAX_AGE", "3600")),
+        )
+
+
+class SmpRegistry:
+    """In-memory participant registry of the SMP stand-in."""
+
+    def __init__(self, default_endpoint: str = DEFAULT_ENDPOINT):
+        self.default_endpoint = default_endpoint
+        # "scheme::participant" (lower case) -> (document types, endpoint)
+        self.participants: dict[str, tuple[frozenset[str], str]] = {}
+        # identical document type sets are shared between participants
+        self._document_type_sets: dict[frozenset[str], frozenset[str]] = {}
+
+    def __len__(self) -> int:
+        return len(self.participants)
+
+    @staticmethod
+    def key(scheme_id: str, participant_id: str) -> str:
+        return f"{scheme_id}::{participant_id}".lower()
+
+    def add(
+        self,
+        scheme_id: str,
+        participant_id: str,
+        document_types: Iterable[str] = (),
+        endpoint: Optional[str] = None,
+    ):
+        """Register a participant (every known document type by default)."""
+        doc_type_ids = frozenset(
+            PEPPOL_DOCUMENT_TYPES.get(doc_type, doc_type) for doc_type in document_types
+        ) or frozenset(PEPPOL_DOCUMENT_TYPES.values())
+        doc_type_ids = self._document_type_sets.setdefault(doc_type_ids, doc_type_ids)
+        self.participants[self.key(scheme_id, participant_id)] = (
+            doc_type_ids,
+            endpoint or self.default_endpoint,
+        )
+
+    def load(self, path: str | Path) -> int:
+        """
+        Load a CSV registry file.
+
+        Returns:
+            Number of participants loaded
+        """
+        count = 0
+        with open(path, newline="", encoding="utf-8") as f:
+            for row in csv.reader(f):
+                if not row or row[0] == "scheme_id" or row[0].startswith("#"):
+                    continue
+                scheme_id, participant_id, *rest = row
+                document_types = rest[0].split("|") if rest and rest[0] else ()
+                endpoint = rest[1] if len(rest) > 1 and rest[1] else None
+                self.add(scheme_id, participant_id, document_types, endpoint)
+                count += 1
+        return count
+
+    def get(self, participant_identifier: str) -> Optional[tuple[frozenset[str], str]]:
+        """
+        Find a participant from its URL identifier
+        ("iso6523-actorid-upis::0009::123456789" or "...::0009:123456789").
+        """
+        scheme, _, value = participant_identifier.partition("::")
+        if scheme.lower() != PARTICIPANT_ID_SCHEME or not value:
+            return None
+        scheme_id, sep, participant_id = value.partition("::")
+        if not sep:
+            scheme_id, _, participant_id = value.partition(":")
+        return self.participants.get(self.key(scheme_id, participant_id))
+
+
+def write_registry(
+    path: str | Path,
+    participants: Iterable[tuple[str, str]],
+    document_types: Iterable[str] = (),
+    endpoint: str = "",
+) -> int:
+    """
+    Write a CSV registry file for the SMP stand-in.
+
+    Args:
+        path: Registry file
+        participants: (scheme_id, participant_id) pairs
+        document_types: Document types of every participant (all if empty)
+        endpoint: AS4 endpoint of every participant (default if empty)
+
+    Returns:
+        Number of participants written
+    """
+    doc_types = "|".join(document_types)
+    count = 0
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["scheme_id", "participant_id", "document_types", "endpoint"])
+        for scheme_id, participant_id in participants:
+            writer.writerow([scheme_id, participant_id, doc_types, endpoint])
+            count += 1
+    return count
+
+
+def service_group_xml(base_url: str, participant_identifier: str, document_types) -> str:
+    """ServiceGroup document listing the participant's document types."""
+    services_url = f"{base_url}/{quote(participant_identifier, safe=':')}/services/"
+    references = "".join(
+        f"<ServiceMetadataReference href={quoteattr(services_url + quote(doc_type, safe=''))}/>"
+        for doc_type in sorted(document_types)
+    )
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        f'<ServiceGroup xmlns="{SMP_NS}" xmlns:ids="{IDS_NS}">'
+        f'<ids:ParticipantIdentifier scheme="{PARTICIPANT_ID_SCHEME}">'
+        f"{escape(participant_identifier.partition('::')[2])}</ids:ParticipantIdentifier>"
+        f"<ServiceMetadataReferenceCollection>{references}"
+        "</ServiceMetadataReferenceCollection></ServiceGroup>"
+    )
+
+
+def service_metadata_xml(
+    participant_identifier: str, document_type: str, endpoint: str
+) -> str:
+    """ServiceMetadata document with a single AS4 endpoint."""
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        f'<SignedServiceMetadata xmlns="{SMP_NS}" xmlns:ids="{IDS_NS}">'
+        "<ServiceMetadata><ServiceInformation>"
+        f'<ids:ParticipantIdentifier scheme="{PARTICIPANT_ID_SCHEME}">'
+        f"{escape(participant_identifier.partition('::')[2])}</ids:ParticipantIdentifier>"
+        f'<ids:DocumentIdentifier scheme="busdox-docid-qns">'
+        f"{escape(document_type)}</ids:DocumentIdentifier>"
+        "<ProcessList><Process><ServiceEndpointList>"
+        f'<Endpoint transportProfile="{AS4_TRANSPORT_PROFILE}">'
+        f'<EndpointReference xmlns="{WSA_NS}"><Address>{escape(endpoint)}</Address>'
+        "</EndpointReference>"
+        "<RequireBusinessLevelSignature>false</RequireBusinessLevelSignature>"
+        f"<Certificate>{DEFAULT_CERTIFICATE}</Certificate>"
+        "<ServiceDescription>pac0 fake SMP</ServiceDescription>"
+        "<TechnicalContactUrl>https://pdplibre.org</TechnicalContactUrl>"
+        "</Endpoint></ServiceEndpointList></Process></ProcessList>"
+        "</ServiceInformation></ServiceMetadata></SignedServiceMetadata>"
+    )
+
+
+def create_app(
+    registry: Optional[SmpRegistry] = None,
+    faults: Optional[FaultConfig] = None,
+    seed: Optional[int] = None,
+) -> FastAPI:
+    """Build the SMP stand-in application."""
+    app = FastAPI()
+    app.state.registry = registry if registry is not None else SmpRegistry()
+    app.state.faults = faults or FaultConfig()
+    app.state.random = random.Random(seed)
+    app.state.requests = 0
+
+    async def inject_faults(request: Request) -> Optional[Response]:
+        """Apply latency and draw an injected error for this request."""
+        faults: FaultConfig = request.app.state.faults
+        rnd: random.Random = request.app.state.random
+        request.app.state.requests += 1
+        delay = faults.latency + faults.latency_jitter * rnd.random()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        draw = rnd.random()
+        if draw < faults.unavailable_rate:
+            return Response(status_code=503)
+        if draw < faults.unavailable_rate + faults.error_rate:
+            return Response(status_code=500)
+        return None
+
+    def xml_response(request: Request, content: str) -> Response:
+        faults: FaultConfig = request.app.state.faults
+        return Response(
+            content=content,
+            media_type="application/xml",
+            headers={"Cache-Control": f"max-age={faults.cache_max_age}"},
+        )
+
+    @app.get("/healthcheck")
+    async def healthcheck(request: Request):
+        return {
+            "status": "OK",
+            "participants": len(request.app.state.registry),
+            "requests": request.app.state.requests,
+        }
+
+    @app.get("/_admin/faults")
+    async def get_faults(request: Request):
+        return asdict(request.app.state.faults)
+
+    @app.put("/_admin/faults")
+    async def set_faults(request: Request, faults: FaultConfig):
+        request.app.state.faults = faults
+        return asdict(faults)
+
+    @app.get("/{participant_identifier}/services/{document_type:path}")
+    async def service_metadata(
+        request: Request, participant_identifier: str, document_type: str
+    ):
+        if (error := await inject_faults(request)) is not None:
+            return error
+        participant = request.app.state.registry.get(participant_identifier)
+        if participant is None or document_type not in participant[0]:
+            return Response(status_code=404)
+        return xml_response(
+            request,
+            service_metadata_xml(participant_identifier, document_type, participant[1]),
+        )
+
+    @app.get("/{participant_identifier}")
+    async def service_group(request: Request, participant_identifier: str):
+        if (error := await inject_faults(request)) is not None:
+            return error
+        participant = request.app.state.registry.get(participant_identifier)
+        if participant is None:
+            return Response(status_code=404)
+        base_url = str(request.base_url).rstrip("/")
+        return xml_response(
+            request,
+            service_group_xml(base_url, participant_identifier, participant[0]),
+        )
+
+    return app
+
+
+def app_from_env() -> FastAPI:
+    """Application configured from the environment (see module docstring)."""
+    registry = SmpRegistry(os.environ.get("SMP_DEFAULT_ENDPOINT", DEFAULT_ENDPOINT))
+    if path := os.environ.get("SMP_REGISTRY"):
+        registry.load(path)
+    seed = os.environ.get("SMP_SEED")
+    return create_app(registry, FaultConfig.from_env(), int(seed) if seed else None)
+
+
+app = app_from_env()
@@ -0,0 +1,121 @@
+# SPDX-FileCopyrightText: 2026 Philippe ENTZMANN <philippe@entzmann.name>
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+"""
+Local PPF stand-in.
+
+Accepts the gzip-compressed invoice batches sent by `PpfSubmitter` (routage)
+and answers with one result per invoice, so that the PPF fallback can be
+exercised without the real platform.
+
+An invoice is rejected when its payload is empty, or at random with
+`PPF_REJECT_RATE`.
+
+Environment:
+    PPF_LATENCY          added latency per batch in seconds
+    PPF_REJECT_RATE      fraction of invoices rejected
+    PPF_UNAVAILABLE_RATE fraction of batches answered 503
+    PPF_SEED             random seed of the fault injection
+"""
+
+import asyncio
+import gzip
+import json
+import os
+import random
+from dataclasses import asdict, dataclass
+from typing import Optional
+
+from fastapi import FastAPI, Request, Response
+
+from pac0.service.routage.ppf import PPF_BATCH_PATH
+
+
+@dataclass
+class FaultConfig:
+    """Latency and error injection settings."""
+
+    latency: float = 0.0
+    reject_rate: float = 0.0
+    unavailable_rate: float = 0.0
+
+    @classmethod
+    def from_env(cls) -> "FaultConfig":
+        return cls(
+            latency=float(os.environ.get("PPF_LATENCY", "0")),
+            reject_rate=float(os.environ.get("PPF_REJECT_RATE", "0")),
+            unavailable_rate=float(os.environ.get("PPF_UNAVAILABLE_RATE", "0")),
+        )
+
+
+def create_app(faults: Optional[FaultConfig] = None, seed: Optional[int] = None) -> FastAPI:
+    """Build the PPF stand-in application."""
+    app = FastAPI()
+    app.state.faults = faults or FaultConfig()
+    app.state.random = random.Random(seed)
+    # accepted invoices and received batches (batch_id, invoice count, body size)
+    app.state.invoices = []
+    app.state.batches = []
+
+    @app.get("/healthcheck")
+    async def healthcheck(request: Request):
+        return {
+            "status": "OK",
+            "batches": len(request.app.state.batches),
+            "invoices": len(request.app.state.invoices),
+        }
+
+    @app.get("/_admin/faults")
+    async def get_faults(request: Request):
+        return asdict(request.app.state.faults)
+
+    @app.put("/_admin/faults")
+    async def set_faults(request: Request, faults: FaultConfig):
+        request.app.state.faults = faults
+        return asdict(faults)
+
+    @app.post(PPF_BATCH_PATH)
+    async def submit_batch(request: Request):
+        faults: FaultConfig = request.app.state.faults
+        rnd: random.Random = request.app.state.random
+        if faults.latency > 0:
+            await asyncio.sleep(faults.latency)
+        if rnd.random() < faults.unavailable_rate:
+            return Response(status_code=503)
+
+        body = await request.body()
+        try:
+            if request.headers.get("content-encoding") == "gzip":
+                body = gzip.decompress(body)
+            batch = json.loads(body)
+            invoices = batch["invoices"]
+        except (OSError, ValueError, KeyError):
+            return Response(status_code=400)
+
+        request.app.state.batches.append((batch.get("batch_id"), len(invoices), len(body)))
+        results = []
+        for invoice in invoices:
+            if not invoice.get("payload"):
+                error = "empty payload"
+            elif rnd.random() < faults.reject_rate:
+                error = "injected rejection"
+            else:
+                error = None
+            if error is not None:
+                results.append({"ref": invoice["ref"], "status": "rejected", "error": error})
+            else:
+                request.app.state.invoices.append(invoice)
+                results.append({"ref": invoice["ref"], "status": "accepted"})
+        return {"batch_id": batch.get("batch_id"), "results": results}
+
+    return app
+
+
+def app_from_env() -> FastAPI:
+    """Application configured from the environment (see module docstring)."""
+    seed = os.environ.get("PPF_SEED")
+    return create_app(FaultConfig.from_env(), int(seed) if seed else None)
+
+
+app = app_from_env()
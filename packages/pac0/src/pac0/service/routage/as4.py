@@ -0,0 +1,444 @@
+# SPDX-FileCopyrightText: 2026 Philippe ENTZMANN <philippe@entzmann.name>
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+"""
+Transmission AS4 sortante vers les Access Points (AP) PEPPOL.
+
+- un pool de connexions keep-alive par AP destinataire: les envois successifs
+  vers une même PA réutilisent leurs connexions TLS
+- la préparation du message (compression, empreinte, signature, chiffrement)
+  est faite dans un pool de threads ou de processus: la boucle d'événements
+  reste libre pour les autres factures
+- le certificat d'un partenaire (`PeppolEndpoint.certificate`) n'est décodé
+  qu'une fois, puis réutilisé
+
+La signature et le chiffrement WS-Security sont confiés à une fonction
+`security` (voir `As4Security`), appelée dans le pool avec le message préparé
+et le certificat décodé du destinataire. Sans elle, `As4Transmitter` refuse
+d'envoyer, sauf autorisation explicite (`allow_plaintext`, tests et
+développement uniquement).
+"""
+
+import asyncio
+import base64
+import binascii
+import email.parser
+import email.policy
+import gzip
+import hashlib
+import importlib
+import uuid
+import xml.etree.ElementTree as ET
+from collections import OrderedDict
+from concurrent.futures import Executor
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from functools import lru_cache, partial
+from typing import Any, Callable, Optional, Self
+from urllib.parse import urlsplit
+from xml.sax.saxutils import escape, quoteattr
+
+import httpx
+
+from .models import AS4TransmissionResult, InvoiceMessage
+from .peppol import PEPPOL_DOCUMENT_TYPES, PeppolEndpoint, participant_key
+
+SOAP_NS = "http://www.w3.org/2003/05/soap-envelope"
+EBMS_NS = "http://docs.oasis-open.org/ebxml-msg/ebms/v3.0/ns/core/200704/"
+
+PARTICIPANT_ID_SCHEME = "iso6523-actorid-upis"
+AP_PARTY_TYPE = "urn:fdc:peppol.eu:2017:identifiers:ap"
+PEPPOL_AGREEMENT = "urn:fdc:peppol.eu:2017:agreements:tia:ap_provider"
+PEPPOL_BILLING_PROCESS = "urn:fdc:peppol.eu:2017:poacc:billing:01:1.0"
+PEPPOL_PROCESS_SCHEME = "cenbii-procid-ubl"
+ROLE_INITIATOR = "http://docs.oasis-open.org/ebxml-msg/ebms/v3.0/ns/core/200704/initiator"
+ROLE_RESPONDER = "http://docs.oasis-open.org/ebxml-msg/ebms/v3.0/ns/core/200704/responder"
+
+# Nombre de certificats partenaires décodés gardés en mémoire
+CERTIFICATE_CACHE_SIZE = 10_000
+
+
+@dataclass(frozen=True)
+class PartnerCertificate:
+    """Certificat X.509 d'un AP partenaire, décodé depuis le SMP."""
+
+    der: bytes
+    # SHA-256 du certificat (hexadécimal)
+    fingerprint: str
+
+
+@lru_cache(maxsize=CERTIFICATE_CACHE_SIZE)
+def parse_certificate(certificate: str) -> PartnerCertificate:
+    """
+    Décode le certificat publié par le SMP (base64, avec ou sans en-têtes PEM).
+
+    Le résultat est mis en cache: un même partenaire n'est décodé qu'une fois.
+
+    Raises:
+        ValueError: si le certificat n'est pas du base64 valide
+    """
+    body = "".join(
+        line for line in certificate.strip().splitlines() if not line.startswith("-----")
+    )
+    try:
+        der = base64.b64decode("".join(body.split()), validate=True)
+    except binascii.Error as e:
+        raise ValueError(f"Certificat invalide: {e}") from e
+    if not der:
+        raise ValueError("Certificat vide")
+    return PartnerCertificate(der=der, fingerprint=hashlib.sha256(der).hexdigest())
+
+
+@lru_cache(maxsize=CERTIFICATE_CACHE_SIZE)
+def load_x509(der: bytes) -> Any:
+    """
+    Charge un certificat DER avec `cryptography` (dépendance optionnelle),
+    pour les implémentations de `As4Security`.
+
+    Raises:
+        ImportError: si `cryptography` n'est pas installé
+    """
+    from cryptography import x509
+
+    return x509.load_der_x509_certificate(der)
+
+
+@dataclass(frozen=True)
+class As4Message:
+    """Message AS4 prêt à l'envoi (enveloppe SOAP + pièce jointe)."""
+
+    message_id: str
+    envelope: bytes
+    # charge utile compressée (gzip), éventuellement chiffrée
+    payload: bytes
+    # SHA-256 de `payload` (base64), référencé par la signature
+    payload_digest: str
+    content_id: str
+
+    def body(self) -> tuple[bytes, str]:
+        """Corps MIME multipart/related et son Content-Type."""
+        boundary = f"----=_Part_{self.message_id}"
+        body = b"".join(
+            [
+                f"--{boundary}\r\n"
+                "Content-Type: application/soap+xml; charset=UTF-8\r\n"
+                "Content-Transfer-Encoding: binary\r\n\r\n".encode(),
+                self.envelope,
+                f"\r\n--{boundary}\r\n"
+                "Content-Type: application/octet-stream\r\n"
+                "Content-Transfer-Encoding: binary\r\n"
+                f"Content-ID: <{self.content_id}>\r\n\r\n".encode(),
+                self.payload,
+                f"\r\n--{boundary}--\r\n".encode(),
+            ]
+        )
+        content_type = (
+            f'multipart/related; boundary="{boundary}"; '
+            'type="application/soap+xml"; start-info="application/soap+xml"'
+        )
+        return body, content_type
+
+
+# Signature / chiffrement: (message préparé, certificat du destinataire) -> message
+# Doit être picklable (fonction de module) avec un pool de processus.
+As4Security = Callable[[As4Message, PartnerCertificate], As4Message]
+
+
+def load_security(path: str) -> As4Security:
+    """Fonction `security` désignée par "module:fonction" (ex: AS4_SECURITY)."""
+    module, _, name = path.partition(":")
+    if not name:
+        raise ValueError(f"As4Security attendue sous la forme module:fonction: {path}")
+    return getattr(importlib.import_module(module), name)
+
+
+def _party_id(participant: str) -> str:
+    scheme_id, participant_id = participant_key(participant)
+    return f"{scheme_id}:{participant_id}"
+
+
+def build_message(
+    message: InvoiceMessage,
+    sender_ap: str,
+    receiver_ap: str,
+    certificate: PartnerCertificate,
+    security: Optional[As4Security] = None,
+    message_id: Optional[str] = None,
+) -> As4Message:
+    """
+    Prépare le message AS4 d'une facture (travail CPU, exécuté dans le pool).
+
+    Args:
+        message: Facture à transmettre
+        sender_ap: Identifiant PEPPOL de l'AP émetteur (notre PA)
+        receiver_ap: Identifiant de l'AP destinataire (empreinte du certificat)
+        certificate: Certificat décodé de l'AP destinataire
+        security: Signature / chiffrement du message (None: message en clair)
+        message_id: Identifiant ebMS (généré si absent)
+    """
+    message_id = message_id or f"{uuid.uuid4()}@pac0"
+    content_id = f"{message.invoice_id}@pac0"
+    payload = gzip.compress(message.payload, compresslevel=6)
+    document_type = PEPPOL_DOCUMENT_TYPES.get(message.document_type, message.document_type)
+    doc_scheme, _, doc_value = document_type.partition("::")
+    sender = _party_id(message.sender_siret or message.sender_siren)
+    recipient = _party_id(message.recipient_siret or message.recipient_siren)
+    timestamp = datetime.now(timezone.utc).isoformat(timespec="milliseconds")
+
+    envelope = (
+        f'<env:Envelope xmlns:env="{SOAP_NS}" xmlns:eb="{EBMS_NS}">'
+        '<env:Header><eb:Messaging env:mustUnderstand="true"><eb:UserMessage>'
+        f"<eb:MessageInfo><eb:Timestamp>{timestamp}</eb:Timestamp>"
+        f"<eb:MessageId>{escape(message_id)}</eb:MessageId></eb:MessageInfo>"
+        "<eb:PartyInfo>"
+        f'<eb:From><eb:PartyId type="{AP_PARTY_TYPE}">{escape(sender_ap)}</eb:PartyId>'
+        f"<eb:Role>{ROLE_INITIATOR}</eb:Role></eb:From>"
+        f'<eb:To><eb:PartyId type="{AP_PARTY_TYPE}">{escape(receiver_ap)}</eb:PartyId>'
+        f"<eb:Role>{ROLE_RESPONDER}</eb:Role></eb:To>"
+        "</eb:PartyInfo>"
+        f"<eb:CollaborationInfo><eb:AgreementRef>{PEPPOL_AGREEMENT}</eb:AgreementRef>"
+        f'<eb:Service type="{PEPPOL_PROCESS_SCHEME}">{PEPPOL_BILLING_PROCESS}</eb:Service>'
+        f"<eb:Action>{escape(doc_value)}</eb:Action>"
+        f"<eb:ConversationId>{escape(message.invoice_id)}</eb:ConversationId>"
+        "</eb:CollaborationInfo>"
+        "<eb:MessageProperties>"
+        f'<eb:Property name="originalSender" type="{PARTICIPANT_ID_SCHEME}">'
+        f"{escape(sender)}</eb:Property>"
+        f'<eb:Property name="finalRecipient" type="{PARTICIPANT_ID_SCHEME}">'
+        f"{escape(recipient)}</eb:Property>"
+        "</eb:MessageProperties>"
+        f"<eb:PayloadInfo><eb:PartInfo href={quoteattr('cid:' + content_id)}>"
+        "<eb:PartProperties>"
+        '<eb:Property name="CompressionType">application/gzip</eb:Property>'
+        '<eb:Property name="MimeType">application/xml</eb:Property>'
+        f'<eb:Property name="DocumentType" type="{escape(doc_scheme)}">'
+        f"{escape(doc_value)}</eb:Property>"
+        "</eb:PartProperties></eb:PartInfo></eb:PayloadInfo>"
+        "</eb:UserMessage></eb:Messaging></env:Header><env:Body/></env:Envelope>"
+    ).encode()
+
+    as4_message = As4Message(
+        message_id=message_id,
+        envelope=envelope,
+        payload=payload,
+        payload_digest=base64.b64encode(hashlib.sha256(payload).digest()).decode(),
+        content_id=content_id,
+    )
+    if security is not None:
+        as4_message = security(as4_message, certificate)
+    return as4_message
+
+
+def parse_receipt(content: bytes, message_id: str) -> AS4TransmissionResult:
+    """Interprète la réponse synchrone (signal ebMS) de l'AP destinataire."""
+    try:
+        root = ET.fromstring(content)
+    except ET.ParseError as e:
+        return AS4TransmissionResult(
+            success=False, message_id=message_id, error_message=f"Réponse invalide: {e}"
+        )
+
+    signal = root.find(f".//{{{EBMS_NS}}}SignalMessage")
+    if signal is None:
+        return AS4TransmissionResult(
+            success=False, message_id=message_id, error_message="Signal ebMS absent"
+        )
+
+    error = signal.find(f"{{{EBMS_NS}}}Error")
+    if error is not None:
+        description = error.findtext(f"{{{EBMS_NS}}}Description") or ""
+        code = error.get("errorCode", "")
+        return AS4TransmissionResult(
+            success=False,
+            message_id=message_id,
+            error_message=f"{code} {description}".strip(),
+        )
+
+    ref = signal.findtext(f"{{{EBMS_NS}}}MessageInfo/{{{EBMS_NS}}}RefToMessageId")
+    if signal.find(f"{{{EBMS_NS}}}Receipt") is None or ref != message_id:
+        return AS4TransmissionResult(
+            success=False, message_id=message_id, error_message="Accusé de réception invalide"
+        )
+    return AS4TransmissionResult(success=True, message_id=message_id)
+
+
+class As4Transmitter:
+    """Envoi AS4 avec un pool de connexions par AP et préparation hors boucle."""
+
+    def __init__(
+        self,
+        sender_ap: str,
+        timeout: float = 30.0,
+        max_connections_per_ap: int = 10,
+        keepalive_expiry: float = 60.0,
+        max_access_points: int = 1000,
+        executor: Optional[Executor] = None,
+        security: Optional[As4Security] = None,
+        allow_plaintext: bool = False,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ):
+        """
+        Args:
+            sender_ap: Identifiant PEPPOL de notre AP (ex: "POP000123")
+            timeout: Timeout d'un envoi en secondes
+            max_connections_per_ap: Connexions simultanées vers un même AP
+            keepalive_expiry: Durée de conservation d'une connexion inactive
+            max_access_points: Nombre d'AP gardant un pool ouvert (les moins
+                récemment utilisés sont fermés au-delà)
+            executor: Pool de threads ou de processus préparant les messages
+                (None: pool de threads par défaut de la boucle)
+            security: Signature / chiffrement des messages (obligatoire)
+            allow_plaintext: Autorise l'envoi sans `security`, messages ni
+                signés ni chiffrés (tests et développement uniquement)
+            transport: Transport HTTP (pour les tests)
+
+        Raises:
+            ValueError: ni `security` ni `allow_plaintext`
+        """
+        if security is None and not allow_plaintext:
+            raise ValueError(
+                "Transmission AS4 refusée sans signature ni chiffrement: "
+                "configurer `security` (AS4_SECURITY)"
+            )
+        self.sender_ap = sender_ap
+        self.timeout = timeout
+        self.max_connections_per_ap = max_connections_per_ap
+        self.keepalive_expiry = keepalive_expiry
+        self.max_access_points = max_access_points
+        self.executor = executor
+        self.security = security
+        self._transport = transport
+        # origine de l'AP -> client HTTP (pool keep-alive), ordre LRU
+        self._clients: OrderedDict[str, httpx.AsyncClient] = OrderedDict()
+        self._closing: set[asyncio.Task] = set()
+
+    async def start(self) -> Self:
+        """Rien à ouvrir d'avance: les pools sont créés au premier envoi vers un AP."""
+        return self
+
+    async def close(self):
+        """Ferme les pools de connexions vers les AP."""
+        clients = list(self._clients.values())
+        self._clients.clear()
+        await asyncio.gather(*(client.aclose() for client in clients), *self._closing)
+
+    async def __aenter__(self) -> Self:
+        return await self.start()
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb) -> None:
+        await self.close()
+
+    def _client(self, address: str) -> httpx.AsyncClient:
+        """Retourne le client HTTP (pool keep-alive) de l'AP d'une adresse."""
+        parts = urlsplit(address)
+        origin = f"{parts.scheme}://{parts.netloc}"
+        client = self._clients.get(origin)
+        if client is not None:
+            self._clients.move_to_end(origin)
+            return client
+
+        client = httpx.AsyncClient(
+            timeout=self.timeout,
+            transport=self._transport,
+            limits=httpx.Limits(
+                max_connections=self.max_connections_per_ap,
+                max_keepalive_connections=self.max_connections_per_ap,
+                keepalive_expiry=self.keepalive_expiry,
+            ),
+        )
+        self._clients[origin] = client
+        if len(self._clients) > self.max_access_points:
+            _, evicted = self._clients.popitem(last=False)
+            task = asyncio.create_task(evicted.aclose())
+            self._closing.add(task)
+            task.add_done_callback(self._closing.discard)
+        return client
+
+    async def prepare(
+        self, message: InvoiceMessage, endpoint: PeppolEndpoint
+    ) -> As4Message:
+        """Prépare le message AS4 dans le pool (compression, signature, chiffrement)."""
+        certificate = parse_certificate(endpoint.certificate)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.executor,
+            partial(
+                build_message,
+                message,
+                self.sender_ap,
+                certificate.fingerprint,
+                certificate,
+                self.security,
+            ),
+        )
+
+    async def send(
+        self, message: InvoiceMessage, endpoint: PeppolEndpoint
+    ) -> AS4TransmissionResult:
+        """
+        Transmet une facture à l'AP destinataire.
+
+        Returns:
+            AS4TransmissionResult (success=False en cas d'erreur, jamais d'exception)
+        """
+        try:
+            as4_message = await self.prepare(message, endpoint)
+        except ValueError as e:
+            return AS4TransmissionResult(success=False, error_message=str(e))
+
+        body, content_type = as4_message.body()
+        try:
+            response = await self._client(endpoint.address).post(
+                endpoint.address,
+                content=body,
+                headers={"Content-Type": content_type, "SOAPAction": '""'},
+            )
+        except httpx.TimeoutException:
+            return AS4TransmissionResult(
+                success=False,
+                message_id=as4_message.message_id,
+                error_message=f"Timeout AS4 ({self.timeout}s)",
+                retryable=True,
+            )
+        except httpx.HTTPError as e:
+            return AS4TransmissionResult(
+                success=False,
+                message_id=as4_message.message_id,
+                error_message=f"Erreur AS4: {e}",
+                retryable=True,
+            )
+
+        if response.status_code != 200:
+            return AS4TransmissionResult(
+                success=False,
+                message_id=as4_message.message_id,
+                error_message=f"HTTP {response.status_code}",
+                # 4xx: message refusé, un réessai aurait le même sort
+                retryable=response.status_code >= 500 or response.status_code == 429,
+            )
+        return parse_receipt(response.content, as4_message.message_id)
+
+
+def parse_multipart(body: bytes, content_type: str) -> tuple[bytes, dict[str, bytes]]:
+    """
+    Sépare un message AS4 reçu en (enveloppe SOAP, pièces jointes par Content-ID).
+
+    Utilisé par le récepteur AS4 de test (`service/as4_fake`).
+    """
+    parsed = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+        f"Content-Type: {content_type}\r\n\r\n".encode() + body
+    )
+    if not parsed.is_multipart():
+        raise ValueError("Message AS4 non multipart")
+    envelope = b""
+    attachments: dict[str, bytes] = {}
+    for part in parsed.iter_parts():
+        content = part.get_payload(decode=True)
+        content_id = part.get("Content-ID")
+        if content_id is None:
+            envelope = content
+        else:
+            attachments[content_id.strip("<>")] = content
+    return envelope, attachments
+
@@ -0,0 +1,158 @@
+# SPDX-FileCopyrightText: 2026 Philippe ENTZMANN <philippe@entzmann.name>
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+"""
+Suivi de santé des SMP: disjoncteur (circuit breaker) et timeouts adaptatifs.
+
+Chaque hôte SMP a son propre disjoncteur:
+- CLOSED: les requêtes passent, les échecs consécutifs sont comptés
+- OPEN: après `failure_threshold` échecs, les requêtes sont refusées
+  pendant `reset_timeout` secondes
+- HALF_OPEN: une seule requête de test est autorisée; son succès referme
+  le disjoncteur, son échec le rouvre
+
+Les latences observées servent à calculer un timeout par hôte et le délai
+après lequel une requête de secours (hedged request) peut être lancée.
+"""
+
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from enum import Enum
+from typing import Callable, Optional
+
+
+class CircuitState(str, Enum):
+    """États d'un disjoncteur."""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+
+@dataclass
+class SmpHealth:
+    """État de santé d'un hôte SMP."""
+
+    host: str
+    state: CircuitState = CircuitState.CLOSED
+    consecutive_failures: int = 0
+    opened_at: float = 0.0
+    probe_in_flight: bool = False
+    latencies: deque = field(default_factory=deque)
+
+    def percentile(self, p: float) -> Optional[float]:
+        """Percentile `p` (0-100) des latences observées, None si aucune."""
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        index = min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))
+        return ordered[index]
+
+
+class SmpHealthTracker:
+    """Disjoncteurs et statistiques de latence, par hôte SMP."""
+
+    def __init__(
+        self,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30.0,
+        latency_window: int = 100,
+        min_samples: int = 10,
+        timeout_factor: float = 3.0,
+        min_timeout: float = 1.0,
+        max_timeout: float = 30.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        """
+        Args:
+            failure_threshold: Échecs consécutifs ouvrant le disjoncteur
+            reset_timeout: Durée d'ouverture avant une requête de test
+            latency_window: Nombre de latences conservées par hôte
+            min_samples: Nombre de latences nécessaires pour adapter le timeout
+            timeout_factor: Timeout = p99 des latences x ce facteur
+            min_timeout: Timeout minimal en secondes
+            max_timeout: Timeout maximal (et par défaut) en secondes
+            clock: Horloge monotone (injectable pour les tests)
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.latency_window = latency_window
+        self.min_samples = min_samples
+        self.timeout_factor = timeout_factor
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self._clock = clock
+        self._hosts: dict[str, SmpHealth] = {}
+
+    def get(self, host: str) -> SmpHealth:
+        """Retourne l'état de santé d'un hôte (créé au premier appel)."""
+        health = self._hosts.get(host)
+        if health is None:
+            health = SmpHealth(host=host, latencies=deque(maxlen=self.latency_window))
+            self._hosts[host] = health
+        return health
+
+    def state(self, host: str) -> CircuitState:
+        """Retourne l'état du disjoncteur d'un hôte."""
+        return self.get(host).state
+
+    def allow(self, host: str) -> bool:
+        """
+        Indique si une requête vers `host` peut être envoyée.
+
+        Un disjoncteur ouvert depuis plus de `reset_timeout` passe à
+        HALF_OPEN et laisse passer une unique requête de test.
+        """
+        health = self.get(host)
+        if health.state == CircuitState.CLOSED:
+            return True
+        if health.state == CircuitState.OPEN:
+            if self._clock() - health.opened_at < self.reset_timeout:
+                return False
+            health.state = CircuitState.HALF_OPEN
+            health.probe_in_flight = False
+        if health.probe_in_flight:
+            return False
+        health.probe_in_flight = True
+        return True
+
+    def record_success(self, host: str, latency: float):
+        """Enregistre une réponse du SMP (referme le disjoncteur)."""
+        health = self.get(host)
+        health.latencies.append(latency)
+        health.consecutive_failures = 0
+        health.probe_in_flight = False
+        health.state = CircuitState.CLOSED
+
+    def record_failure(self, host: str):
+        """Enregistre un échec (timeout, 5xx, erreur réseau)."""
+        health = self.get(host)
+        health.consecutive_failures += 1
+        health.probe_in_flight = False
+        if (
+            health.state == CircuitState.HALF_OPEN
+            or health.consecutive_failures >= self.failure_threshold
+        ):
+            health.state = CircuitState.OPEN
+            health.opened_at = self._clock()
+
+    def release(self, host: str):
+        """Libère la requête de test d'un hôte (requête annulée sans résultat)."""
+        self.get(host).probe_in_flight = False
+
+    def timeout_for(self, host: str) -> float:
+        """Timeout adapté aux latences observées de l'hôte."""
+        health = self.get(host)
+        if len(health.latencies) < self.min_samples:
+            return self.max_timeout
+        timeout = health.percentile(99) * self.timeout_factor
+        return max(self.min_timeout, min(timeout, self.max_timeout))
+
+    def hedge_delay(self, host: str) -> Optional[float]:
+        """Délai (p95) avant une requête de secours, None si trop peu de mesures."""
+        health = self.get(host)
+        if len(health.latencies) < self.min_samples:
+            return None
+        return health.percentile(95)
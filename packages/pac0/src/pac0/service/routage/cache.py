@@ -0,0 +1,154 @@
+# SPDX-FileCopyrightText: 2026 Philippe ENTZMANN <philippe@entzmann.name>
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+"""
+Cache LRU borné avec expiration par entrée.
+
+Utilisé par le service de découverte PEPPOL pour mémoriser les
+résolutions SML (hostname -> URL SMP) et les réponses SMP
+((participant, document type) -> résultat).
+"""
+
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Hashable, Optional
+
+
+@dataclass
+class CacheStats:
+    """Compteurs d'utilisation d'un cache."""
+
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    expirations: int = 0
+    size: int = 0
+    maxsize: int = 0
+
+    @property
+    def hit_ratio(self) -> float:
+        """Proportion de lectures servies depuis le cache."""
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+class TTLCache:
+    """
+    Cache LRU borné dont chaque entrée porte sa propre date d'expiration.
+
+    Les entrées expirées sont supprimées à la lecture. Lorsque le cache est
+    plein, l'entrée la moins récemment utilisée est évincée.
+    Un cache de taille 0 est désactivé (aucune entrée n'est conservée).
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 10_000,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        """
+        Initialise le cache.
+
+        Args:
+            maxsize: Nombre maximal d'entrées (0 pour désactiver le cache)
+            clock: Horloge monotone en secondes (injectable pour les tests)
+        """
+        self.maxsize = maxsize
+        self._clock = clock
+        self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._stats = CacheStats(maxsize=maxsize)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        item = self._data.get(key)
+        return item is not None and item[0] > self._clock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """
+        Retourne la valeur associée à `key` si elle est présente et valide.
+
+        Args:
+            key: Clé recherchée
+            default: Valeur retournée en cas d'absence ou d'expiration
+
+        Returns:
+            La valeur en cache ou `default`
+        """
+        item = self._data.get(key)
+        if item is None:
+            self._stats.misses += 1
+            return default
+
+        expires_at, value = item
+        if expires_at <= self._clock():
+            del self._data[key]
+            self._stats.expirations += 1
+            self._stats.misses += 1
+            return default
+
+        self._data.move_to_end(key)
+        self._stats.hits += 1
+        return value
+
+    def peek(self, key: Hashable, default: Any = None) -> Any:
+        """
+        Comme `get`, sans modifier l'ordre LRU ni les compteurs.
+        """
+        item = self._data.get(key)
+        if item is None or item[0] <= self._clock():
+            return default
+        return item[1]
+
+    def set(self, key: Hashable, value: Any, ttl: float) -> None:
+        """
+        Ajoute ou remplace une entrée.
+
+        Args:
+            key: Clé
+            value: Valeur à mémoriser
+            ttl: Durée de validité en secondes (<= 0: l'entrée n'est pas stockée)
+        """
+        if self.maxsize <= 0 or ttl <= 0:
+            return
+
+        self._data[key] = (self._clock() + ttl, value)
+        self._data.move_to_end(key)
+
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self._stats.evictions += 1
+
+    def expires_at(self, key: Hashable) -> Optional[float]:
+        """Retourne la date d'expiration (horloge du cache) d'une entrée."""
+        item = self._data.get(key)
+        return item[0] if item is not None else None
+
+    def invalidate(self, key: Hashable) -> None:
+        """Supprime une entrée si elle existe."""
+        self._data.pop(key, None)
+
+    def invalidate_where(self, predicate: Callable[[Hashable], bool]) -> int:
+        """Supprime les entrées dont la clé vérifie `predicate`; retourne leur nombre."""
+        keys = [key for key in self._data if predicate(key)]
+        for key in keys:
+            del self._data[key]
+        return len(keys)
+
+    def clear(self) -> None:
+        """Vide le cache (les compteurs sont conservés)."""
+        self._data.clear()
+
+    def stats(self) -> CacheStats:
+        """Retourne une copie des compteurs d'utilisation."""
+        return CacheStats(
+            hits=self._stats.hits,
+            misses=self._stats.misses,
+            evictions=self._stats.evictions,
+            expirations=self._stats.expirations,
+            size=len(self._data),
+            maxsize=self.maxsize,
+        )
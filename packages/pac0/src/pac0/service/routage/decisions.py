@@ -0,0 +1,249 @@
+# SPDX-FileCopyrightText: 2026 Philippe ENTZMANN <philippe@entzmann.name>
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+"""
+Cache des décisions de routage partagé entre les répliques.
+
+Une décision est le résultat de lookup qui détermine la route d'une facture
+pour un (destinataire, document type): endpoint PEPPOL (ROUTED) ou
+participant absent du SML (ROUTED_TO_PPF). Les autres résultats (erreurs
+transitoires, document type non supporté, ...) ne sont pas mémorisés.
+
+Les décisions sont stockées dans un bucket NATS KV, partagé par toutes les
+répliques de routage, avec une couche locale en lecture (TTLCache) de courte
+durée. Chaque réplique surveille le bucket: une décision modifiée ou
+supprimée par une autre réplique est retirée de sa couche locale.
+
+Clés: `<siren>.<nic>.<document type>`, le NIC étant `_` pour un destinataire
+désigné par son SIREN et le document type encodé en base64 URL. Invalider
+un SIREN invalide aussi ses SIRET.
+"""
+
+import asyncio
+import base64
+import json
+import logging
+import time
+from dataclasses import asdict, dataclass
+from typing import Any, Awaitable, Callable, Optional
+
+from nats.errors import Error as NatsError
+from nats.js.errors import KeyDeletedError, KeyNotFoundError, NoKeysError
+
+from .cache import TTLCache
+from .peppol import PeppolLookupResult, lookup_result_from_dict
+
+logger = logging.getLogger(__name__)
+
+# Bucket NATS KV par défaut des décisions
+DEFAULT_BUCKET = "pac0-routage-decisions"
+
+_MISSING = object()
+
+
+@dataclass
+class DecisionStats:
+    """Compteurs du cache des décisions."""
+
+    local_hits: int = 0
+    shared_hits: int = 0
+    misses: int = 0
+    stores: int = 0
+    invalidations: int = 0
+    errors: int = 0
+
+
+def is_decision(result: PeppolLookupResult) -> bool:
+    """Un résultat de lookup qui fixe la route (PEPPOL ou fallback PPF)."""
+    return (result.success and result.endpoint is not None) or (
+        result.error_code == "PARTICIPANT_NOT_FOUND"
+    )
+
+
+def _recipient_subject(recipient: str) -> str:
+    recipient = recipient.strip()
+    siren, nic = recipient[:9], recipient[9:]
+    return f"{siren}.{nic or '_'}"
+
+
+def decision_key(recipient: str, document_type: str) -> str:
+    """Clé KV d'une décision (SIREN ou SIRET, document type)."""
+    encoded = base64.urlsafe_b64encode(document_type.encode()).decode().rstrip("=")
+    return f"{_recipient_subject(recipient)}.{encoded}"
+
+
+def key_recipient(key: str) -> str:
+    """Destinataire (SIREN ou SIRET) d'une clé KV."""
+    siren, nic, _ = key.split(".", 2)
+    return siren if nic == "_" else siren + nic
+
+
+class RoutingDecisionCache:
+    """Décisions de routage en NATS KV, avec une couche locale en lecture."""
+
+    def __init__(
+        self,
+        broker: Any = None,
+        bucket: str = DEFAULT_BUCKET,
+        ttl: float = 3600.0,
+        ppf_ttl: float = 600.0,
+        local_size: int = 10_000,
+        local_ttl: float = 30.0,
+        on_invalidate: Optional[Callable[[str], Awaitable[None]]] = None,
+        clock: Callable[[], float] = time.time,
+    ):
+        """
+        Args:
+            broker: NatsBroker FastStream (None: couche locale seule)
+            bucket: Bucket NATS KV (créé si absent)
+            ttl: Durée de validité d'une route PEPPOL
+            ppf_ttl: Durée de validité d'un fallback PPF (plus courte: le
+                destinataire peut s'enregistrer sur PEPPOL entre-temps)
+            local_size: Nombre maximal d'entrées de la couche locale
+            local_ttl: Durée maximale d'une entrée de la couche locale, qui
+                borne la désynchronisation si la surveillance du bucket est
+                interrompue
+            on_invalidate: Appelé avec le destinataire de chaque décision
+                supprimée, sur chaque réplique (cache de lookup PEPPOL)
+            clock: Horloge murale en secondes (partagée entre répliques)
+        """
+        self.broker = broker
+        self.bucket = bucket
+        self.ttl = ttl
+        self.ppf_ttl = ppf_ttl
+        self.local_ttl = local_ttl
+        self.on_invalidate = on_invalidate
+        self._clock = clock
+        self._local = TTLCache(local_size)
+        self._kv = None
+        self._watch_task: Optional[asyncio.Task] = None
+        self.stats = DecisionStats()
+
+    async def _key_value(self):
+        if self._kv is None and self.broker is not None:
+            # les décisions périmées disparaissent du bucket d'elles-mêmes
+            self._kv = await self.broker.key_value(
+                self.bucket, ttl=max(self.ttl, self.ppf_ttl)
+            )
+        return self._kv
+
+    async def start(self):
+        """Démarre la surveillance du bucket (invalidations des autres répliques)."""
+        kv = await self._key_value()
+        if kv is not None and self._watch_task is None:
+            watcher = await kv.watchall(meta_only=True)
+            self._watch_task = asyncio.create_task(self._watch(watcher))
+
+    async def close(self):
+        if self._watch_task is not None:
+            task, self._watch_task = self._watch_task, None
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+    async def _watch(self, watcher):
+        try:
+            async for entry in watcher:
+                # None: fin des valeurs initiales du bucket
+                if entry is None:
+                    continue
+                self._local.invalidate(entry.key)
+                if entry.operation is not None:  # DEL ou PURGE
+                    await self._notify(key_recipient(entry.key))
+        finally:
+            await watcher.stop()
+
+    async def _notify(self, recipient: str):
+        if self.on_invalidate is not None:
+            await self.on_invalidate(recipient)
+
+    async def get(self, recipient: str, document_type: str) -> Optional[PeppolLookupResult]:
+        """Décision mémorisée pour un destinataire, None si inconnue ou expirée."""
+        key = decision_key(recipient, document_type)
+        cached = self._local.get(key, _MISSING)
+        if cached is not _MISSING:
+            self.stats.local_hits += 1
+            return cached
+
+        kv = await self._key_value()
+        if kv is None:
+            self.stats.misses += 1
+            return None
+        try:
+            entry = await kv.get(key)
+        except (KeyNotFoundError, KeyDeletedError):
+            self.stats.misses += 1
+            return None
+        except NatsError as e:
+            # KV indisponible: on refait le lookup plutôt que d'échouer
+            logger.warning("Lecture de la décision %s impossible: %s", key, e)
+            self.stats.errors += 1
+            return None
+
+        data = json.loads(entry.value)
+        remaining = data["expires_at"] - self._clock()
+        if remaining <= 0:
+            self.stats.misses += 1
+            return None
+        result = lookup_result_from_dict(data["result"])
+        self._local.set(key, result, min(self.local_ttl, remaining))
+        self.stats.shared_hits += 1
+        return result
+
+    async def put(self, recipient: str, document_type: str, result: PeppolLookupResult):
+        """Mémorise un résultat de lookup s'il fixe la route (voir `is_decision`)."""
+        if not is_decision(result):
+            return
+        key = decision_key(recipient, document_type)
+        ttl = self.ttl if result.success else self.ppf_ttl
+        self._local.set(key, result, min(self.local_ttl, ttl))
+        self.stats.stores += 1
+
+        kv = await self._key_value()
+        if kv is None:
+            return
+        value = json.dumps({"expires_at": self._clock() + ttl, "result": asdict(result)})
+        try:
+            await kv.put(key, value.encode())
+        except NatsError as e:
+            logger.warning("Écriture de la décision %s impossible: %s", key, e)
+            self.stats.errors += 1
+
+    async def invalidate(self, recipient: str, document_type: Optional[str] = None) -> int:
+        """
+        Supprime les décisions d'un destinataire (d'un document type, ou
+        toutes), sur toutes les répliques.
+
+        Returns:
+            Nombre de décisions supprimées du bucket
+        """
+        self.stats.invalidations += 1
+        if document_type is not None:
+            keys = [decision_key(recipient, document_type)]
+            self._local.invalidate(keys[0])
+        else:
+            # un SIREN couvre aussi ses SIRET
+            prefix = _recipient_subject(recipient).removesuffix("_")
+            if not prefix.endswith("."):
+                prefix += "."
+            self._local.invalidate_where(lambda key: key.startswith(prefix))
+            keys = None
+        # les autres répliques sont notifiées par la surveillance du bucket
+        await self._notify(recipient)
+
+        kv = await self._key_value()
+        if kv is None:
+            return 0
+        try:
+            if keys is None:
+                try:
+                    keys = await kv.keys(filters=[prefix + ">"])
+                except NoKeysError:
+                    keys = []
+            for key in keys:
+                await kv.delete(key)
+        except NatsError as e:
+            logger.warning("Invalidation des décisions de %s impossible: %s", recipient, e)
+            self.stats.errors += 1
+            return 0
+        return len(keys)
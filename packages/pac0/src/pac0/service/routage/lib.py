@@ -9,18 +9,46 @@ Ce module implémente le routage des factures vers les PA distantes
 via PEPPOL ou vers le PPF en fallback.
 """
 
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from typing import Optional
 
 
-from pac0.shared.esb import QUEUE
+from pac0.shared import esb
+from pac0.shared.blob import BlobNotFoundError, BlobStore, blob_store_from_env
+from pac0.shared.esb import CtxService, RoutingHeaders, publish_envelope
 
+from .as4 import As4Transmitter, load_security
+from .decisions import RoutingDecisionCache
 from .models import InvoiceMessage, RoutingResult, RoutingStatus
-from .peppol import PeppolEndpoint, PeppolEnvironment, PeppolLookupService
+from .peppol import (
+    PeppolEndpoint,
+    PeppolEnvironment,
+    PeppolLookupService,
+    participant_key,
+)
+from .ppf import PpfSubmitter
+from .retry import RetryPolicy, RetryScheduler, RetryStore
+from .shards import ShardAssigner, ShardCallback
+from .worker import RoutageWorker
 
 
+logger = logging.getLogger(__name__)
+
 # URL du PPF pour le fallback
 PPF_API_URL = "https://api.ppf.gouv.fr"
 
+# Invalidation des décisions de routage (annuaire local, enregistrement SMP):
+# {"recipient": SIREN ou SIRET, "document_type": optionnel}
+SUBJECT_INVALIDATE = "routage-INVALIDATE"
+
+# Erreurs de lookup transitoires: la facture passe en PENDING et sera réessayée
+RETRYABLE_LOOKUP_ERRORS = frozenset(
+    {"SMP_CIRCUIT_OPEN", "SMP_TIMEOUT", "SMP_UNAVAILABLE", "SML_TIMEOUT"}
+)
+
 
 # Service PEPPOL (singleton)
 _peppol_service: Optional[PeppolLookupService] = None
@@ -30,7 +58,11 @@ def get_peppol_service() -> PeppolLookupService:
     """Retourne le service PEPPOL (singleton)."""
     global _peppol_service
     if _peppol_service is None:
-        _peppol_service = PeppolLookupService(environment=PeppolEnvironment.PRODUCTION)
+        _peppol_service = PeppolLookupService(
+            environment=PeppolEnvironment.PRODUCTION,
+            # instantané du cache pour redémarrer à chaud (optionnel)
+            snapshot_path=os.environ.get("PEPPOL_CACHE_SNAPSHOT"),
+        )
     return _peppol_service
 
 
@@ -40,6 +72,274 @@ def set_peppol_service(service: PeppolLookupService):
     _peppol_service = service
 
 
+# Émetteur AS4 (singleton, None: transmission AS4 désactivée)
+_as4_transmitter: Optional[As4Transmitter] = None
+
+
+def get_as4_transmitter() -> Optional[As4Transmitter]:
+    """
+    Retourne l'émetteur AS4 (singleton).
+
+    Activé par la variable d'environnement AS4_SENDER_ID (identifiant PEPPOL de
+    notre AP). AS4_SECURITY ("module:fonction", voir `As4Security`) signe et
+    chiffre les messages; sans elle, l'émetteur refuse de démarrer, sauf avec
+    AS4_ALLOW_PLAINTEXT=1 (tests et développement uniquement).
+    AS4_EXECUTOR=process prépare les messages dans un pool de processus
+    (AS4_WORKERS) plutôt que dans le pool de threads par défaut.
+    """
+    global _as4_transmitter
+    if _as4_transmitter is None and (sender_ap := os.environ.get("AS4_SENDER_ID")):
+        executor = None
+        if os.environ.get("AS4_EXECUTOR") == "process":
+            workers = os.environ.get("AS4_WORKERS")
+            executor = ProcessPoolExecutor(int(workers) if workers else None)
+        security = os.environ.get("AS4_SECURITY")
+        _as4_transmitter = As4Transmitter(
+            sender_ap,
+            max_connections_per_ap=int(os.environ.get("AS4_MAX_CONNECTIONS_PER_AP", "10")),
+            executor=executor,
+            security=load_security(security) if security else None,
+            allow_plaintext=os.environ.get("AS4_ALLOW_PLAINTEXT") == "1",
+        )
+    return _as4_transmitter
+
+
+def set_as4_transmitter(transmitter: Optional[As4Transmitter]):
+    """Configure l'émetteur AS4 (pour les tests)."""
+    global _as4_transmitter
+    _as4_transmitter = transmitter
+
+
+# Stockage des documents (claim-check), None: factures toujours en ligne
+_blob_store: Optional[BlobStore] = None
+
+
+def get_blob_store() -> Optional[BlobStore]:
+    """Retourne le stockage des documents (singleton, voir PAC0_BLOB_STORE)."""
+    global _blob_store
+    if _blob_store is None:
+        _blob_store = blob_store_from_env(esb.broker)
+    return _blob_store
+
+
+def set_blob_store(store: Optional[BlobStore]):
+    """Configure le stockage des documents (pour les tests)."""
+    global _blob_store
+    _blob_store = store
+
+
+async def with_payload(message: InvoiceMessage) -> InvoiceMessage:
+    """
+    Facture avec son contenu en ligne, récupéré depuis le stockage des
+    documents si elle n'en porte que la référence.
+    """
+    if message.payload is not None:
+        return message
+    store = get_blob_store()
+    if store is None:
+        raise BlobNotFoundError("payload_ref sans stockage de documents (PAC0_BLOB_STORE)")
+    data = await store.get(message.payload_ref)
+    return message.model_copy(update={"payload": data})
+
+
+# Dépôt groupé au PPF (singleton, None: dépôt PPF désactivé)
+_ppf_submitter: Optional[PpfSubmitter] = None
+
+
+def get_ppf_submitter() -> Optional[PpfSubmitter]:
+    """
+    Retourne le dépôt groupé au PPF (singleton).
+
+    Activé par PPF_ENABLED=1; configuration par variables d'environnement:
+    PPF_API_URL, PPF_BATCH_SIZE, PPF_BATCH_BYTES, PPF_BATCH_WAIT (secondes).
+    """
+    global _ppf_submitter
+    if _ppf_submitter is None and os.environ.get("PPF_ENABLED") == "1":
+        _ppf_submitter = PpfSubmitter(
+            os.environ.get("PPF_API_URL", PPF_API_URL),
+            max_batch_size=int(os.environ.get("PPF_BATCH_SIZE", "100")),
+            max_batch_bytes=int(os.environ.get("PPF_BATCH_BYTES", str(5 * 1024 * 1024))),
+            max_wait=float(os.environ.get("PPF_BATCH_WAIT", "0.5")),
+        )
+    return _ppf_submitter
+
+
+def set_ppf_submitter(submitter: Optional[PpfSubmitter]):
+    """Configure le dépôt groupé au PPF (pour les tests)."""
+    global _ppf_submitter
+    _ppf_submitter = submitter
+
+
+# Décisions de routage partagées (singleton, None: désactivé)
+_decision_cache: Optional[RoutingDecisionCache] = None
+
+
+async def _forget_participant(recipient: str):
+    await get_peppol_service().forget(*participant_key(recipient))
+
+
+def get_decision_cache() -> Optional[RoutingDecisionCache]:
+    """
+    Retourne le cache des décisions de routage (singleton).
+
+    Activé par ROUTAGE_DECISIONS: "nats" (bucket NATS KV partagé par les
+    répliques) ou "local" (couche locale seule). Durées de validité:
+    ROUTAGE_DECISIONS_TTL (route PEPPOL), ROUTAGE_DECISIONS_PPF_TTL (fallback PPF).
+    """
+    global _decision_cache
+    mode = os.environ.get("ROUTAGE_DECISIONS")
+    if _decision_cache is None and mode in ("nats", "local"):
+        _decision_cache = RoutingDecisionCache(
+            esb.broker if mode == "nats" else None,
+            ttl=float(os.environ.get("ROUTAGE_DECISIONS_TTL", "3600")),
+            ppf_ttl=float(os.environ.get("ROUTAGE_DECISIONS_PPF_TTL", "600")),
+            # décision invalidée par une autre réplique: le cache de lookup
+            # de cette réplique est aussi périmé
+            on_invalidate=_forget_participant,
+        )
+    return _decision_cache
+
+
+def set_decision_cache(cache: Optional[RoutingDecisionCache]):
+    """Configure le cache des décisions de routage (pour les tests)."""
+    global _decision_cache
+    _decision_cache = cache
+
+
+async def invalidate_decisions(message: dict) -> int:
+    """Traite un message de SUBJECT_INVALIDATE."""
+    recipient = message["recipient"]
+    await _forget_participant(recipient)
+    cache = get_decision_cache()
+    if cache is None:
+        return 0
+    return await cache.invalidate(recipient, message.get("document_type"))
+
+
+def recipient_key(message) -> Optional[str]:
+    """Destinataire d'une facture (SIRET, sinon SIREN), None si inconnu."""
+    if isinstance(message, dict):
+        return message.get("recipient_siret") or message.get("recipient_siren")
+    if isinstance(message, InvoiceMessage):
+        return message.recipient_siret or message.recipient_siren
+    return None
+
+
+def lifecycle_key(document_types: frozenset[str], message) -> Optional[str]:
+    """
+    Destinataire d'un message de cycle de vie (document type de
+    `document_types`), à traiter dans l'ordre; None pour les autres messages.
+    """
+    if isinstance(message, dict):
+        document_type = message.get("document_type", "invoice_ubl")
+    elif isinstance(message, InvoiceMessage):
+        document_type = message.document_type
+    else:
+        return None
+    return recipient_key(message) if document_type in document_types else None
+
+
+async def destination_host(message) -> Optional[str]:
+    """
+    Hôte du SMP du destinataire d'une facture, None si inconnu.
+
+    Lu dans le cache SML uniquement: pas de requête DNS par message, le
+    lookup du routage s'en charge.
+    """
+    recipient = recipient_key(message)
+    if recipient is None:
+        return None
+    return get_peppol_service().cached_smp_host(*participant_key(recipient))
+
+
+def create_worker(handler) -> RoutageWorker:
+    """
+    Moteur de traitement concurrent de routage-IN.
+
+    Configuration par variables d'environnement:
+    ROUTAGE_MAX_IN_FLIGHT, ROUTAGE_MAX_PER_DESTINATION, ROUTAGE_MAX_PENDING,
+    ROUTAGE_ORDERED_DOCUMENT_TYPES (document types de cycle de vie traités
+    dans l'ordre par destinataire, séparés par des virgules; aucun par défaut).
+    """
+    ordered = frozenset(
+        filter(None, os.environ.get("ROUTAGE_ORDERED_DOCUMENT_TYPES", "").split(","))
+    )
+    return RoutageWorker(
+        handler,
+        max_in_flight=int(os.environ.get("ROUTAGE_MAX_IN_FLIGHT", "100")),
+        max_per_destination=int(os.environ.get("ROUTAGE_MAX_PER_DESTINATION", "10")),
+        max_pending=int(os.environ.get("ROUTAGE_MAX_PENDING", "1000")),
+        # ordre par destinataire pour les seuls messages de cycle de vie:
+        # les factures indépendantes restent traitées en parallèle
+        ordering_key=partial(lifecycle_key, ordered) if ordered else None,
+        destination=destination_host,
+    )
+
+
+def create_retry_scheduler(publish) -> RetryScheduler:
+    """
+    Échéancier des réessais, réinjectant dans routage-IN via `publish`.
+
+    Configuration par variables d'environnement:
+    ROUTAGE_RETRY_DB (base SQLite; en mémoire si absente, avec un
+    avertissement: les réessais sont alors perdus au redémarrage),
+    ROUTAGE_RETRY_RATE (réinjections par seconde), ROUTAGE_RETRY_BASE_DELAY,
+    ROUTAGE_RETRY_MAX_DELAY, ROUTAGE_RETRY_MAX_ATTEMPTS.
+    """
+    path = os.environ.get("ROUTAGE_RETRY_DB")
+    if not path:
+        logger.warning(
+            "routage: ROUTAGE_RETRY_DB non défini, réessais en mémoire "
+            "(perdus au redémarrage de la brique)"
+        )
+    return RetryScheduler(
+        publish,
+        store=RetryStore(path or None),
+        policy=RetryPolicy(
+            base_delay=float(os.environ.get("ROUTAGE_RETRY_BASE_DELAY", "5")),
+            max_delay=float(os.environ.get("ROUTAGE_RETRY_MAX_DELAY", "3600")),
+            max_attempts=int(os.environ.get("ROUTAGE_RETRY_MAX_ATTEMPTS", "10")),
+        ),
+        rate=float(os.environ.get("ROUTAGE_RETRY_RATE", "10")),
+    )
+
+
+def create_shard_assigner(
+    ctx: CtxService, on_assign: ShardCallback, on_revoke: ShardCallback
+) -> Optional[ShardAssigner]:
+    """
+    Attribution des partitions de routage-IN, None si la brique n'est pas
+    partitionnée.
+
+    Le partitionnement requiert le mode JetStream: chaque partition y est un
+    consumer durable dont les messages attendent la reprise par une autre
+    réplique. En NATS core, une partition dont la réplique s'est arrêtée
+    brutalement perdrait ses messages jusqu'à l'expiration de son annonce:
+    les partitions sont alors consommées par toutes les répliques (voir
+    `routage/main.py`), sans affinité.
+
+    Configuration par variables d'environnement: ROUTAGE_SHARDS (nombre de
+    partitions), ROUTAGE_SHARD_LEASE (secondes).
+    """
+    shards = esb.get_shard_count("routage")
+    if shards <= 0:
+        return None
+    if ctx.jetstream is None:
+        logger.warning(
+            "ROUTAGE_SHARDS=%d sans JetStream: partitions consommées par toutes "
+            "les répliques, sans affinité par destinataire",
+            shards,
+        )
+        return None
+    return ShardAssigner(
+        esb.broker,
+        shards,
+        on_assign,
+        on_revoke,
+        lease=float(os.environ.get("ROUTAGE_SHARD_LEASE", "10")),
+    )
+
+
 async def route_invoice(message: InvoiceMessage) -> RoutingResult:
     """
     Route une facture vers la destination appropriée.
@@ -57,20 +357,55 @@ async def route_invoice(message: InvoiceMessage) -> RoutingResult:
         RoutingResult avec le statut et la destination
     """
     peppol_service = get_peppol_service()
+    recipient = recipient_key(message)
+
+    # Décision déjà prise pour ce destinataire (par cette réplique ou une
+    # autre); le cache de lookup de la réplique d'abord: le bucket partagé
+    # (aller-retour NATS) ne sert qu'en son absence
+    decisions = get_decision_cache()
+    if decisions is not None and peppol_service.is_cached(
+        *participant_key(recipient), message.document_type
+    ):
+        decisions = None
+    result = (
+        await decisions.get(recipient, message.document_type)
+        if decisions is not None
+        else None
+    )
 
     # Lookup PEPPOL pour le destinataire
-    if message.recipient_siret:
-        result = await peppol_service.lookup_by_siret(
-            message.recipient_siret, document_type=message.document_type
-        )
-    else:
-        result = await peppol_service.lookup_by_siren(
-            message.recipient_siren, document_type=message.document_type
-        )
+    if result is None:
+        if message.recipient_siret:
+            result = await peppol_service.lookup_by_siret(
+                message.recipient_siret, document_type=message.document_type
+            )
+        else:
+            result = await peppol_service.lookup_by_siren(
+                message.recipient_siren, document_type=message.document_type
+            )
+        if decisions is not None:
+            await decisions.put(recipient, message.document_type, result)
 
     if result.success and result.endpoint:
         # Participant trouvé sur PEPPOL - transmettre via AS4
-        # TODO: Implémenter la transmission AS4 réelle
+        transmitter = get_as4_transmitter()
+        if transmitter is not None:
+            # contenu récupéré seulement au moment de l'envoi
+            transmission = await transmitter.send(
+                await with_payload(message), result.endpoint
+            )
+            if not transmission.success:
+                return RoutingResult(
+                    invoice_id=message.invoice_id,
+                    # échec réseau: réessayer; rejet par l'AP: erreur
+                    status=RoutingStatus.PENDING
+                    if transmission.retryable
+                    else RoutingStatus.ERROR,
+                    destination=result.endpoint.address,
+                    error_code="AS4_TRANSMISSION_FAILED",
+                    error_message=transmission.error_message,
+                    peppol_lookup_success=True,
+                )
         return RoutingResult(
             invoice_id=message.invoice_id,
             status=RoutingStatus.ROUTED,
@@ -79,17 +414,40 @@ async def route_invoice(message: InvoiceMessage) -> RoutingResult:
         )
 
     elif result.error_code == "PARTICIPANT_NOT_FOUND":
-        # Fallback vers PPF
-        # TODO: Implémenter la transmission vers PPF
+        # Fallback vers PPF, par lots
+        submitter = get_ppf_submitter()
+        if submitter is not None:
+            submission = await submitter.submit(await with_payload(message))
+            if not submission.success:
+                return RoutingResult(
+                    invoice_id=message.invoice_id,
+                    status=RoutingStatus.PENDING
+                    if submission.retryable
+                    else RoutingStatus.ERROR,
+                    destination=submitter.base_url,
+                    error_code="PPF_SUBMISSION_FAILED",
+                    error_message=submission.error_message,
+                    peppol_lookup_success=False,
+                )
         return RoutingResult(
             invoice_id=message.invoice_id,
             status=RoutingStatus.ROUTED_TO_PPF,
-            destination=PPF_API_URL,
+            destination=submitter.base_url if submitter is not None else PPF_API_URL,
+            peppol_lookup_success=False,
+        )
+
+    elif result.error_code in RETRYABLE_LOOKUP_ERRORS:
+        # SMP/SML indisponible ou en échec récent: la facture sera réessayée
+        return RoutingResult(
+            invoice_id=message.invoice_id,
+            status=RoutingStatus.PENDING,
+            error_code=result.error_code,
+            error_message=result.error_message,
             peppol_lookup_success=False,
         )
 
     else:
-        # Erreur de routage (timeout, SMP indisponible, etc.)
+        # Erreur de routage (document type non supporté, réponse SMP invalide, etc.)
         return RoutingResult(
             invoice_id=message.invoice_id,
             status=RoutingStatus.ERROR,
@@ -99,13 +457,34 @@ async def route_invoice(message: InvoiceMessage) -> RoutingResult:
         )
 
 
-@router.subscriber(SUBJECT_IN, QUEUE)
-async def process(message):
+def routing_of(message: InvoiceMessage) -> RoutingHeaders:
+    """En-têtes de routage d'une facture (voir pac0.shared.esb)."""
+    return RoutingHeaders(
+        invoice_id=message.invoice_id,
+        sender_siren=message.sender_siren,
+        recipient_siren=message.recipient_siren,
+        document_type=message.document_type,
+        local_recipient=message.local_recipient,
+    )
+
+
+async def process(
+    ctx: CtxService,
+    message,
+    correlation_id: Optional[str] = None,
+    retry: Optional[RetryScheduler] = None,
+):
     """
     Handler principal du service de routage.
 
     Reçoit les factures depuis routage-IN et les route vers
     la destination appropriée.
+
+    Args:
+        ctx: Contexte ESB de la brique (publishers OUT/ERR)
+        message: Message reçu (dict, InvoiceMessage ou message legacy)
+        correlation_id: Identifiant de corrélation à propager
+        retry: Échéancier des réessais (None: les factures PENDING vont en erreur)
     """
     try:
         # Parser le message si c'est un dict
@@ -125,15 +504,27 @@ async def process(message):
         # Router la facture
         routing_result = await route_invoice(invoice_message)
 
-        # Publier le résultat
-        if routing_result.status == RoutingStatus.ERROR:
-            await publisher_err.publish(
-                routing_result.model_dump(), correlation_id=message.correlation_id
+        # Réessayer plus tard les factures PENDING (jusqu'à max_attempts)
+        if (
+            routing_result.status == RoutingStatus.PENDING
+            and retry is not None
+            and await retry.schedule(
+                invoice_message.model_dump(), correlation_id, invoice_message.attempt
             )
+        ):
+            return
+
+        # Publier le résultat
+        if routing_result.status in (RoutingStatus.ERROR, RoutingStatus.PENDING):
+            publisher = ctx.publisher_err
         else:
-            await publisher_out.publish(
-                routing_result.model_dump(), correlation_id=message.correlation_id
-            )
+            publisher = ctx.publisher_out
+        await publish_envelope(
+            publisher,
+            routing_result,
+            routing_of(invoice_message),
+            correlation_id=correlation_id,
+        )
 
     except Exception as e:
         # Erreur inattendue
@@ -143,6 +534,9 @@ async def process(message):
             error_code="INTERNAL_ERROR",
             error_message=str(e),
         )
-        await publisher_err.publish(
-            error_result.model_dump(), correlation_id=message.correlation_id
+        await publish_envelope(
+            ctx.publisher_err,
+            error_result,
+            RoutingHeaders(invoice_id=error_result.invoice_id),
+            correlation_id=correlation_id,
         )
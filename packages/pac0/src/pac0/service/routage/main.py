@@ -2,7 +2,29 @@
 #
 # SPDX-License-Identifier: GPL-3.0-or-later
 
-from pac0.shared.esb import init_esb_app
+from faststream.nats import NatsMessage
+
+from pac0.service.routage import lib
+from pac0.service.routage.lib import (
+    SUBJECT_INVALIDATE,
+    create_retry_scheduler,
+    create_shard_assigner,
+    create_worker,
+    get_as4_transmitter,
+    get_decision_cache,
+    get_peppol_service,
+    get_ppf_submitter,
+    invalidate_decisions,
+    recipient_key,
+)
+from pac0.service.routage.models import InvoiceMessage
+from pac0.shared.esb import (
+    decode_envelope,
+    get_shard_count,
+    init_esb_app,
+    publish_envelope,
+    sharded_subject,
+)
 
 
 ctx, broker, app = init_esb_app("routage")
@@ -10,8 +32,119 @@ ctx, broker, app = init_esb_app("routage")
 # publisher = ctx.broker.publisher("test")
 
 
-@broker.subscriber(ctx.subject_in, ctx.queue)
-async def process(message):
-    await ctx.publisher_out.publish(message, correlation_id=message.correlation_id)
-    # await publisher_err.publish(message, correlation_id=message.correlation_id)
-    # TODO see lib.process()
+@app.on_startup
+async def startup():
+    # pool HTTP vers les SMP partagé par tous les lookups
+    await get_peppol_service().start()
+    if (transmitter := get_as4_transmitter()) is not None:
+        await transmitter.start()
+    if (submitter := get_ppf_submitter()) is not None:
+        await submitter.start()
+    # réessais enregistrés avant l'arrêt précédent
+    await retry.start()
+
+
+@app.after_startup
+async def after_startup():
+    # buckets NATS KV: le broker doit être connecté
+    if (decisions := get_decision_cache()) is not None:
+        # décisions invalidées par les autres répliques
+        await decisions.start()
+    if shards is not None:
+        await shards.start()
+
+
+@app.on_shutdown
+async def drain():
+    # après ctx.drain (plus de nouvelles factures), avant la fermeture du
+    # broker: les factures acceptées sont publiées, les autres répliques
+    # reprennent les partitions
+    await worker.join()
+    await retry.stop()
+    if shards is not None:
+        await shards.stop()
+
+
+@app.after_shutdown
+async def shutdown():
+    if (decisions := get_decision_cache()) is not None:
+        await decisions.close()
+    await get_peppol_service().close()
+    if (transmitter := get_as4_transmitter()) is not None:
+        await transmitter.close()
+    if (submitter := get_ppf_submitter()) is not None:
+        # dépose le dernier lot avant l'arrêt
+        await submitter.close()
+
+
+# publication acquittée par JetStream en mode JetStream
+publisher_in = ctx.publisher(ctx.subject_in)
+
+
+async def reinject(message, correlation_id):
+    subject = sharded_subject(
+        ctx.subject_in, recipient_key(message), get_shard_count(ctx.prefix)
+    )
+    await publish_envelope(
+        publisher_in,
+        message,
+        lib.routing_of(InvoiceMessage(**message)),
+        correlation_id=correlation_id,
+        subject=subject,
+    )
+
+
+# factures PENDING réinjectées dans routage-IN, à débit limité
+retry = create_retry_scheduler(reinject)
+
+
+async def route(message, correlation_id):
+    # routage de la facture, résultat sur routage-OUT / routage-ERR;
+    # les factures PENDING repartent par l'échéancier des réessais
+    await lib.process(ctx, message, correlation_id, retry=retry)
+
+
+# traitement concurrent: un SMP ou une PA lente ne bloque plus routage-IN
+worker = create_worker(route)
+
+
+@ctx.subscriber(ctx.subject_in)
+async def process(message: NatsMessage):
+    body = await decode_envelope(message)
+    if ctx.jetstream is not None:
+        # JetStream: le message n'est acquitté qu'une fois routé (refusé et
+        # redistribué si le routage échoue ou si la brique s'arrête avant)
+        await worker.process(body, message.correlation_id)
+    else:
+        await worker.submit(body, message.correlation_id)
+
+
+# partitions de routage-IN (ROUTAGE_SHARDS): abonnements dynamiques
+shard_subscribers = {}
+
+
+async def subscribe_shard(shard: int):
+    subscriber = ctx.subscriber(f"{ctx.subject_in}.{shard}", persistent=False)
+    subscriber(process)
+    await subscriber.start()
+    shard_subscribers[shard] = subscriber
+
+
+async def unsubscribe_shard(shard: int):
+    if (subscriber := shard_subscribers.pop(shard, None)) is not None:
+        await subscriber.stop()
+
+
+shards = create_shard_assigner(ctx, subscribe_shard, unsubscribe_shard)
+
+if shards is None and get_shard_count(ctx.prefix) > 0:
+    # NATS core (ou mémoire): les partitions publiées par gestion_cycle_vie
+    # sont consommées dans le groupe de queue de la brique, sans affinité
+    ctx.subscriber(f"{ctx.subject_in}.*")(process)
+
+
+# annuaire local ou enregistrement SMP modifié: les décisions du destinataire
+# sont supprimées du bucket partagé, donc de toutes les répliques
+@broker.subscriber(SUBJECT_INVALIDATE, ctx.queue)
+async def invalidate(message: dict):
+    await invalidate_decisions(message)
@@ -9,7 +9,9 @@ Modèles de données pour le service de routage.
 from enum import Enum
 from typing import Optional
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, model_validator
+
+from pac0.shared.blob import BlobRef
 
 
 class RoutingStatus(str, Enum):
@@ -33,10 +35,25 @@ class InvoiceMessage(BaseModel):
     document_type: str = Field(
         default="invoice_ubl", description="Type de document PEPPOL"
     )
-    payload: str = Field(..., description="Contenu de la facture (XML)")
+    payload: Optional[bytes] = Field(
+        None,
+        description="Contenu de la facture (XML, PDF Factur-X...), absent si `payload_ref`",
+    )
+    payload_ref: Optional[BlobRef] = Field(
+        None, description="Référence du contenu dans le stockage de documents"
+    )
     local_recipient: bool = Field(
         default=False, description="True si le destinataire est local"
     )
+    attempt: int = Field(
+        default=0, description="Nombre de tentatives de routage déjà faites"
+    )
+
+    @model_validator(mode="after")
+    def _check_payload(self) -> "InvoiceMessage":
+        if self.payload is None and self.payload_ref is None:
+            raise ValueError("payload ou payload_ref requis")
+        return self
 
 
 class RoutingResult(BaseModel):
@@ -60,3 +77,17 @@ class AS4TransmissionResult(BaseModel):
     success: bool
     message_id: Optional[str] = None
     error_message: Optional[str] = None
+    retryable: bool = Field(
+        default=False, description="True si l'échec est transitoire (réseau, HTTP)"
+    )
+
+
+class PpfSubmissionResult(BaseModel):
+    """Résultat du dépôt d'une facture au PPF."""
+
+    success: bool
+    batch_id: Optional[str] = None
+    error_message: Optional[str] = None
+    retryable: bool = Field(
+        default=False, description="True si l'échec est transitoire (réseau, HTTP)"
+    )
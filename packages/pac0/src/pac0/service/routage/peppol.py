@@ -9,15 +9,36 @@ Ce module implémente le lookup PEPPOL pour déterminer quelle PA
 a autorité pour une entreprise donnée.
 """
 
-import hashlib
-from dataclasses import dataclass, field
-from enum import Enum
-from typing import Optional
-from urllib.parse import quote
+import asyncio
+import contextlib
+import importlib.util
+import inspect
+import logging
+import time
+import xml.etree.ElementTree as ET
+from dataclasses import asdict, dataclass, field
+from email.utils import parsedate_to_datetime
+from typing import AsyncIterator, Iterable, Mapping, Optional, Self
+from urllib.parse import quote, unquote, urlsplit
 
 import httpx
 
-from pac0.shared.peppol import PeppolScheme, PeppolEnvironment, compute_sml_hostname
+from pac0.shared.peppol import (
+    PeppolEnvironment,
+    PeppolScheme,
+    SmlHashScheme,
+    compute_sml_hostname,
+)
+
+from .breaker import SmpHealthTracker
+from .cache import CacheStats, TTLCache
+from .snapshot import LookupSnapshot
+
+logger = logging.getLogger(__name__)
+
+
+# Sentinelle pour distinguer une absence du cache d'une valeur None en cache
+_MISSING = object()
 
 
 @dataclass
@@ -42,6 +63,56 @@ class PeppolLookupResult:
     smp_url: Optional[str] = None
 
 
+@dataclass
+class LookupManyStats:
+    """Statistiques agrégées d'un `lookup_many`, mises à jour au fil de l'eau."""
+
+    total: int = 0
+    success: int = 0
+    errors: dict[str, int] = field(default_factory=dict)
+    elapsed: float = 0.0
+
+    @property
+    def throughput(self) -> float:
+        """Nombre de lookups terminés par seconde."""
+        return self.total / self.elapsed if self.elapsed > 0 else 0.0
+
+    def record(self, result: "PeppolLookupResult", elapsed: float):
+        """Comptabilise un résultat."""
+        self.total += 1
+        self.elapsed = elapsed
+        if result.success:
+            self.success += 1
+        else:
+            code = result.error_code or "UNKNOWN"
+            self.errors[code] = self.errors.get(code, 0) + 1
+
+
+@dataclass
+class ParticipantServices:
+    """
+    Services d'un participant, lus une seule fois sur son SMP.
+
+    Le ServiceGroup donne la liste des document types; le ServiceMetadata
+    demandé est récupéré en parallèle avec lui, les autres document types
+    connus (PEPPOL_DOCUMENT_TYPES) sont préchargés en tâche de fond.
+    """
+
+    # None si le SMP ne fournit pas de ServiceGroup exploitable
+    document_types: Optional[frozenset[str]] = None
+    # erreur de la requête ServiceGroup (timeout, 5xx, ...)
+    error: Optional[tuple["PeppolLookupResult", float]] = None
+
+
+# Participant d'un lookup_many: SIREN/SIRET seul ou (scheme_id, participant_id)
+Participant = str | tuple[str, str]
+
+# Nombre de lookups préparés d'avance par `lookup_many`, en multiple de la
+# concurrence: borne la mémoire tout en laissant les SMP rapides avancer
+# pendant que les lents sont limités par `per_smp_concurrency`
+LOOKUP_MANY_WINDOW = 4
+
+
 # Document types PEPPOL courants
 PEPPOL_DOCUMENT_TYPES = {
     "invoice_ubl": (
@@ -63,6 +134,271 @@ PEPPOL_DOCUMENT_TYPES = {
 }
 
 
+# Profil de transport recherché dans les réponses SMP
+AS4_TRANSPORT_PROFILE = "peppol-transport-as4-v2_0"
+
+# Taille maximale d'une réponse SMP acceptée par le parser
+MAX_SMP_RESPONSE_SIZE = 4 * 1024 * 1024
+
+# Taille des blocs passés au parser quand la réponse est déjà en mémoire
+SMP_PARSE_CHUNK_SIZE = 64 * 1024
+
+
+class SmpResponseTooLarge(ValueError):
+    """Réponse SMP dépassant la taille maximale autorisée."""
+
+
+class SmpEndpointParser:
+    """
+    Parser incrémental (une seule passe) des réponses SMP ServiceMetadata.
+
+    Les données sont fournies par blocs via `feed()`. Le parse s'arrête dès
+    que le premier endpoint du profil de transport recherché est complet;
+    les endpoints des autres profils sont libérés au fil de l'eau.
+    """
+
+    _FIELDS = ("Address", "Certificate", "ServiceDescription")
+
+    def __init__(
+        self,
+        transport_profile: str = AS4_TRANSPORT_PROFILE,
+        max_size: int = MAX_SMP_RESPONSE_SIZE,
+    ):
+        """
+        Args:
+            transport_profile: Profil de transport de l'endpoint recherché
+            max_size: Taille maximale du document en octets
+        """
+        self.transport_profile = transport_profile
+        self.max_size = max_size
+        self.size = 0
+        self.done = False
+        self.endpoint: Optional[PeppolEndpoint] = None
+        # seuls les événements "end" sont demandés: à la fin d'un Endpoint,
+        # son sous-arbre (Address, Certificate, ...) est complet
+        self._parser = ET.XMLPullParser(events=("end",))
+
+    def feed(self, data: bytes | str) -> bool:
+        """
+        Fournit un bloc de la réponse.
+
+        Returns:
+            True si le parse est terminé (les blocs suivants sont ignorés)
+
+        Raises:
+            SmpResponseTooLarge: si `max_size` est dépassé avant la fin du parse
+            xml.etree.ElementTree.ParseError: si le XML est invalide
+        """
+        self.size += len(data)
+        if self.done:
+            return True
+        if self.size > self.max_size:
+            raise SmpResponseTooLarge(
+                f"Réponse SMP supérieure à {self.max_size} octets"
+            )
+
+        self._parser.feed(data)
+        for _, elem in self._parser.read_events():
+            tag = elem.tag
+            if not (tag == "Endpoint" or tag.endswith("}Endpoint")):
+                continue
+            if elem.get("transportProfile") == self.transport_profile:
+                self._finish(elem)
+                return True
+            # endpoint d'un autre profil: libérer son sous-arbre
+            elem.clear()
+        return False
+
+    def close(self) -> Optional[PeppolEndpoint]:
+        """
+        Termine le parse.
+
+        Returns:
+            PeppolEndpoint trouvé ou None
+
+        Raises:
+            xml.etree.ElementTree.ParseError: si le XML est invalide ou tronqué
+        """
+        if not self.done:
+            self._parser.close()
+            self.done = True
+        return self.endpoint
+
+    def _finish(self, endpoint: ET.Element):
+        self.done = True
+        fields: dict[str, Optional[str]] = {}
+        for child in endpoint.iter():
+            name = child.tag.rpartition("}")[2]
+            if name in self._FIELDS and name not in fields:
+                fields[name] = child.text
+        address = fields.get("Address")
+        certificate = fields.get("Certificate")
+        if address is None or certificate is None:
+            return
+        self.endpoint = PeppolEndpoint(
+            address=address,
+            certificate=certificate,
+            transport_profile=self.transport_profile,
+            service_description=fields.get("ServiceDescription"),
+        )
+
+
+def parse_smp_endpoint(
+    content: bytes | str,
+    transport_profile: str = AS4_TRANSPORT_PROFILE,
+    max_size: int = MAX_SMP_RESPONSE_SIZE,
+) -> Optional[PeppolEndpoint]:
+    """
+    Extrait l'endpoint d'une réponse SMP ServiceMetadata complète.
+
+    Args:
+        content: Réponse SMP (octets bruts de préférence)
+        transport_profile: Profil de transport recherché
+        max_size: Taille maximale du document en octets
+
+    Returns:
+        PeppolEndpoint ou None si absent, incomplet ou XML invalide
+
+    Raises:
+        SmpResponseTooLarge: si le document dépasse `max_size`
+    """
+    parser = SmpEndpointParser(transport_profile, max_size)
+    try:
+        for offset in range(0, len(content), SMP_PARSE_CHUNK_SIZE):
+            if parser.feed(content[offset : offset + SMP_PARSE_CHUNK_SIZE]):
+                break
+        return parser.close()
+    except ET.ParseError:
+        return None
+
+
+def parse_service_group(content: bytes | str) -> Optional[frozenset[str]]:
+    """
+    Extrait les document types annoncés par une réponse SMP ServiceGroup.
+
+    Args:
+        content: XML du ServiceGroup
+
+    Returns:
+        Identifiants PEPPOL complets des document types, ou None si la
+        réponse n'est pas un ServiceGroup exploitable
+    """
+    try:
+        root = ET.fromstring(content)
+    except ET.ParseError:
+        return None
+    if root.tag.rpartition("}")[2] != "ServiceGroup":
+        return None
+
+    document_types = set()
+    for elem in root.iter():
+        if elem.tag.rpartition("}")[2] != "ServiceMetadataReference":
+            continue
+        _, sep, doc_type = elem.get("href", "").partition("/services/")
+        if sep and doc_type:
+            document_types.add(unquote(doc_type))
+    return frozenset(document_types)
+
+
+def smp_url_from_naptr(regexp: str) -> Optional[str]:
+    """
+    Extrait l'URL du SMP du champ regexp d'un enregistrement NAPTR U-NAPTR.
+
+    Exemples: "!^.*$!https://smp.example.com!" ou "!.*!https://smp.example.com!"
+
+    Args:
+        regexp: Champ regexp (délimiteur en premier caractère)
+
+    Returns:
+        URL du SMP ou None si le format n'est pas reconnu
+    """
+    if len(regexp) < 3 or not regexp.endswith(regexp[0]):
+        return None
+    parts = regexp[1:-1].split(regexp[0])
+    if len(parts) != 2 or parts[0] not in ("^.*$", ".*"):
+        return None
+    return parts[1] or None
+
+
+def parse_cache_ttl(headers: Mapping[str, str]) -> Optional[float]:
+    """
+    Calcule la durée de cache annoncée par une réponse HTTP.
+
+    `Cache-Control` (no-store, no-cache, s-maxage, max-age) est prioritaire
+    sur `Expires`.
+
+    Args:
+        headers: En-têtes de la réponse HTTP
+
+    Returns:
+        Durée en secondes (0 si la réponse ne doit pas être mise en cache),
+        ou None si aucune directive n'est présente
+    """
+    cache_control = headers.get("cache-control")
+    if cache_control:
+        directives = {}
+        for part in cache_control.lower().split(","):
+            name, _, value = part.strip().partition("=")
+            directives[name] = value.strip('"')
+        if "no-store" in directives or "no-cache" in directives:
+            return 0.0
+        for name in ("s-maxage", "max-age"):
+            if name in directives:
+                try:
+                    return max(0.0, float(directives[name]))
+                except ValueError:
+                    pass
+
+    expires = headers.get("expires")
+    if expires:
+        try:
+            expires_at = parsedate_to_datetime(expires).timestamp()
+        except (TypeError, ValueError):
+            # date invalide (ex: "0"): réponse considérée comme expirée
+            return 0.0
+        now = time.time()
+        date = headers.get("date")
+        if date:
+            try:
+                now = parsedate_to_datetime(date).timestamp()
+            except (TypeError, ValueError):
+                pass
+        return max(0.0, expires_at - now)
+
+    return None
+
+
+def lookup_result_from_dict(data: dict) -> PeppolLookupResult:
+    """Reconstruit un PeppolLookupResult sérialisé avec `dataclasses.asdict`."""
+    endpoint = data.get("endpoint")
+    return PeppolLookupResult(
+        **{
+            **data,
+            "endpoint": PeppolEndpoint(**endpoint) if endpoint is not None else None,
+        }
+    )
+
+
+def participant_key(participant: Participant) -> tuple[str, str]:
+    """
+    Normalise un participant en (scheme_id, participant_id).
+
+    Un identifiant seul de 14 caractères est un SIRET, sinon un SIREN.
+
+    Args:
+        participant: SIREN, SIRET ou tuple (scheme_id, participant_id)
+
+    Returns:
+        Tuple (scheme_id, participant_id)
+    """
+    if isinstance(participant, str):
+        participant_id = participant.strip()
+        scheme = PeppolScheme.SIRET if len(participant_id) == 14 else PeppolScheme.SIREN
+        return scheme.value, participant_id
+    scheme_id, participant_id = participant
+    return scheme_id, participant_id
+
+
 class PeppolLookupService:
     """
     Service de découverte PEPPOL via SML/SMP.
@@ -76,6 +412,22 @@ class PeppolLookupService:
         environment: PeppolEnvironment = PeppolEnvironment.PRODUCTION,
         timeout: float = 30.0,
         dns_resolver: Optional[object] = None,
+        cache_size: int = 10_000,
+        cache_ttl: float = 3600.0,
+        cache_max_ttl: float = 86400.0,
+        negative_cache_ttl: float = 300.0,
+        max_connections: int = 100,
+        max_connections_per_host: int = 10,
+        keepalive_expiry: float = 60.0,
+        http2: bool = True,
+        dns_timeout: float = 5.0,
+        dns_nameservers: Optional[list[str]] = None,
+        dns_port: int = 53,
+        max_smp_response_size: int = MAX_SMP_RESPONSE_SIZE,
+        smp_health: Optional[SmpHealthTracker] = None,
+        hedge_requests: bool = False,
+        snapshot_path: Optional[str] = None,
+        sml_hash_scheme: SmlHashScheme = SmlHashScheme.MD5,
     ):
         """
         Initialise le service de lookup PEPPOL.
@@ -84,58 +436,306 @@ class PeppolLookupService:
             environment: Environnement PEPPOL (production ou test)
             timeout: Timeout en secondes pour les requêtes HTTP
             dns_resolver: Résolveur DNS optionnel (pour les tests)
+            cache_size: Nombre maximal d'entrées par cache (0 pour désactiver)
+            cache_ttl: Durée de cache par défaut si ni le DNS ni le SMP
+                n'en fournissent une
+            cache_max_ttl: Durée de cache maximale, quelle que soit la source
+            negative_cache_ttl: Durée de cache des réponses négatives
+                (participant ou document type non trouvé)
+            max_connections: Nombre maximal de connexions HTTP ouvertes
+            max_connections_per_host: Nombre maximal de requêtes simultanées
+                vers un même SMP
+            keepalive_expiry: Durée de conservation d'une connexion inactive
+            http2: Active HTTP/2 (paquet `h2`, dépendance httpx[http2])
+            dns_timeout: Timeout en secondes de chaque requête DNS
+            dns_nameservers: Serveurs DNS à interroger (défaut: configuration
+                système)
+            dns_port: Port des serveurs DNS `dns_nameservers`
+            max_smp_response_size: Taille maximale d'une réponse SMP (octets)
+            smp_health: Suivi de santé des SMP (disjoncteurs, timeouts
+                adaptatifs); par défaut un tracker plafonné à `timeout`
+            hedge_requests: Lance une requête de secours quand la première
+                dépasse la latence p95 du SMP
+            snapshot_path: Fichier SQLite où persister le cache de lookup
+                pour redémarrer à chaud (désactivé si None)
+            sml_hash_scheme: Algorithme des hostnames SML (MD5 historique
+                ou SHA256 base32 des zones NAPTR)
         """
         self.sml_zone = environment.value
+        self.sml_hash_scheme = sml_hash_scheme
         self.environment = environment
         self.timeout = timeout
+        self.max_smp_response_size = max_smp_response_size
+        self.cache_ttl = cache_ttl
+        self.cache_max_ttl = cache_max_ttl
+        self.negative_cache_ttl = negative_cache_ttl
         self._dns_resolver = dns_resolver
+        self.dns_timeout = dns_timeout
+        self.dns_nameservers = dns_nameservers
+        self.dns_port = dns_port
+        self._async_resolver = None
         self._mock_smp_responses: dict = {}
+        # hostname SML -> URL du SMP (None si participant non trouvé)
+        self._smp_url_cache = TTLCache(cache_size)
+        # (scheme, participant, document type) -> PeppolLookupResult
+        self._lookup_cache = TTLCache(cache_size)
+        # copie persistante du cache de lookup, lue à la demande
+        self._snapshot = LookupSnapshot(snapshot_path) if snapshot_path else None
+        self.snapshot_hits = 0
+        # écritures de l'instantané en attente, recopiées hors de la boucle
+        # d'événements par une tâche d'écriture (voir _write_snapshot)
+        self._snapshot_writes: list[tuple[tuple[str, str, str], dict, float]] = []
+        self._snapshot_writer: Optional[asyncio.Task] = None
+        # (scheme, participant) -> document types du ServiceGroup SMP
+        # (None si le SMP n'en fournit pas)
+        self._service_group_cache = TTLCache(cache_size)
+        # lookups en cours, partagés par les appelants concurrents
+        self._inflight: dict[tuple[str, str, str], asyncio.Future] = {}
+        self._inflight_services: dict[tuple[str, str], asyncio.Future] = {}
+        # préchargements des autres document types d'un participant
+        self._prefetches: set[asyncio.Future] = set()
+        self.coalesced_lookups = 0
+        # Disjoncteur et timeout adaptatif par hôte SMP
+        self.smp_health = smp_health or SmpHealthTracker(max_timeout=timeout)
+        self.hedge_requests = hedge_requests
+        self.hedged_requests = 0
+        # Client HTTP partagé par tous les lookups (voir start/close)
+        self.max_connections = max_connections
+        self.max_connections_per_host = max_connections_per_host
+        self.keepalive_expiry = keepalive_expiry
+        self.http2 = http2 and importlib.util.find_spec("h2") is not None
+        if http2 and not self.http2:
+            # dépendance httpx[http2] absente: connexions HTTP/1.1 seulement
+            logger.warning("HTTP/2 demandé mais le paquet h2 n'est pas installé")
+        self._client: Optional[httpx.AsyncClient] = None
+        self._host_semaphores: dict[str, asyncio.Semaphore] = {}
+
+    async def start(self) -> Self:
+        """
+        Ouvre le pool de connexions HTTP vers les SMP.
 
-    def _resolve_smp_url_sync(self, hostname: str) -> Optional[str]:
+        À appeler au démarrage de la brique (voir `routage/main.py`).
+        Le pool est sinon créé à la première requête.
+        """
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout,
+                http2=self.http2,
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections,
+                    keepalive_expiry=self.keepalive_expiry,
+                ),
+                headers={"Accept": "application/xml"},
+            )
+        return self
+
+    async def close(self):
+        """Ferme le pool de connexions HTTP et enregistre l'instantané du cache."""
+        for task in self._prefetches:
+            task.cancel()
+        await asyncio.gather(*self._prefetches, return_exceptions=True)
+        if self._snapshot is not None:
+            if self._snapshot_writer is not None:
+                await self._snapshot_writer
+            await asyncio.to_thread(self._snapshot.close)
+        if self._client is not None:
+            client, self._client = self._client, None
+            await client.aclose()
+
+    async def __aenter__(self) -> Self:
+        return await self.start()
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb) -> None:
+        await self.close()
+
+    async def _get_client(self) -> httpx.AsyncClient:
+        """Retourne le client HTTP partagé (le crée si nécessaire)."""
+        if self._client is None:
+            await self.start()
+        return self._client
+
+    def _host_semaphore(self, url: str) -> asyncio.Semaphore:
+        """Retourne le sémaphore limitant les requêtes simultanées vers un SMP."""
+        host = urlsplit(url).netloc
+        semaphore = self._host_semaphores.get(host)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.max_connections_per_host)
+            self._host_semaphores[host] = semaphore
+        return semaphore
+
+    def _cache_ttl(self, ttl: Optional[float]) -> float:
+        """Borne une durée de cache annoncée (DNS ou HTTP)."""
+        if ttl is None:
+            ttl = self.cache_ttl
+        return max(0.0, min(ttl, self.cache_max_ttl))
+
+    def cache_stats(self) -> dict[str, CacheStats]:
         """
-        Résout l'URL du SMP via DNS (synchrone).
+        Retourne les compteurs des caches de lookup.
 
-        Tente d'abord NAPTR, puis fallback vers CNAME.
+        Returns:
+            Dictionnaire {"smp_url": CacheStats, "lookup": CacheStats,
+            "service_group": CacheStats}
+        """
+        return {
+            "smp_url": self._smp_url_cache.stats(),
+            "lookup": self._lookup_cache.stats(),
+            "service_group": self._service_group_cache.stats(),
+        }
+
+    async def clear_cache(self):
+        """Vide les caches de lookup (les compteurs sont conservés)."""
+        self._smp_url_cache.clear()
+        self._lookup_cache.clear()
+        self._service_group_cache.clear()
+        if self._snapshot is not None:
+            self._snapshot_writes.clear()
+            # écriture SQLite dans un thread: la boucle d'événements reste libre
+            await asyncio.to_thread(self._snapshot.clear)
+
+    async def forget(self, scheme_id: str, participant_id: str):
+        """
+        Oublie tout ce qui est en cache pour un participant (résolution SML,
+        ServiceGroup, résultats de lookup), par exemple après la modification
+        de son enregistrement SMP.
+        """
+        participant = (scheme_id.lower(), participant_id.lower())
+        self._smp_url_cache.invalidate(
+            compute_sml_hostname(
+                self.sml_zone, scheme_id, participant_id, self.sml_hash_scheme
+            )
+        )
+        self._service_group_cache.invalidate(participant)
+        self._lookup_cache.invalidate_where(lambda key: key[:2] == participant)
+        if self._snapshot is not None:
+            self._snapshot_writes = [
+                write for write in self._snapshot_writes if write[0][:2] != participant
+            ]
+            await asyncio.to_thread(self._snapshot.forget, *participant)
+
+    async def _resolve_smp_url(self, hostname: str) -> Optional[str]:
+        """
+        Résout l'URL du SMP en passant par le cache SML.
+
+        Les résolutions positives sont conservées selon le TTL DNS,
+        les absences selon `negative_cache_ttl`.
 
         Args:
             hostname: Hostname SML généré
 
         Returns:
             URL du SMP ou None si non trouvé
+
+        Raises:
+            TimeoutError: si aucune requête DNS n'a abouti dans le délai
         """
-        # Si un mock est configuré, l'utiliser
-        if self._dns_resolver is not None:
-            return self._dns_resolver(hostname)
+        cached = self._smp_url_cache.get(hostname, _MISSING)
+        if cached is not _MISSING:
+            return cached
+
+        smp_url, ttl = await self._resolve_smp_url_async(hostname)
+        if smp_url:
+            self._smp_url_cache.set(hostname, smp_url, self._cache_ttl(ttl))
+        else:
+            self._smp_url_cache.set(hostname, None, self.negative_cache_ttl)
+        return smp_url
+
+    def _get_async_resolver(self):
+        """Retourne le résolveur DNS asynchrone (créé au premier appel)."""
+        if self._async_resolver is None:
+            import dns.asyncresolver
+
+            if self.dns_nameservers:
+                resolver = dns.asyncresolver.Resolver(configure=False)
+                resolver.nameservers = list(self.dns_nameservers)
+                resolver.port = self.dns_port
+            else:
+                resolver = dns.asyncresolver.Resolver()
+            self._async_resolver = resolver
+        return self._async_resolver
+
+    async def _query_dns(self, hostname: str, rdtype: str):
+        """
+        Envoie une requête DNS avec le timeout `dns_timeout`.
+
+        Returns:
+            Réponse dnspython, ou None si le nom ou l'enregistrement n'existe pas
+
+        Raises:
+            TimeoutError: si la requête n'a pas abouti dans le délai
+        """
+        import dns.exception
+        import dns.resolver
 
-        # Implémentation réelle avec dnspython
         try:
-            import dns.resolver
+            return await self._get_async_resolver().resolve(
+                hostname, rdtype, lifetime=self.dns_timeout
+            )
+        except dns.exception.Timeout as e:
+            raise TimeoutError(f"DNS {rdtype} {hostname}") from e
+        except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer):
+            return None
+        except dns.exception.DNSException:
+            return None
 
-            # Essayer NAPTR d'abord (nouvelle méthode)
-            try:
-                answers = dns.resolver.resolve(hostname, "NAPTR")
-                for rdata in answers:
-                    regexp = str(rdata.regexp)
-                    if regexp.startswith("!^.*$!") and regexp.endswith("!"):
-                        return regexp[6:-1]
-            except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer):
-                pass
-            except Exception:
-                pass
+    async def _resolve_smp_url_async(
+        self, hostname: str
+    ) -> tuple[Optional[str], Optional[float]]:
+        """
+        Résout l'URL du SMP via DNS sans bloquer la boucle d'événements.
 
-            # Fallback vers CNAME
-            try:
-                answers = dns.resolver.resolve(hostname, "CNAME")
-                cname = str(answers[0].target).rstrip(".")
-                return f"https://{cname}"
-            except dns.resolver.NXDOMAIN:
-                return None
-            except Exception:
-                return None
+        Les requêtes NAPTR et CNAME sont envoyées en parallèle;
+        NAPTR est prioritaire, CNAME sert de fallback.
+
+        Args:
+            hostname: Hostname SML généré
+
+        Returns:
+            Tuple (URL du SMP ou None si non trouvé, TTL DNS ou None si inconnu)
+
+        Raises:
+            TimeoutError: si aucune des deux requêtes n'a abouti dans le délai
+        """
+        # Si un mock est configuré, l'utiliser (synchrone ou coroutine)
+        if self._dns_resolver is not None:
+            smp_url = self._dns_resolver(hostname)
+            if inspect.isawaitable(smp_url):
+                smp_url = await smp_url
+            return smp_url, None
 
+        try:
+            import dns.asyncresolver  # noqa: F401
         except ImportError:
             # dnspython non disponible - mode dégradé
-            return None
+            return None, None
+
+        naptr, cname = await asyncio.gather(
+            self._query_dns(hostname, "NAPTR"),
+            self._query_dns(hostname, "CNAME"),
+            return_exceptions=True,
+        )
+
+        errors = [a for a in (naptr, cname) if isinstance(a, BaseException)]
+
+        if naptr is not None and not isinstance(naptr, BaseException):
+            for rdata in naptr:
+                regexp = rdata.regexp
+                if isinstance(regexp, bytes):
+                    regexp = regexp.decode("utf-8", errors="replace")
+                smp_url = smp_url_from_naptr(regexp)
+                if smp_url:
+                    return smp_url, naptr.rrset.ttl
+
+        if cname is not None and not isinstance(cname, BaseException):
+            target = str(cname[0].target).rstrip(".")
+            return f"https://{target}", cname.rrset.ttl
+
+        # aucune réponse exploitable: une erreur n'est pas une absence
+        if errors:
+            raise errors[0]
+
+        return None, None
 
     def set_mock_smp_response(
         self,
@@ -219,67 +819,441 @@ class PeppolLookupService:
                     smp_url=mock["smp_url"],
                 )
 
+        # Vérifier le cache (positif ou négatif)
+        cache_key = (scheme_id.lower(), participant_id.lower(), doc_type_id)
+        cached = self._lookup_cache.get(cache_key, _MISSING)
+        if cached is not _MISSING:
+            return cached
+
+        # Regrouper les lookups identiques déjà en cours (single-flight)
+        task = self._inflight.get(cache_key)
+        if task is None:
+            task = self._start_lookup(
+                cache_key, scheme_id, participant_id, document_type, doc_type_id
+            )
+        else:
+            self.coalesced_lookups += 1
+
+        # shield: l'annulation d'un appelant n'annule pas le lookup partagé
+        return await asyncio.shield(task)
+
+    def _start_lookup(
+        self,
+        cache_key: tuple[str, str, str],
+        scheme_id: str,
+        participant_id: str,
+        document_type: str,
+        doc_type_id: str,
+    ) -> asyncio.Future:
+        """Lance un lookup partagé par les appelants concurrents."""
+        task = asyncio.ensure_future(
+            self._lookup_and_cache(
+                cache_key, scheme_id, participant_id, document_type, doc_type_id
+            )
+        )
+        self._inflight[cache_key] = task
+        task.add_done_callback(lambda _: self._inflight.pop(cache_key, None))
+        return task
+
+    async def _lookup_and_cache(
+        self,
+        cache_key: tuple[str, str, str],
+        scheme_id: str,
+        participant_id: str,
+        document_type: str,
+        doc_type_id: str,
+    ) -> PeppolLookupResult:
+        """Effectue le lookup et mémorise son résultat dans le cache."""
+        if self._snapshot is not None:
+            # lecture SQLite dans un thread: la boucle d'événements reste libre
+            restored = await asyncio.to_thread(self._snapshot.get, cache_key)
+            if restored is not None:
+                data, ttl = restored
+                result = lookup_result_from_dict(data)
+                self.snapshot_hits += 1
+                self._lookup_cache.set(cache_key, result, ttl)
+                return result
+
+        result, ttl = await self._lookup_uncached(
+            scheme_id, participant_id, document_type, doc_type_id
+        )
+        self._store_result(cache_key, result, ttl)
+        return result
+
+    def _store_result(
+        self,
+        cache_key: tuple[str, str, str],
+        result: PeppolLookupResult,
+        ttl: float,
+    ):
+        """Mémorise un résultat dans le cache (et son instantané)."""
+        self._lookup_cache.set(cache_key, result, ttl)
+        if self._snapshot is not None and self._lookup_cache.maxsize > 0 and ttl > 0:
+            self._snapshot_writes.append((cache_key, asdict(result), ttl))
+            if self._snapshot_writer is None:
+                self._snapshot_writer = asyncio.ensure_future(self._write_snapshot())
+
+    async def _write_snapshot(self):
+        """
+        Recopie les écritures en attente dans l'instantané, par lots et dans
+        un thread pour ne pas bloquer la boucle d'événements.
+        """
+        try:
+            while self._snapshot_writes:
+                writes, self._snapshot_writes = self._snapshot_writes, []
+                await asyncio.to_thread(self._put_snapshot, writes)
+        finally:
+            self._snapshot_writer = None
+
+    def _put_snapshot(self, writes: list[tuple[tuple[str, str, str], dict, float]]):
+        for cache_key, data, ttl in writes:
+            self._snapshot.put(cache_key, data, ttl)
+
+    async def _lookup_uncached(
+        self,
+        scheme_id: str,
+        participant_id: str,
+        document_type: str,
+        doc_type_id: str,
+    ) -> tuple[PeppolLookupResult, float]:
+        """
+        Effectue le lookup SML + SMP sans passer par le cache de résultats.
+
+        Args:
+            scheme_id: Scheme ID
+            participant_id: Identifiant participant
+            document_type: Type de document tel que demandé (pour les messages)
+            doc_type_id: Identifiant PEPPOL complet du document type
+
+        Returns:
+            Tuple (PeppolLookupResult, durée de cache en secondes; 0 si le
+            résultat ne doit pas être mis en cache)
+        """
         # Étape 1: Générer le hostname SML
-        hostname = compute_sml_hostname(scheme_id, participant_id)
+        hostname = compute_sml_hostname(
+            self.sml_zone, scheme_id, participant_id, self.sml_hash_scheme
+        )
 
         # Étape 2: Résoudre l'URL du SMP via DNS
-        smp_url = self._resolve_smp_url_sync(hostname)
+        try:
+            smp_url = await self._resolve_smp_url(hostname)
+        except TimeoutError:
+            return PeppolLookupResult(
+                success=False,
+                error_code="SML_TIMEOUT",
+                error_message=f"Timeout DNS lors de la résolution de {hostname}",
+            ), 0
+        except Exception as e:
+            return PeppolLookupResult(
+                success=False,
+                error_code="SML_ERROR",
+                error_message=str(e),
+            ), 0
 
         if not smp_url:
             return PeppolLookupResult(
                 success=False,
                 error_code="PARTICIPANT_NOT_FOUND",
                 error_message=f"Participant {scheme_id}::{participant_id} non trouvé dans le SML",
+            ), self.negative_cache_ttl
+
+        # Étape 3: document types du participant (ServiceGroup en cache)
+        host = urlsplit(smp_url).netloc
+        group_key = (scheme_id.lower(), participant_id.lower())
+        document_types = self._service_group_cache.get(group_key, _MISSING)
+        if document_types not in (_MISSING, None) and doc_type_id not in document_types:
+            return self._unsupported(smp_url, document_type)
+
+        # Étape 4: Requêtes HTTP vers le SMP (chacune admise par son disjoncteur)
+        if document_types is not _MISSING:
+            return await self._fetch_lookup_result(
+                host, smp_url, scheme_id, participant_id, document_type, doc_type_id
             )
 
-        # Étape 3: Requête HTTP vers le SMP
+        # ServiceGroup inconnu: lu en parallèle avec le ServiceMetadata
+        # demandé, pour un seul aller-retour SMP sur le chemin critique
+        # (disjoncteur semi-ouvert: seule la première requête part)
+        requested = asyncio.ensure_future(
+            self._fetch_lookup_result(
+                host, smp_url, scheme_id, participant_id, document_type, doc_type_id
+            )
+        )
         try:
-            endpoint = await self._fetch_smp_metadata(
-                smp_url, scheme_id, participant_id, doc_type_id
+            services = await self._participant_services(
+                host, smp_url, scheme_id, participant_id
             )
-
-            if endpoint:
-                return PeppolLookupResult(
-                    success=True,
-                    endpoint=endpoint,
-                    smp_url=smp_url,
-                )
-            else:
-                return PeppolLookupResult(
-                    success=False,
-                    error_code="DOCUMENT_TYPE_NOT_SUPPORTED",
-                    error_message=f"Le participant ne supporte pas le document type {document_type}",
-                    smp_url=smp_url,
-                )
-
-        except httpx.TimeoutException:
+        except BaseException:
+            requested.cancel()
+            raise
+        if (
+            services.document_types is not None
+            and doc_type_id not in services.document_types
+        ):
+            requested.cancel()
+            return self._unsupported(smp_url, document_type)
+        return await requested
+
+    def _unsupported(
+        self, smp_url: str, document_type: str
+    ) -> tuple[PeppolLookupResult, float]:
+        return PeppolLookupResult(
+            success=False,
+            error_code="DOCUMENT_TYPE_NOT_SUPPORTED",
+            error_message=f"Le participant ne supporte pas le document type {document_type}",
+            smp_url=smp_url,
+        ), self.negative_cache_ttl
+
+    def _circuit_open(
+        self, host: str, smp_url: str
+    ) -> tuple[PeppolLookupResult, float]:
+        return PeppolLookupResult(
+            success=False,
+            error_code="SMP_CIRCUIT_OPEN",
+            error_message=f"SMP {host} indisponible (disjoncteur ouvert)",
+            smp_url=smp_url,
+        ), 0
+
+    def _smp_failure(
+        self, host: str, smp_url: str, error: Exception, latency: float
+    ) -> tuple[PeppolLookupResult, float]:
+        """Convertit l'échec d'une requête SMP en résultat et met à jour le disjoncteur."""
+        if isinstance(error, SmpResponseTooLarge):
+            # le SMP a répondu: réponse refusée, pas une panne de l'hôte
+            self.smp_health.record_success(host, latency)
+            return PeppolLookupResult(
+                success=False,
+                error_code="SMP_ERROR",
+                error_message=str(error),
+                smp_url=smp_url,
+            ), 0
+        if isinstance(error, httpx.TimeoutException):
+            self.smp_health.record_failure(host)
             return PeppolLookupResult(
                 success=False,
                 error_code="SMP_TIMEOUT",
                 error_message="Timeout lors de la requête SMP",
                 smp_url=smp_url,
-            )
-        except httpx.HTTPStatusError as e:
-            if e.response.status_code == 503:
+            ), 0
+        if isinstance(error, httpx.HTTPStatusError):
+            if error.response.status_code >= 500:
+                self.smp_health.record_failure(host)
+            else:
+                self.smp_health.record_success(host, latency)
+            if error.response.status_code == 503:
                 return PeppolLookupResult(
                     success=False,
                     error_code="SMP_UNAVAILABLE",
                     error_message="SMP temporairement indisponible",
                     smp_url=smp_url,
-                )
+                ), 0
             return PeppolLookupResult(
                 success=False,
                 error_code="SMP_ERROR",
-                error_message=f"Erreur SMP: {e.response.status_code}",
+                error_message=f"Erreur SMP: {error.response.status_code}",
                 smp_url=smp_url,
+            ), 0
+        self.smp_health.record_failure(host)
+        return PeppolLookupResult(
+            success=False,
+            error_code="SMP_ERROR",
+            error_message=str(error),
+            smp_url=smp_url,
+        ), 0
+
+    async def _fetch_lookup_result(
+        self,
+        host: str,
+        smp_url: str,
+        scheme_id: str,
+        participant_id: str,
+        document_type: str,
+        doc_type_id: str,
+    ) -> tuple[PeppolLookupResult, float]:
+        """Récupère le ServiceMetadata d'un document type et le convertit en résultat."""
+        if not self.smp_health.allow(host):
+            return self._circuit_open(host, smp_url)
+        started_at = time.monotonic()
+        try:
+            endpoint, ttl = await self._fetch_smp_metadata_hedged(
+                host, smp_url, scheme_id, participant_id, doc_type_id
             )
+        except asyncio.CancelledError:
+            self.smp_health.release(host)
+            raise
         except Exception as e:
+            return self._smp_failure(host, smp_url, e, time.monotonic() - started_at)
+
+        self.smp_health.record_success(host, time.monotonic() - started_at)
+        if endpoint:
             return PeppolLookupResult(
-                success=False,
-                error_code="SMP_ERROR",
-                error_message=str(e),
+                success=True,
+                endpoint=endpoint,
                 smp_url=smp_url,
+            ), self._cache_ttl(ttl)
+        return self._unsupported(smp_url, document_type)
+
+    async def _participant_services(
+        self, host: str, smp_url: str, scheme_id: str, participant_id: str
+    ) -> ParticipantServices:
+        """
+        Récupère les services d'un participant (une seule fois pour les
+        appelants concurrents).
+        """
+        key = (scheme_id.lower(), participant_id.lower())
+        task = self._inflight_services.get(key)
+        if task is None:
+            task = asyncio.ensure_future(
+                self._fetch_participant_services(
+                    host, smp_url, scheme_id, participant_id
+                )
             )
+            self._inflight_services[key] = task
+            task.add_done_callback(
+                lambda _: self._inflight_services.pop(key, None)
+            )
+        return await asyncio.shield(task)
+
+    async def _fetch_participant_services(
+        self, host: str, smp_url: str, scheme_id: str, participant_id: str
+    ) -> ParticipantServices:
+        """
+        Lit le ServiceGroup du participant, le met en cache et lance en tâche
+        de fond le préchargement des document types connus qu'il annonce.
+        """
+        if not self.smp_health.allow(host):
+            return ParticipantServices(error=self._circuit_open(host, smp_url))
+        started_at = time.monotonic()
+        try:
+            document_types, ttl = await self._fetch_service_group(
+                smp_url, scheme_id, participant_id
+            )
+        except asyncio.CancelledError:
+            self.smp_health.release(host)
+            raise
+        except Exception as e:
+            return ParticipantServices(
+                error=self._smp_failure(
+                    host, smp_url, e, time.monotonic() - started_at
+                )
+            )
+        self.smp_health.record_success(host, time.monotonic() - started_at)
+        group_key = (scheme_id.lower(), participant_id.lower())
+        if document_types is None:
+            # pas de ServiceGroup: requêtes par document type pendant un temps
+            self._service_group_cache.set(group_key, None, self.negative_cache_ttl)
+            return ParticipantServices()
+
+        self._service_group_cache.set(group_key, document_types, self._cache_ttl(ttl))
+        self._prefetch(scheme_id, participant_id, document_types)
+        return ParticipantServices(document_types=document_types)
+
+    def _prefetch(
+        self, scheme_id: str, participant_id: str, document_types: frozenset[str]
+    ):
+        """
+        Précharge dans le cache les ServiceMetadata des document types connus
+        annoncés par le ServiceGroup (hors lookups déjà en cours ou en cache).
+        """
+        if self._lookup_cache.maxsize == 0:
+            return
+        participant = (scheme_id.lower(), participant_id.lower())
+        for doc_type_id in PEPPOL_DOCUMENT_TYPES.values():
+            cache_key = (*participant, doc_type_id)
+            if (
+                doc_type_id not in document_types
+                or cache_key in self._inflight
+                or cache_key in self._lookup_cache
+            ):
+                continue
+            task = self._start_lookup(
+                cache_key, scheme_id, participant_id, doc_type_id, doc_type_id
+            )
+            self._prefetches.add(task)
+            task.add_done_callback(self._prefetches.discard)
+
+    async def _fetch_service_group(
+        self, smp_url: str, scheme_id: str, participant_id: str
+    ) -> tuple[Optional[frozenset[str]], Optional[float]]:
+        """
+        Récupère la liste des document types d'un participant (ServiceGroup).
+
+        Args:
+            smp_url: URL de base du SMP
+            scheme_id: Scheme ID
+            participant_id: Identifiant participant
+
+        Returns:
+            Tuple (document types ou None si le SMP ne fournit pas de
+            ServiceGroup exploitable, durée de cache annoncée ou None)
+        """
+        participant_identifier = f"iso6523-actorid-upis::{scheme_id}::{participant_id}"
+        url = f"{smp_url}/{participant_identifier}"
+
+        client = await self._get_client()
+        timeout = self.smp_health.timeout_for(urlsplit(smp_url).netloc)
+        async with (
+            self._host_semaphore(smp_url),
+            client.stream("GET", url, timeout=timeout) as response,
+        ):
+            # listing refusé ou absent: repli sur les requêtes par document type
+            if 400 <= response.status_code < 500:
+                return None, None
+
+            response.raise_for_status()
+
+            content = bytearray()
+            async for chunk in response.aiter_bytes():
+                content += chunk
+                if len(content) > self.max_smp_response_size:
+                    raise SmpResponseTooLarge(
+                        f"Réponse SMP supérieure à {self.max_smp_response_size} octets"
+                    )
+            return parse_service_group(bytes(content)), parse_cache_ttl(
+                response.headers
+            )
+
+    async def _fetch_smp_metadata_hedged(
+        self,
+        host: str,
+        smp_url: str,
+        scheme_id: str,
+        participant_id: str,
+        document_type_id: str,
+    ) -> tuple[Optional[PeppolEndpoint], Optional[float]]:
+        """
+        Récupère les métadonnées SMP, avec une requête de secours si activée.
+
+        Si `hedge_requests` est actif et que la première requête dépasse la
+        latence p95 de l'hôte, une seconde requête identique est lancée;
+        la première réponse valide est retenue et l'autre requête annulée.
+        """
+        args = (smp_url, scheme_id, participant_id, document_type_id)
+        delay = self.smp_health.hedge_delay(host) if self.hedge_requests else None
+        if delay is None:
+            return await self._fetch_smp_metadata(*args)
+
+        tasks = {asyncio.ensure_future(self._fetch_smp_metadata(*args))}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            # requête de secours admise par le disjoncteur (refusée pendant
+            # la requête de test d'un disjoncteur semi-ouvert)
+            if not done and self.smp_health.allow(host):
+                self.hedged_requests += 1
+                tasks.add(asyncio.ensure_future(self._fetch_smp_metadata(*args)))
+
+            error: Optional[BaseException] = None
+            while tasks:
+                done, tasks = await asyncio.wait(
+                    tasks, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = error or task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
 
     async def _fetch_smp_metadata(
         self,
@@ -287,7 +1261,7 @@ class PeppolLookupService:
         scheme_id: str,
         participant_id: str,
         document_type_id: str,
-    ) -> Optional[PeppolEndpoint]:
+    ) -> tuple[Optional[PeppolEndpoint], Optional[float]]:
         """
         Récupère les métadonnées depuis le SMP.
 
@@ -298,92 +1272,170 @@ class PeppolLookupService:
             document_type_id: Type de document PEPPOL
 
         Returns:
-            PeppolEndpoint ou None si non trouvé
+            Tuple (PeppolEndpoint ou None si non trouvé, durée de cache
+            annoncée par le SMP ou None)
         """
         participant_identifier = f"iso6523-actorid-upis::{scheme_id}::{participant_id}"
         encoded_doc_type = quote(document_type_id, safe="")
 
         url = f"{smp_url}/{participant_identifier}/services/{encoded_doc_type}"
 
-        async with httpx.AsyncClient(timeout=self.timeout) as client:
-            response = await client.get(url, headers={"Accept": "application/xml"})
-
+        client = await self._get_client()
+        timeout = self.smp_health.timeout_for(urlsplit(smp_url).netloc)
+        async with (
+            self._host_semaphore(smp_url),
+            client.stream("GET", url, timeout=timeout) as response,
+        ):
             if response.status_code == 404:
-                return None
+                return None, None
 
             response.raise_for_status()
-            return self._parse_smp_response(response.text)
 
-    def _parse_smp_response(self, xml_content: str) -> Optional[PeppolEndpoint]:
+            # Parse au fil de la réception; le reste de la réponse est lu
+            # sans être parsé pour que la connexion reste réutilisable
+            parser = SmpEndpointParser(max_size=self.max_smp_response_size)
+            try:
+                async for chunk in response.aiter_bytes():
+                    if parser.feed(chunk) and parser.size > parser.max_size:
+                        break
+                endpoint = parser.close()
+            except ET.ParseError:
+                endpoint = None
+
+            return endpoint, parse_cache_ttl(response.headers)
+
+    def _parse_smp_response(
+        self, xml_content: str | bytes
+    ) -> Optional[PeppolEndpoint]:
         """
         Parse la réponse XML du SMP.
 
         Args:
-            xml_content: Contenu XML de la réponse SMP
+            xml_content: Contenu XML de la réponse SMP (texte ou octets bruts)
 
         Returns:
             PeppolEndpoint extrait ou None
         """
-        import xml.etree.ElementTree as ET
+        return parse_smp_endpoint(xml_content, max_size=self.max_smp_response_size)
 
-        namespaces = {
-            "smp": "http://busdox.org/serviceMetadata/publishing/1.0/",
-            "wsa": "http://www.w3.org/2005/08/addressing",
-        }
+    async def lookup_many(
+        self,
+        participants: Iterable[Participant],
+        document_type: str = "invoice_ubl",
+        concurrency: int = 50,
+        per_smp_concurrency: Optional[int] = None,
+        stats: Optional[LookupManyStats] = None,
+    ) -> AsyncIterator[tuple[tuple[str, str], PeppolLookupResult]]:
+        """
+        Recherche les endpoints PEPPOL d'un grand nombre de participants.
 
-        try:
-            root = ET.fromstring(xml_content)
+        Les lookups sont exécutés en parallèle et les résultats produits
+        dans l'ordre où ils se terminent. Le SML est résolu avant
+        d'occuper une place de concurrence, afin qu'un SMP lent n'occupe
+        jamais plus de `per_smp_concurrency` places.
 
-            # Chercher l'endpoint AS4
-            endpoint = root.find(
-                './/smp:Endpoint[@transportProfile="peppol-transport-as4-v2_0"]',
-                namespaces,
-            )
+        Exemple:
+            async for (scheme_id, participant_id), result in service.lookup_many(sirens):
+                ...
 
-            if endpoint is None:
-                # Essayer sans namespace
-                for elem in root.iter():
-                    if "Endpoint" in elem.tag:
-                        if elem.get("transportProfile") == "peppol-transport-as4-v2_0":
-                            endpoint = elem
-                            break
-
-            if endpoint is None:
-                return None
-
-            # Extraire l'adresse
-            address = None
-            for child in endpoint.iter():
-                if "Address" in child.tag:
-                    address = child.text
-                    break
+        Args:
+            participants: SIREN/SIRET (scheme déduit de la longueur) ou
+                tuples (scheme_id, participant_id); lus au fur et à mesure
+            document_type: Type de document
+            concurrency: Nombre maximal de lookups simultanés
+            per_smp_concurrency: Nombre maximal de lookups simultanés vers
+                un même SMP (défaut: concurrency / 4)
+            stats: Statistiques à mettre à jour (débit, erreurs par code)
 
-            # Extraire le certificat
-            certificate = None
-            for child in endpoint.iter():
-                if "Certificate" in child.tag:
-                    certificate = child.text
-                    break
+        Yields:
+            Tuples ((scheme_id, participant_id), PeppolLookupResult)
+        """
+        if stats is None:
+            stats = LookupManyStats()
+        if per_smp_concurrency is None:
+            per_smp_concurrency = max(1, concurrency // 4)
+
+        slots = asyncio.Semaphore(concurrency)
+        smp_slots: dict[str, asyncio.Semaphore] = {}
 
-            # Extraire la description
-            description = None
-            for child in endpoint.iter():
-                if "ServiceDescription" in child.tag:
-                    description = child.text
+        async def lookup_one(scheme_id: str, participant_id: str):
+            # Résolution SML (cachée), pour connaître le SMP à ménager
+            try:
+                smp_url = await self._resolve_smp_url(
+                    compute_sml_hostname(
+                        self.sml_zone, scheme_id, participant_id, self.sml_hash_scheme
+                    )
+                )
+            except Exception:
+                smp_url = None
+
+            if smp_url:
+                host = urlsplit(smp_url).netloc
+                if host not in smp_slots:
+                    smp_slots[host] = asyncio.Semaphore(per_smp_concurrency)
+                smp_slot = smp_slots[host]
+            else:
+                smp_slot = contextlib.nullcontext()
+
+            async with smp_slot, slots:
+                result = await self.lookup(scheme_id, participant_id, document_type)
+            return (scheme_id, participant_id), result
+
+        started_at = time.monotonic()
+        source = iter(participants)
+        window = concurrency * LOOKUP_MANY_WINDOW
+        pending: set[asyncio.Future] = set()
+        exhausted = False
+        try:
+            while True:
+                while not exhausted and len(pending) < window:
+                    participant = next(source, None)
+                    if participant is None:
+                        exhausted = True
+                        break
+                    pending.add(
+                        asyncio.ensure_future(
+                            lookup_one(*participant_key(participant))
+                        )
+                    )
+
+                if not pending:
                     break
 
-            if address is None or certificate is None:
-                return None
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    key, result = task.result()
+                    stats.record(result, time.monotonic() - started_at)
+                    yield key, result
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def is_cached(
+        self, scheme_id: str, participant_id: str, document_type: str = "invoice_ubl"
+    ) -> bool:
+        """
+        Résultat de lookup en cache pour un participant (aucune requête, les
+        compteurs du cache ne changent pas).
+        """
+        doc_type_id = PEPPOL_DOCUMENT_TYPES.get(document_type, document_type)
+        return (scheme_id.lower(), participant_id.lower(), doc_type_id) in self._lookup_cache
 
-            return PeppolEndpoint(
-                address=address,
-                certificate=certificate,
-                transport_profile="peppol-transport-as4-v2_0",
-                service_description=description,
-            )
+    def cached_smp_host(self, scheme_id: str, participant_id: str) -> Optional[str]:
+        """
+        Hôte du SMP d'un participant si sa résolution SML est en cache
+        (aucune requête DNS).
 
-        except ET.ParseError:
-            return None
+        Returns:
+            Hôte (ex: "smp.example.com") ou None si inconnu
+        """
+        hostname = compute_sml_hostname(
+            self.sml_zone, scheme_id, participant_id, self.sml_hash_scheme
+        )
+        smp_url = self._smp_url_cache.peek(hostname)
+        return urlsplit(smp_url).netloc if smp_url else None
 
     async def lookup_by_siren(
         self, siren: str, document_type: str = "invoice_ubl"
@@ -0,0 +1,220 @@
+# SPDX-FileCopyrightText: 2026 Philippe ENTZMANN <philippe@entzmann.name>
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+"""
+Dépôt groupé des factures routées vers le PPF (fallback).
+
+Plutôt qu'un appel HTTP par facture, les factures `ROUTED_TO_PPF` sont
+regroupées en lots:
+- un lot part dès qu'il atteint `max_batch_size` factures ou `max_batch_bytes`
+  octets, ou `max_wait` secondes après l'arrivée de sa première facture
+- le lot est envoyé compressé (gzip) en un seul appel
+- le PPF répond facture par facture: chaque appelant de `submit()` reçoit le
+  résultat de sa propre facture
+
+Format d'un lot (JSON, `Content-Encoding: gzip`):
+
+    {"batch_id": "...", "invoices": [{"ref": "0", "invoice_id": "...",
+     "sender": "...", "recipient": "...", "document_type": "...",
+     "payload": "<base64>"}, ...]}
+
+Le contenu des factures (XML, PDF Factur-X) est transmis en base64.
+
+Réponse attendue:
+
+    {"batch_id": "...", "results": [{"ref": "0", "status": "accepted"},
+     {"ref": "1", "status": "rejected", "error": "..."}, ...]}
+"""
+
+import asyncio
+import base64
+import gzip
+import json
+import logging
+import uuid
+from dataclasses import dataclass, field
+from typing import Optional, Self
+
+import httpx
+
+from .models import InvoiceMessage, PpfSubmissionResult
+
+logger = logging.getLogger(__name__)
+
+# Chemin de dépôt des lots sur l'API PPF
+PPF_BATCH_PATH = "/v1/factures/lots"
+
+
+@dataclass
+class _Batch:
+    batch_id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    invoices: list[dict] = field(default_factory=list)
+    futures: list[asyncio.Future] = field(default_factory=list)
+    size: int = 0
+    timer: Optional[asyncio.TimerHandle] = None
+
+
+class PpfSubmitter:
+    """Regroupe les factures destinées au PPF en dépôts compressés."""
+
+    def __init__(
+        self,
+        base_url: str,
+        max_batch_size: int = 100,
+        max_batch_bytes: int = 5 * 1024 * 1024,
+        max_wait: float = 0.5,
+        timeout: float = 30.0,
+        compresslevel: int = 6,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ):
+        """
+        Args:
+            base_url: URL de l'API PPF
+            max_batch_size: Nombre de factures déclenchant l'envoi d'un lot
+            max_batch_bytes: Taille cumulée des factures déclenchant l'envoi
+            max_wait: Délai maximal d'attente d'une facture avant envoi du lot
+            timeout: Timeout d'un dépôt en secondes
+            compresslevel: Niveau de compression gzip des lots
+            transport: Transport HTTP (pour les tests)
+        """
+        self.base_url = base_url.rstrip("/")
+        self.max_batch_size = max_batch_size
+        self.max_batch_bytes = max_batch_bytes
+        self.max_wait = max_wait
+        self.timeout = timeout
+        self.compresslevel = compresslevel
+        self._transport = transport
+        self._client: Optional[httpx.AsyncClient] = None
+        self._batch = _Batch()
+        self._uploads: set[asyncio.Task] = set()
+        self.batches = 0
+        self.bytes_sent = 0
+
+    async def start(self) -> Self:
+        """Ouvre le client HTTP vers le PPF."""
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout, transport=self._transport
+            )
+        return self
+
+    async def close(self):
+        """Envoie le lot en cours, attend les dépôts et ferme le client HTTP."""
+        self.flush()
+        if self._uploads:
+            await asyncio.gather(*self._uploads, return_exceptions=True)
+        if self._client is not None:
+            client, self._client = self._client, None
+            await client.aclose()
+
+    async def __aenter__(self) -> Self:
+        return await self.start()
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb) -> None:
+        await self.close()
+
+    async def submit(self, message: InvoiceMessage) -> PpfSubmissionResult:
+        """
+        Ajoute une facture au lot en cours et attend le résultat de son dépôt.
+
+        Returns:
+            PpfSubmissionResult de cette facture (jamais d'exception)
+        """
+        batch = self._batch
+        invoice = {
+            "ref": str(len(batch.invoices)),
+            "invoice_id": message.invoice_id,
+            "sender": message.sender_siret or message.sender_siren,
+            "recipient": message.recipient_siret or message.recipient_siren,
+            "document_type": message.document_type,
+            "payload": base64.b64encode(message.payload).decode(),
+        }
+        size = len(message.payload)
+        if batch.invoices and batch.size + size > self.max_batch_bytes:
+            # la facture ne tient plus dans le lot en cours
+            self.flush()
+            return await self.submit(message)
+
+        future = asyncio.get_running_loop().create_future()
+        batch.invoices.append(invoice)
+        batch.futures.append(future)
+        batch.size += size
+
+        if len(batch.invoices) >= self.max_batch_size or batch.size >= self.max_batch_bytes:
+            self.flush()
+        elif batch.timer is None:
+            batch.timer = asyncio.get_running_loop().call_later(self.max_wait, self.flush)
+        return await future
+
+    def flush(self):
+        """Envoie le lot en cours (sans attendre la réponse)."""
+        batch, self._batch = self._batch, _Batch()
+        if batch.timer is not None:
+            batch.timer.cancel()
+        if not batch.invoices:
+            return
+        task = asyncio.create_task(self._upload(batch))
+        self._uploads.add(task)
+        task.add_done_callback(self._uploads.discard)
+
+    async def _upload(self, batch: _Batch):
+        # compression hors de la boucle d'événements (lots de plusieurs Mo)
+        body = await asyncio.to_thread(
+            gzip.compress,
+            json.dumps({"batch_id": batch.batch_id, "invoices": batch.invoices}).encode(),
+            self.compresslevel,
+        )
+        self.batches += 1
+        self.bytes_sent += len(body)
+        try:
+            results = await self._post(body)
+        except Exception as e:
+            logger.warning("routage: échec du dépôt PPF %s: %s", batch.batch_id, e)
+            results = {}
+            # lot refusé (4xx): inutile de réessayer; réseau, 5xx: transitoire
+            rejected = (
+                isinstance(e, httpx.HTTPStatusError) and e.response.status_code < 500
+            )
+            error = PpfSubmissionResult(
+                success=False,
+                batch_id=batch.batch_id,
+                error_message=str(e),
+                retryable=not rejected,
+            )
+        else:
+            error = PpfSubmissionResult(
+                success=False,
+                batch_id=batch.batch_id,
+                error_message="Facture absente de la réponse PPF",
+            )
+
+        for invoice, future in zip(batch.invoices, batch.futures):
+            if future.done():
+                continue
+            item = results.get(invoice["ref"])
+            if item is None:
+                future.set_result(error)
+            else:
+                future.set_result(
+                    PpfSubmissionResult(
+                        success=item.get("status") == "accepted",
+                        batch_id=batch.batch_id,
+                        error_message=item.get("error"),
+                    )
+                )
+
+    async def _post(self, body: bytes) -> dict[str, dict]:
+        """Dépose un lot; retourne les résultats par référence de facture."""
+        if self._client is None:
+            await self.start()
+        response = await self._client.post(
+            self.base_url + PPF_BATCH_PATH,
+            content=body,
+            headers={"Content-Type": "application/json", "Content-Encoding": "gzip"},
+        )
+        if response.status_code != 200:
+            raise httpx.HTTPStatusError(
+                f"HTTP {response.status_code}", request=response.request, response=response
+            )
+        return {item["ref"]: item for item in response.json().get("results", [])}
@@ -0,0 +1,290 @@
+# SPDX-FileCopyrightText: 2026 Philippe ENTZMANN <philippe@entzmann.name>
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+"""
+Réessais différés des factures en attente (`RoutingStatus.PENDING`).
+
+Une facture dont le routage a échoué de façon transitoire (SMP en timeout,
+503, disjoncteur ouvert, AP injoignable) est planifiée pour être réinjectée
+dans routage-IN après un délai exponentiel avec gigue.
+
+- les réessais sont enregistrés dans une base SQLite locale avant d'être
+  acquittés: ils survivent au redémarrage de la brique. Les accès à la base
+  sont faits dans un thread (`asyncio.to_thread`), hors de la boucle
+  d'événements
+- l'échéancier est un tas (échéance, clé): seules les clés sont en mémoire,
+  les messages restent sur disque, ce qui tient des centaines de milliers de
+  factures en attente
+- la réinjection est limitée en débit (seau à jetons), pour ne pas inonder
+  un SMP qui redémarre avec toutes les factures accumulées pendant la panne
+"""
+
+import asyncio
+import heapq
+import json
+import logging
+import random
+import sqlite3
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Optional
+
+import msgpack
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS retry (
+    key TEXT PRIMARY KEY,
+    due_at REAL NOT NULL,
+    correlation_id TEXT,
+    -- msgpack (documents en octets bruts); JSON pour les anciens réessais
+    message BLOB NOT NULL
+) WITHOUT ROWID;
+"""
+
+# Réinjection d'un message: publish(message, correlation_id)
+Publish = Callable[[dict, Optional[str]], Awaitable[Any]]
+
+
+@dataclass
+class RetryPolicy:
+    """Délais entre tentatives: exponentiels, plafonnés, avec gigue."""
+
+    base_delay: float = 5.0
+    max_delay: float = 3600.0
+    multiplier: float = 2.0
+    max_attempts: int = 10
+
+    def delay(self, attempt: int, rnd: Optional[random.Random] = None) -> float:
+        """
+        Délai avant la tentative suivant la tentative `attempt` (0 = première).
+
+        Gigue "equal jitter": entre la moitié et la totalité du plafond
+        exponentiel, pour étaler les réessais nés d'une même panne.
+        """
+        cap = min(self.max_delay, self.base_delay * self.multiplier**attempt)
+        return cap / 2 + (rnd or random).uniform(0, cap / 2)
+
+
+class RetryStore:
+    """
+    Réessais planifiés, persistés dans SQLite.
+
+    Méthodes synchrones protégées par un verrou: `RetryScheduler` les
+    appelle depuis un thread.
+    """
+
+    def __init__(self, path: str | Path | None = None):
+        """
+        Args:
+            path: Fichier SQLite (créé si absent); None: en mémoire, non durable
+        """
+        if path is not None:
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self._db = sqlite3.connect(
+            ":memory:" if path is None else path, check_same_thread=False
+        )
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+        self._lock = threading.Lock()
+
+    def put(self, key: str, due_at: float, message: dict, correlation_id: Optional[str]):
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO retry (key, due_at, correlation_id, message) "
+                "VALUES (?, ?, ?, ?)",
+                (key, due_at, correlation_id, msgpack.packb(message)),
+            )
+
+    def get(self, key: str) -> Optional[tuple[dict, Optional[str]]]:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT message, correlation_id FROM retry WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        data, correlation_id = row
+        if isinstance(data, str):
+            return json.loads(data), correlation_id
+        return msgpack.unpackb(data), correlation_id
+
+    def delete(self, key: str):
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM retry WHERE key = ?", (key,))
+
+    def reschedule(self, key: str, due_at: float):
+        with self._lock, self._db:
+            self._db.execute("UPDATE retry SET due_at = ? WHERE key = ?", (due_at, key))
+
+    def schedule(self) -> list[tuple[float, str]]:
+        """(échéance, clé) de tous les réessais enregistrés."""
+        with self._lock:
+            return self._db.execute("SELECT due_at, key FROM retry").fetchall()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT count(*) FROM retry").fetchone()[0]
+
+    def close(self):
+        if self.path is None:
+            # en mémoire: fermer perdrait les réessais, la brique peut être
+            # redémarrée dans le même processus (monolith)
+            return
+        with self._lock:
+            self._db.close()
+
+
+class TokenBucket:
+    """Limite de débit: `rate` opérations par seconde, rafales de `burst`."""
+
+    def __init__(self, rate: float, burst: int = 1, clock: Callable[[], float] = time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self._clock = clock
+        self._tokens = float(burst)
+        self._updated = clock()
+
+    def delay(self) -> float:
+        """Prend un jeton; retourne 0 ou le temps à attendre avant de réessayer."""
+        now = self._clock()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0.0
+        return (1 - self._tokens) / self.rate
+
+
+class RetryScheduler:
+    """Échéancier durable des réessais de routage."""
+
+    def __init__(
+        self,
+        publish: Publish,
+        store: Optional[RetryStore] = None,
+        policy: Optional[RetryPolicy] = None,
+        rate: float = 10.0,
+        burst: int = 10,
+        clock: Callable[[], float] = time.time,
+        seed: Optional[int] = None,
+    ):
+        """
+        Args:
+            publish: Réinjection d'un message dans routage-IN
+            store: Persistance des réessais (None: en mémoire)
+            policy: Délais et nombre maximal de tentatives
+            rate: Réinjections par seconde au plus
+            burst: Réinjections consécutives autorisées sans attendre
+            clock: Horloge murale (les échéances survivent au redémarrage)
+            seed: Graine de la gigue (pour les tests)
+        """
+        self.publish = publish
+        self.store = store if store is not None else RetryStore()
+        self.policy = policy or RetryPolicy()
+        self._bucket = TokenBucket(rate, burst)
+        self._clock = clock
+        self._random = random.Random(seed)
+        self._heap: list[tuple[float, str]] = []
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self.scheduled = 0
+        self.reinjected = 0
+        self.exhausted = 0
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    async def start(self):
+        """Recharge les réessais enregistrés et lance la réinjection."""
+        self._heap = await asyncio.to_thread(self.store.schedule)
+        heapq.heapify(self._heap)
+        if self._task is None:
+            # lié à la boucle: la brique peut être redémarrée dans une autre
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Arrête la réinjection; les réessais restants sont conservés."""
+        if self._task is not None:
+            task, self._task = self._task, None
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        await asyncio.to_thread(self.store.close)
+
+    async def schedule(
+        self, message: dict, correlation_id: Optional[str] = None, attempt: int = 0
+    ) -> bool:
+        """
+        Planifie la réinjection d'un message après sa tentative `attempt`.
+
+        Le message réinjecté porte `attempt + 1` dans son champ "attempt".
+
+        Returns:
+            False si le nombre maximal de tentatives est atteint (rien n'est planifié)
+        """
+        if attempt + 1 >= self.policy.max_attempts:
+            self.exhausted += 1
+            return False
+        due_at = self._clock() + self.policy.delay(attempt, self._random)
+        key = uuid.uuid4().hex
+        await asyncio.to_thread(
+            self.store.put, key, due_at, {**message, "attempt": attempt + 1}, correlation_id
+        )
+        self._push(due_at, key)
+        self.scheduled += 1
+        return True
+
+    def _push(self, due_at: float, key: str):
+        heapq.heappush(self._heap, (due_at, key))
+        if self._heap[0][1] == key:
+            # nouvelle échéance la plus proche
+            self._wakeup.set()
+
+    async def _sleep(self, delay: float):
+        """Attend `delay` secondes ou une échéance plus proche."""
+        self._wakeup.clear()
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), delay)
+        except TimeoutError:
+            pass
+
+    async def _run(self):
+        while True:
+            if not self._heap:
+                await self._sleep(None)
+                continue
+            due_at, key = self._heap[0]
+            delay = due_at - self._clock()
+            if delay > 0:
+                await self._sleep(delay)
+                continue
+            delay = self._bucket.delay()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+
+            heapq.heappop(self._heap)
+            entry = await asyncio.to_thread(self.store.get, key)
+            if entry is None:
+                continue
+            message, correlation_id = entry
+            try:
+                await self.publish(message, correlation_id)
+            except Exception:
+                logger.exception("routage: échec de réinjection, nouvel essai")
+                due_at = self._clock() + self.policy.base_delay
+                await asyncio.to_thread(self.store.reschedule, key, due_at)
+                self._push(due_at, key)
+                continue
+            await asyncio.to_thread(self.store.delete, key)
+            self.reinjected += 1
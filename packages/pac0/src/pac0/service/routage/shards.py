@@ -0,0 +1,164 @@
+# SPDX-FileCopyrightText: 2026 Philippe ENTZMANN <philippe@entzmann.name>
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+"""
+Attribution des partitions de routage-IN aux répliques.
+
+Chaque réplique s'annonce dans un bucket NATS KV (`members.<id>`) et
+renouvelle son annonce toutes les `lease / 3` secondes; le TTL du bucket
+efface les répliques arrêtées sans prévenir. Chaque réplique calcule seule
+les partitions qui lui reviennent par hachage de rendez-vous sur la liste
+des membres: toutes les répliques arrivent au même résultat sans élection,
+et l'arrivée ou le départ d'une réplique ne déplace que ses partitions.
+
+Les partitions sont des consumers JetStream durables (voir
+`lib.create_shard_assigner`), partagés par les répliques qui s'y abonnent:
+
+- lors d'un rééquilibrage ou d'un arrêt propre, une réplique s'abonne à ses
+  nouvelles partitions avant de quitter les anciennes (et se désinscrit à
+  l'arrêt): pas d'interruption, et un message n'est jamais distribué à deux
+  répliques à la fois pendant le recouvrement;
+- une réplique arrêtée brutalement garde ses partitions jusqu'à l'expiration
+  de son annonce (`lease`): leurs messages ne sont pas perdus mais attendent
+  dans le stream, d'où un retard pouvant atteindre `lease`, et les messages
+  en cours non acquittés sont redistribués après `ack_wait`.
+"""
+
+import asyncio
+import hashlib
+import logging
+import uuid
+from typing import Any, Awaitable, Callable, Iterable, Optional
+
+from nats.errors import Error as NatsError
+from nats.js.errors import NoKeysError
+
+logger = logging.getLogger(__name__)
+
+# Bucket NATS KV par défaut des membres
+DEFAULT_BUCKET = "pac0-routage-shards"
+
+ShardCallback = Callable[[int], Awaitable[None]]
+
+
+def _score(member: str, shard: int) -> int:
+    digest = hashlib.blake2b(f"{member}:{shard}".encode(), digest_size=8).digest()
+    return int.from_bytes(digest)
+
+
+def assigned_shards(shards: int, members: Iterable[str], member: str) -> set[int]:
+    """
+    Partitions attribuées à `member` par hachage de rendez-vous: chaque
+    partition revient au membre de meilleur score.
+    """
+    members = set(members) | {member}
+    return {
+        shard
+        for shard in range(shards)
+        if max(members, key=lambda m: (_score(m, shard), m)) == member
+    }
+
+
+class ShardAssigner:
+    """Annonce d'une réplique et suivi des partitions qui lui reviennent."""
+
+    def __init__(
+        self,
+        broker: Any,
+        shards: int,
+        on_assign: ShardCallback,
+        on_revoke: ShardCallback,
+        member_id: Optional[str] = None,
+        bucket: str = DEFAULT_BUCKET,
+        lease: float = 10.0,
+    ):
+        """
+        Args:
+            broker: NatsBroker FastStream connecté
+            shards: Nombre de partitions
+            on_assign: Abonnement à une partition
+            on_revoke: Désabonnement d'une partition
+            member_id: Identifiant de la réplique (aléatoire par défaut)
+            bucket: Bucket NATS KV des membres (créé si absent)
+            lease: Durée de vie d'une annonce non renouvelée
+        """
+        self.broker = broker
+        self.shards = shards
+        self.on_assign = on_assign
+        self.on_revoke = on_revoke
+        self.member_id = member_id or uuid.uuid4().hex
+        self.bucket = bucket
+        self.lease = lease
+        self.owned: set[int] = set()
+        self.rebalances = 0
+        self._kv = None
+        self._task: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+
+    @property
+    def _key(self) -> str:
+        return f"members.{self.member_id}"
+
+    async def _key_value(self):
+        if self._kv is None:
+            self._kv = await self.broker.key_value(self.bucket, ttl=self.lease)
+        return self._kv
+
+    async def members(self) -> set[str]:
+        """Répliques annoncées (dont celle-ci)."""
+        try:
+            keys = await (await self._key_value()).keys(filters=["members.>"])
+        except NoKeysError:
+            keys = []
+        return {key.removeprefix("members.") for key in keys} | {self.member_id}
+
+    async def _heartbeat(self):
+        await (await self._key_value()).put(self._key, b"")
+
+    async def rebalance(self):
+        """Recalcule les partitions de la réplique et (dés)abonne en conséquence."""
+        async with self._lock:
+            owned = assigned_shards(self.shards, await self.members(), self.member_id)
+            if owned == self.owned:
+                return
+            self.rebalances += 1
+            # nouvelles partitions d'abord: pas de trou pendant la passation
+            for shard in sorted(owned - self.owned):
+                await self.on_assign(shard)
+            for shard in sorted(self.owned - owned):
+                await self.on_revoke(shard)
+            self.owned = owned
+            logger.info("Partitions de %s: %s", self.member_id, sorted(owned))
+
+    async def start(self):
+        """Annonce la réplique, prend ses partitions et lance le renouvellement."""
+        await self._heartbeat()
+        await self.rebalance()
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.lease / 3)
+            try:
+                await self._heartbeat()
+                await self.rebalance()
+            except NatsError as e:
+                # NATS indisponible: la réplique garde ses partitions
+                logger.warning("Renouvellement des partitions impossible: %s", e)
+
+    async def stop(self):
+        """Retire l'annonce (les autres répliques reprennent les partitions)."""
+        if self._task is not None:
+            task, self._task = self._task, None
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        try:
+            await (await self._key_value()).delete(self._key)
+        except NatsError as e:
+            logger.warning("Retrait de %s impossible: %s", self.member_id, e)
+        async with self._lock:
+            for shard in sorted(self.owned):
+                await self.on_revoke(shard)
+            self.owned = set()
@@ -0,0 +1,175 @@
+# SPDX-FileCopyrightText: 2026 Philippe ENTZMANN <philippe@entzmann.name>
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+"""
+Instantané persistant du cache de lookup PEPPOL (démarrage à chaud).
+
+Les résultats mis en cache par `PeppolLookupService` sont recopiés dans une
+base SQLite locale avec leur date d'expiration. Au redémarrage d'une réplique,
+rien n'est chargé d'avance: chaque défaut du cache mémoire consulte la base
+(lecture indexée par clé primaire), ce qui garde un démarrage instantané quelle
+que soit la taille de l'instantané.
+
+Les écritures sont regroupées et validées par lots (`flush_size`) pour ne pas
+payer une transaction par lookup. Les méthodes sont protégées par un verrou:
+`PeppolLookupService` les appelle depuis un thread (`asyncio.to_thread`) pour
+ne pas bloquer la boucle d'événements avec les entrées/sorties SQLite.
+"""
+
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Optional
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS lookup (
+    key TEXT PRIMARY KEY,
+    expires_at REAL NOT NULL,
+    value TEXT NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS lookup_expires_at ON lookup (expires_at);
+"""
+
+CacheKey = tuple[str, str, str]
+
+
+def _encode_key(key: CacheKey) -> str:
+    return "::".join(key)
+
+
+class LookupSnapshot:
+    """Copie sur disque (SQLite) des entrées du cache de lookup."""
+
+    def __init__(
+        self,
+        path: str | Path,
+        flush_size: int = 100,
+        clock: Callable[[], float] = time.time,
+    ):
+        """
+        Args:
+            path: Fichier SQLite de l'instantané (créé si absent)
+            flush_size: Nombre d'écritures en attente déclenchant une validation
+            clock: Horloge murale en secondes (les expirations survivent
+                au redémarrage, contrairement à une horloge monotone)
+        """
+        self.path = Path(path)
+        self.flush_size = flush_size
+        self._clock = clock
+        self._db: Optional[sqlite3.Connection] = None
+        self._pending: dict[str, tuple[float, str]] = {}
+        self._lock = threading.RLock()
+
+    def _connect(self) -> sqlite3.Connection:
+        """Ouvre la base à la première utilisation."""
+        if self._db is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.executescript(SCHEMA)
+        return self._db
+
+    def get(self, key: CacheKey) -> Optional[tuple[Any, float]]:
+        """
+        Retourne `(valeur, ttl restant)` pour une clé encore valide, sinon None.
+        """
+        with self._lock:
+            skey = _encode_key(key)
+            item = self._pending.get(skey)
+            if item is None:
+                item = (
+                    self._connect()
+                    .execute(
+                        "SELECT expires_at, value FROM lookup WHERE key = ?", (skey,)
+                    )
+                    .fetchone()
+                )
+            if item is None:
+                return None
+
+            expires_at, value = item
+            ttl = expires_at - self._clock()
+            if ttl <= 0:
+                return None
+
+            return json.loads(value), ttl
+
+    def put(self, key: CacheKey, value: Any, ttl: float):
+        """Enregistre une valeur (sérialisable en JSON) valable `ttl` secondes."""
+        with self._lock:
+            if ttl <= 0:
+                return
+            self._pending[_encode_key(key)] = (
+                self._clock() + ttl,
+                json.dumps(value),
+            )
+            if len(self._pending) >= self.flush_size:
+                self.flush()
+
+    def flush(self):
+        """Valide les écritures en attente."""
+        with self._lock:
+            if not self._pending:
+                return
+            pending, self._pending = self._pending, {}
+            db = self._connect()
+            with db:
+                db.executemany(
+                    "INSERT OR REPLACE INTO lookup (key, expires_at, value)"
+                    " VALUES (?, ?, ?)",
+                    [
+                        (key, expires_at, value)
+                        for key, (expires_at, value) in pending.items()
+                    ],
+                )
+
+    def prune(self) -> int:
+        """Supprime les entrées expirées; retourne leur nombre."""
+        with self._lock:
+            db = self._connect()
+            with db:
+                cursor = db.execute(
+                    "DELETE FROM lookup WHERE expires_at <= ?", (self._clock(),)
+                )
+            return cursor.rowcount
+
+    def forget(self, scheme_id: str, participant_id: str) -> int:
+        """Supprime les entrées d'un participant; retourne leur nombre."""
+        with self._lock:
+            prefix = _encode_key((scheme_id, participant_id, ""))
+            for key in [key for key in self._pending if key.startswith(prefix)]:
+                del self._pending[key]
+            db = self._connect()
+            with db:
+                cursor = db.execute(
+                    "DELETE FROM lookup WHERE substr(key, 1, ?) = ?",
+                    (len(prefix), prefix),
+                )
+            return cursor.rowcount
+
+    def clear(self):
+        """Vide l'instantané."""
+        with self._lock:
+            self._pending.clear()
+            db = self._connect()
+            with db:
+                db.execute("DELETE FROM lookup")
+
+    def __len__(self) -> int:
+        with self._lock:
+            self.flush()
+            return self._connect().execute("SELECT count(*) FROM lookup").fetchone()[0]
+
+    def close(self):
+        """Valide les écritures en attente, purge les expirés et ferme la base."""
+        with self._lock:
+            if self._db is None and not self._pending:
+                return
+            self.flush()
+            self.prune()
+            self._db.close()
+            self._db = None
@@ -0,0 +1,236 @@
+# SPDX-FileCopyrightText: 2026 Philippe ENTZMANN <philippe@entzmann.name>
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+"""
+Moteur de traitement concurrent des factures reçues sur routage-IN.
+
+Les messages sont traités en parallèle, avec trois garde-fous:
+- `max_in_flight`: nombre maximal de factures en cours de traitement
+- `max_per_destination`: nombre maximal de factures en cours vers une même
+  destination (hôte SMP / PA), pour qu'une PA lente n'occupe pas tous les
+  créneaux
+- ordre par destinataire: les factures d'un même destinataire sont traitées
+  l'une après l'autre, dans leur ordre d'arrivée (cycle de vie)
+
+`submit()` rend la main dès que le message est mis en file, tant que la file
+ne dépasse pas `max_pending` messages (au-delà, l'appelant attend: contre-
+pression vers le consommateur NATS). `process()` attend en plus la fin du
+traitement, pour n'acquitter un message JetStream qu'une fois routé.
+
+Les statistiques distinguent l'attente en file du temps de traitement.
+"""
+
+import asyncio
+import contextlib
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Hashable, Optional
+
+logger = logging.getLogger(__name__)
+
+# Handler appelé pour chaque message: handler(message, correlation_id)
+Handler = Callable[[Any, Optional[str]], Awaitable[Any]]
+
+
+@dataclass
+class LatencyWindow:
+    """Dernières durées observées (secondes) et leurs percentiles."""
+
+    size: int = 1000
+    samples: deque = field(default_factory=deque)
+
+    def add(self, value: float):
+        self.samples.append(value)
+        if len(self.samples) > self.size:
+            self.samples.popleft()
+
+    def percentile(self, p: float) -> float:
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+    def summary(self) -> dict[str, float]:
+        return {f"p{p}": self.percentile(p) for p in (50, 95, 99)}
+
+
+@dataclass
+class WorkerStats:
+    """Compteurs du moteur de routage."""
+
+    submitted: int = 0
+    completed: int = 0
+    failed: int = 0
+    in_flight: int = 0
+    pending: int = 0
+    queue_wait: LatencyWindow = field(default_factory=LatencyWindow)
+    processing: LatencyWindow = field(default_factory=LatencyWindow)
+
+    def as_dict(self) -> dict[str, Any]:
+        return {
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "in_flight": self.in_flight,
+            "pending": self.pending,
+            "queue_wait": self.queue_wait.summary(),
+            "processing": self.processing.summary(),
+        }
+
+
+@dataclass
+class _Item:
+    message: Any
+    correlation_id: Optional[str]
+    enqueued_at: float
+    # résultat attendu par `process()` (None pour `submit()`)
+    done: Optional[asyncio.Future] = None
+
+
+class RoutageWorker:
+    """Traitement concurrent, borné et équitable des messages de routage."""
+
+    def __init__(
+        self,
+        handler: Handler,
+        max_in_flight: int = 100,
+        max_per_destination: int = 10,
+        max_pending: int = 1000,
+        ordering_key: Optional[Callable[[Any], Optional[Hashable]]] = None,
+        destination: Optional[Callable[[Any], Awaitable[Optional[str]]]] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        """
+        Args:
+            handler: Traitement d'un message, appelé avec (message, correlation_id)
+            max_in_flight: Nombre maximal de messages traités simultanément
+            max_per_destination: Nombre maximal de messages traités
+                simultanément pour une même destination
+            max_pending: Nombre maximal de messages acceptés et non terminés
+                (file + traitement); `submit()` attend au-delà
+            ordering_key: Clé des messages à traiter dans l'ordre (ex: le
+                destinataire); None: pas de contrainte d'ordre
+            destination: Destination d'un message (ex: hôte du SMP), pour
+                la limite `max_per_destination`; None: pas de limite
+            clock: Horloge monotone (injectable pour les tests)
+        """
+        self.handler = handler
+        self.max_in_flight = max_in_flight
+        self.max_per_destination = max_per_destination
+        self.max_pending = max_pending
+        self.ordering_key = ordering_key
+        self.destination = destination
+        self._clock = clock
+        self._slots = asyncio.Semaphore(max_in_flight)
+        self._capacity = asyncio.Semaphore(max_pending)
+        self._destinations: dict[str, asyncio.Semaphore] = {}
+        # clé d'ordre -> messages en attente derrière celui en cours
+        self._chains: dict[Hashable, deque[_Item]] = {}
+        self._tasks: set[asyncio.Task] = set()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self.stats = WorkerStats()
+
+    async def submit(self, message: Any, correlation_id: Optional[str] = None):
+        """
+        Met un message en file de traitement.
+
+        Attend si `max_pending` messages sont déjà acceptés.
+        """
+        await self._enqueue(_Item(message, correlation_id, self._clock()))
+
+    async def process(self, message: Any, correlation_id: Optional[str] = None) -> Any:
+        """
+        Met un message en file et attend la fin de son traitement.
+
+        Mêmes limites que `submit()`; retourne le résultat du handler ou
+        lève son exception (l'appelant refuse alors le message).
+        """
+        done = asyncio.get_running_loop().create_future()
+        await self._enqueue(_Item(message, correlation_id, self._clock(), done))
+        return await done
+
+    async def _enqueue(self, item: _Item):
+        await self._capacity.acquire()
+        self.stats.submitted += 1
+        self.stats.pending += 1
+        self._idle.clear()
+
+        key = self.ordering_key(item.message) if self.ordering_key else None
+        if key is None:
+            self._spawn(self._run(item))
+        elif key in self._chains:
+            self._chains[key].append(item)
+        else:
+            self._chains[key] = deque([item])
+            self._spawn(self._drain(key))
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _drain(self, key: Hashable):
+        """Traite dans l'ordre les messages d'une même clé."""
+        chain = self._chains[key]
+        try:
+            while chain:
+                await self._run(chain[0])
+                chain.popleft()
+        finally:
+            del self._chains[key]
+
+    def _destination_slot(self, destination: Optional[str]):
+        if destination is None:
+            return contextlib.nullcontext()
+        semaphore = self._destinations.get(destination)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.max_per_destination)
+            self._destinations[destination] = semaphore
+        return semaphore
+
+    async def _run(self, item: _Item):
+        try:
+            destination = None
+            if self.destination is not None:
+                try:
+                    destination = await self.destination(item.message)
+                except Exception:
+                    logger.exception("routage: destination inconnue")
+
+            # créneau de destination d'abord: une destination lente ne
+            # bloque que ses propres messages, pas les créneaux globaux
+            async with self._destination_slot(destination), self._slots:
+                started_at = self._clock()
+                self.stats.queue_wait.add(started_at - item.enqueued_at)
+                self.stats.in_flight += 1
+                try:
+                    result = await self.handler(item.message, item.correlation_id)
+                    self.stats.completed += 1
+                    if item.done is not None and not item.done.done():
+                        item.done.set_result(result)
+                except Exception as e:
+                    self.stats.failed += 1
+                    if item.done is None:
+                        logger.exception("routage: échec du traitement")
+                    elif not item.done.done():
+                        item.done.set_exception(e)
+                finally:
+                    self.stats.in_flight -= 1
+                    self.stats.processing.add(self._clock() - started_at)
+        finally:
+            if item.done is not None and not item.done.done():
+                # traitement annulé (arrêt): l'appelant ne reste pas bloqué
+                item.done.cancel()
+            self.stats.pending -= 1
+            self._capacity.release()
+            if self.stats.pending == 0:
+                self._idle.set()
+
+    async def join(self):
+        """Attend la fin du traitement de tous les messages acceptés."""
+        await self._idle.wait()
+
@@ -0,0 +1,256 @@
+# SPDX-FileCopyrightText: 2026 Philippe ENTZMANN <philippe@entzmann.name>
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+"""
+Claim-check des documents (factures, PDF Factur-X).
+
+Un document est stocké une seule fois dans un stockage adressé par contenu
+(la clé est son sha256); seule sa référence (`BlobRef`) circule sur le bus.
+Les briques qui ont besoin des octets les récupèrent à la demande, en
+vérifiant leur empreinte.
+
+Stockages:
+- `NatsBlobStore`: object store JetStream (production)
+- `LocalBlobStore`: répertoire local (tests, poste de développement)
+"""
+
+import asyncio
+import hashlib
+import os
+import tempfile
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Any, Optional
+
+from nats.js.errors import ObjectNotFoundError
+from pydantic import BaseModel, Field
+
+# Bucket JetStream par défaut des documents
+DEFAULT_BUCKET = "pac0-blobs"
+
+
+class BlobNotFoundError(KeyError):
+    """Document absent du stockage."""
+
+
+class BlobIntegrityError(ValueError):
+    """Octets récupérés ne correspondant pas à l'empreinte de la référence."""
+
+
+class BlobRef(BaseModel):
+    """Référence d'un document stocké (claim-check)."""
+
+    sha256: str = Field(..., description="Empreinte sha256 (hexadécimal), clé du document")
+    size: int = Field(..., description="Taille en octets")
+    content_type: str = Field(default="application/octet-stream")
+
+
+def blob_ref(data: bytes, content_type: str = "application/octet-stream") -> BlobRef:
+    """Référence d'un document (sans le stocker)."""
+    return BlobRef(
+        sha256=hashlib.sha256(data).hexdigest(), size=len(data), content_type=content_type
+    )
+
+
+def check_blob(ref: BlobRef, data: bytes) -> bytes:
+    """
+    Vérifie que des octets correspondent à une référence.
+
+    Raises:
+        BlobIntegrityError: taille ou empreinte différente
+    """
+    if len(data) != ref.size or hashlib.sha256(data).hexdigest() != ref.sha256:
+        raise BlobIntegrityError(f"Document {ref.sha256} corrompu")
+    return data
+
+
+class BlobStore(ABC):
+    """Stockage de documents adressé par contenu."""
+
+    async def put(
+        self, data: bytes, content_type: str = "application/octet-stream"
+    ) -> BlobRef:
+        """
+        Stocke un document (rien n'est écrit s'il est déjà présent).
+
+        Returns:
+            Référence du document
+        """
+        ref = blob_ref(data, content_type)
+        if not await self.exists(ref):
+            await self._write(ref.sha256, data)
+        return ref
+
+    async def get(self, ref: BlobRef) -> bytes:
+        """
+        Récupère un document et vérifie son empreinte.
+
+        Raises:
+            BlobNotFoundError: document absent
+            BlobIntegrityError: document corrompu
+        """
+        return check_blob(ref, await self._read(ref.sha256))
+
+    @abstractmethod
+    async def exists(self, ref: BlobRef) -> bool:
+        """True si le document est présent."""
+
+    @abstractmethod
+    async def delete(self, ref: BlobRef):
+        """Supprime un document (sans erreur s'il est absent)."""
+
+    @abstractmethod
+    async def _write(self, key: str, data: bytes):
+        """Écrit les octets d'un document sous sa clé (sha256)."""
+
+    @abstractmethod
+    async def _read(self, key: str) -> bytes:
+        """
+        Octets d'un document.
+
+        Raises:
+            BlobNotFoundError: document absent
+        """
+
+
+class LocalBlobStore(BlobStore):
+    """Documents dans un répertoire local (un fichier par empreinte)."""
+
+    def __init__(self, root: str | Path):
+        self.root = Path(root)
+
+    def _path(self, key: str) -> Path:
+        # sous-répertoires par préfixe: pas de répertoire géant
+        return self.root / key[:2] / key
+
+    async def exists(self, ref: BlobRef) -> bool:
+        return await asyncio.to_thread(self._path(ref.sha256).exists)
+
+    async def delete(self, ref: BlobRef):
+        await asyncio.to_thread(self._path(ref.sha256).unlink, missing_ok=True)
+
+    async def _write(self, key: str, data: bytes):
+        await asyncio.to_thread(self._write_file, self._path(key), data)
+
+    @staticmethod
+    def _write_file(path: Path, data: bytes):
+        # écriture atomique: un lecteur ne voit jamais un fichier partiel
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=path.parent)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    async def _read(self, key: str) -> bytes:
+        try:
+            return await asyncio.to_thread(self._path(key).read_bytes)
+        except FileNotFoundError:
+            raise BlobNotFoundError(key) from None
+
+
+class NatsBlobStore(BlobStore):
+    """Documents dans un object store NATS JetStream."""
+
+    def __init__(self, broker: Any, bucket: str = DEFAULT_BUCKET):
+        """
+        Args:
+            broker: NatsBroker FastStream connecté
+            bucket: Bucket de l'object store (créé si absent)
+        """
+        self.broker = broker
+        self.bucket = bucket
+        self._store = None
+
+    async def _object_store(self):
+        if self._store is None:
+            self._store = await self.broker.object_storage(self.bucket)
+        return self._store
+
+    async def exists(self, ref: BlobRef) -> bool:
+        store = await self._object_store()
+        try:
+            await store.get_info(ref.sha256)
+        except ObjectNotFoundError:
+            return False
+        return True
+
+    async def delete(self, ref: BlobRef):
+        store = await self._object_store()
+        try:
+            await store.delete(ref.sha256)
+        except ObjectNotFoundError:
+            pass
+
+    async def _write(self, key: str, data: bytes):
+        await (await self._object_store()).put(key, data)
+
+    async def _read(self, key: str) -> bytes:
+        store = await self._object_store()
+        try:
+            return (await store.get(key)).data
+        except ObjectNotFoundError:
+            raise BlobNotFoundError(key) from None
+
+
+def blob_store_from_env(broker: Any = None) -> Optional[BlobStore]:
+    """
+    Stockage configuré par la variable d'environnement PAC0_BLOB_STORE:
+    "nats" ou "nats://<bucket>" (object store JetStream du broker),
+    "file://<répertoire>" (répertoire local). None si non configuré.
+    """
+    url = os.environ.get("PAC0_BLOB_STORE")
+    if not url:
+        return None
+    if url.startswith("file://"):
+        return LocalBlobStore(url.removeprefix("file://"))
+    if url == "nats" or url.startswith("nats://"):
+        if broker is None:
+            raise ValueError("PAC0_BLOB_STORE=nats requiert un broker NATS")
+        return NatsBlobStore(broker, url.removeprefix("nats://") or DEFAULT_BUCKET)
+    raise ValueError(f"PAC0_BLOB_STORE non supporté: {url}")
+
+
+async def check_in(
+    store: BlobStore,
+    message: dict,
+    field: str = "payload",
+    min_size: int = 0,
+    content_type: str = "application/octet-stream",
+) -> dict:
+    """
+    Remplace le document `field` d'un message par sa référence `<field>_ref`.
+
+    Les documents de moins de `min_size` octets restent dans le message.
+
+    Returns:
+        Nouveau message (le message d'origine n'est pas modifié)
+    """
+    value = message.get(field)
+    if value is None:
+        return message
+    data = value.encode() if isinstance(value, str) else value
+    if len(data) < min_size:
+        return message
+    ref = await store.put(data, content_type)
+    return {**message, field: None, f"{field}_ref": ref.model_dump()}
+
+
+async def check_out(store: BlobStore, message: dict, field: str = "payload") -> bytes:
+    """
+    Octets du document `field` d'un message, en ligne ou par sa référence.
+
+    Raises:
+        BlobNotFoundError: ni document ni référence
+    """
+    value = message.get(field)
+    if value is not None:
+        return value.encode() if isinstance(value, str) else value
+    ref = message.get(f"{field}_ref")
+    if ref is None:
+        raise BlobNotFoundError(field)
+    return await store.get(BlobRef.model_validate(ref))
@@ -2,19 +2,455 @@
 #
 # SPDX-License-Identifier: GPL-3.0-or-later
 
-from dataclasses import dataclass
-from typing import Any
-from pydantic_settings import BaseSettings
-from faststream import FastStream, ContextRepo
+import asyncio
+import base64
+import inspect
+import itertools
+import json
+import logging
+import time
+import uuid
+import zlib
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field, fields
+from datetime import date, datetime
+from enum import Enum
+from typing import Any, Iterable, Literal, Mapping, Optional
+import msgpack
+from nats.js.api import AckPolicy as JsAckPolicy
+from nats.js.api import ConsumerConfig, RetentionPolicy, StreamConfig
+from nats.aio.subscription import Subscription
+from nats.errors import SlowConsumerError
+from nats.js.errors import BadRequestError, KeyNotFoundError, NoKeysError
+from pydantic import BaseModel
+from pydantic_settings import BaseSettings, SettingsConfigDict
+from faststream import AckPolicy, BaseMiddleware, FastStream, ContextRepo
 import os
-from faststream.nats import NatsBroker, NatsRouter
+from faststream.message import StreamMessage
+from faststream.nats import JStream, NatsBroker, NatsMessage, NatsRouter, PullSub
+
+logger = logging.getLogger(__name__)
 
 QUEUE = "q"
 
 
 class SettingsService(BaseSettings):
-    # any_flag: bool
-    ...
+    """
+    Réglages ESB d'une brique, lus dans l'environnement ou le fichier `.env`
+    (préfixe `ESB_`, par exemple ESB_MAX_WORKERS).
+
+    `SettingsService.for_brick(prefix)` applique en plus les réglages propres
+    à une brique (préfixe `<BRIQUE>_ESB_`, par exemple
+    CONTROLE_FORMATS_ESB_MAX_WORKERS).
+    """
+
+    model_config = SettingsConfigDict(env_prefix="ESB_", env_file=".env", extra="ignore")
+
+    # handlers exécutés simultanément par abonnement (1: un message à la fois)
+    max_workers: int = 1
+    # messages / octets reçus et pas encore traités par abonnement; au-delà,
+    # le client NATS les abandonne (slow consumer, NATS core) ou cesse d'en
+    # demander (JetStream). None: valeurs par défaut du client
+    pending_msgs_limit: Optional[int] = None
+    pending_bytes_limit: Optional[int] = None
+    # intervalle minimal entre deux alertes slow consumer d'un même sujet
+    slow_consumer_log_interval: float = 10.0
+    # publications: taille du tampon d'écriture (octets) qui déclenche un
+    # envoi immédiat, délai maximal d'un envoi forcé (flush)
+    publish_pending_size: int = 2 * 1024 * 1024
+    publish_flush_timeout: Optional[float] = None
+    # publications par lots (ctx.batch_publisher, ctx.publish_many): taille
+    # d'un lot, délai maximal avant envoi d'un lot incomplet, accusés de
+    # publication JetStream attendus simultanément
+    publish_batch: int = 100
+    publish_batch_interval: float = 0.05
+    publish_max_pending_acks: int = 1000
+    # arrêt: délai maximal pour terminer les traitements en cours (voir
+    # CtxService.drain); doit rester inférieur au délai avant SIGKILL
+    drain_timeout: float = 10.0
+
+    # transport des canaux: NATS core, JetStream (voir JetStreamConfig) ou
+    # bus en mémoire partagé par les briques d'un même processus (LocalBroker)
+    mode: Literal["core", "jetstream", "memory"] = "core"
+    stream: str = "pac0"
+    fetch_batch: int = 100
+    fetch_timeout: float = 5.0
+    ack_batch: int = 1
+    ack_interval: float = 1.0
+    max_ack_pending: int = 1000
+    max_deliver: int = 5
+    ack_wait: float = 30.0
+    max_age: float = 7 * 24 * 3600.0
+
+    @classmethod
+    def for_brick(cls, prefix: str, env_file: Optional[str] = ".env") -> "SettingsService":
+        """Réglages communs, surchargés par ceux de la brique `prefix`."""
+        settings = cls(_env_file=env_file)
+        brick = cls(
+            _env_file=env_file,
+            _env_prefix=f"{prefix.upper().replace('-', '_')}_ESB_",
+        )
+        return settings.model_copy(
+            update={name: getattr(brick, name) for name in brick.model_fields_set}
+        )
+
+    def subscriber_options(self) -> dict:
+        """Options appliquées à chaque abonnement de la brique."""
+        options = {}
+        if self.max_workers > 1:
+            options["max_workers"] = self.max_workers
+        if self.pending_msgs_limit is not None:
+            options["pending_msgs_limit"] = self.pending_msgs_limit
+        if self.pending_bytes_limit is not None:
+            options["pending_bytes_limit"] = self.pending_bytes_limit
+        return options
+
+    def broker_options(self) -> dict:
+        """Options de la connexion NATS de la brique."""
+        return {
+            "pending_size": self.publish_pending_size,
+            "flush_timeout": self.publish_flush_timeout,
+            "error_cb": SlowConsumerLogger(self.slow_consumer_log_interval),
+            # attente des handlers par FastStream (subscriber.stop, CtxService.drain)
+            "graceful_timeout": self.drain_timeout,
+        }
+
+
+class SlowConsumerLogger:
+    """
+    Callback d'erreur NATS: compte les messages abandonnés par sujet (slow
+    consumer) et les signale au plus une fois par `interval` secondes.
+    """
+
+    def __init__(self, interval: float = 10.0):
+        self.interval = interval
+        self.dropped: dict[str, int] = {}
+        self._logged_at: dict[str, float] = {}
+
+    async def __call__(self, error: Exception):
+        if not isinstance(error, SlowConsumerError):
+            logger.error("Erreur NATS: %s", error)
+            return
+        subject = error.subject
+        self.dropped[subject] = self.dropped.get(subject, 0) + 1
+        now = asyncio.get_running_loop().time()
+        if now - self._logged_at.get(subject, float("-inf")) >= self.interval:
+            self._logged_at[subject] = now
+            logger.warning(
+                "Slow consumer sur %s: %d messages abandonnés",
+                subject,
+                self.dropped[subject],
+            )
+
+
+# ====================================================================
+# mode JetStream (ESB_MODE=jetstream)
+#
+# Les canaux des briques sont conservés dans un stream JetStream et chaque
+# brique les consomme par un consumer pull durable (partagé par ses
+# répliques): une facture en cours de traitement lors d'un arrêt brutal est
+# redistribuée, et les messages sont récupérés par lots.
+
+# Canaux conservés dans le stream
+STREAM_SUBJECTS = ["*-IN", "*-IN.*", "*-OUT", "*-ERR"]
+
+
+@dataclass
+class JetStreamConfig:
+    """Réglages du mode JetStream."""
+
+    stream: str = "pac0"
+    # messages récupérés par requête pull, attente maximale d'un lot
+    fetch_batch: int = 100
+    fetch_timeout: float = 5.0
+    # acquittements envoyés par lots de `ack_batch` (1: un par message),
+    # au plus tard après `ack_interval` secondes
+    ack_batch: int = 1
+    ack_interval: float = 1.0
+    # messages distribués et non acquittés par consumer (contrôle de flux)
+    max_ack_pending: int = 1000
+    # distributions d'un message avant abandon, délai de redistribution
+    max_deliver: int = 5
+    ack_wait: float = 30.0
+    # durée de conservation des messages non consommés
+    max_age: float = 7 * 24 * 3600.0
+
+    @classmethod
+    def from_settings(cls, settings: SettingsService) -> Optional["JetStreamConfig"]:
+        """Réglages JetStream d'une brique, None en mode NATS core."""
+        if settings.mode != "jetstream":
+            return None
+        return cls(**{f.name: getattr(settings, f.name) for f in fields(cls)})
+
+    def stream_config(self) -> StreamConfig:
+        return StreamConfig(
+            name=self.stream,
+            subjects=STREAM_SUBJECTS,
+            # un message acquitté par son unique consumer est supprimé
+            retention=RetentionPolicy.WORK_QUEUE,
+            max_age=self.max_age,
+        )
+
+    def consumer_config(self) -> ConsumerConfig:
+        return ConsumerConfig(
+            ack_policy=JsAckPolicy.EXPLICIT,
+            max_ack_pending=self.max_ack_pending,
+            max_deliver=self.max_deliver,
+            ack_wait=self.ack_wait,
+        )
+
+
+def durable_name(prefix: str, subject: str) -> str:
+    """Nom du consumer durable d'une brique pour un canal."""
+    return f"{prefix}__{subject}".replace(".", "_")
+
+
+async def declare_stream(broker: NatsBroker, config: JetStreamConfig):
+    """Crée (ou met à jour) le stream des canaux."""
+    js = (await broker.connect()).jetstream()
+    try:
+        await js.add_stream(config.stream_config())
+    except BadRequestError:
+        # stream existant avec une autre configuration
+        await js.update_stream(config.stream_config())
+
+
+class AckBatcher:
+    """
+    Acquittements JetStream différés et envoyés par lots.
+
+    Un message n'est acquitté qu'une fois traité sans erreur; en cas d'erreur
+    il est refusé (nak) aussitôt et sera redistribué. Les acquittements
+    d'un lot partent dans la même écriture réseau.
+    """
+
+    def __init__(self, size: int, interval: float):
+        self.size = size
+        self.interval = interval
+        self._pending: list[NatsMessage] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        # flushs déclenchés par le timer, attendus par `close`
+        self._flushes: set[asyncio.Task] = set()
+        self.flushes = 0
+
+    async def add(self, message: NatsMessage):
+        self._pending.append(message)
+        if len(self._pending) >= self.size:
+            await self.flush()
+        elif self._timer is None:
+            # acquitter avant `ack_wait` même si le lot ne se remplit pas
+            self._timer = asyncio.get_running_loop().call_later(
+                self.interval, self._flush_later
+            )
+
+    async def flush(self):
+        """Envoie les acquittements en attente."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        pending, self._pending = self._pending, []
+        if not pending:
+            return
+        for message in pending:
+            await message.ack()
+        self.flushes += 1
+
+    def _flush_later(self):
+        task = asyncio.create_task(self.flush())
+        self._flushes.add(task)
+        task.add_done_callback(self._flushes.discard)
+
+    async def close(self):
+        """Envoie les acquittements en attente, y compris ceux d'un flush en cours."""
+        await self.flush()
+        while self._flushes:
+            await asyncio.gather(*self._flushes, return_exceptions=True)
+
+    def __call__(self, msg: Any, *, context: ContextRepo) -> BaseMiddleware:
+        """Middleware FastStream (voir `init_esb_app`)."""
+        return _AckBatchMiddleware(msg, context=context, batcher=self)
+
+
+class _AckBatchMiddleware(BaseMiddleware):
+    def __init__(self, msg: Any, *, context: ContextRepo, batcher: AckBatcher):
+        super().__init__(msg, context=context)
+        self.batcher = batcher
+
+    async def consume_scope(self, call_next, msg):
+        reply = getattr(msg.raw_message, "reply", "") or ""
+        if not reply.startswith("$JS.ACK."):
+            # NATS core: rien à acquitter
+            return await call_next(msg)
+        try:
+            result = await call_next(msg)
+        except BaseException:
+            await msg.nack()
+            raise
+        if not msg.committed:
+            await self.batcher.add(msg)
+        return result
+
+
+# ====================================================================
+# arrêt progressif (drain)
+#
+# À l'arrêt, FastStream marque chaque abonnement inactif puis attend ses
+# handlers avant de se désabonner: entre-temps, les messages NATS core déjà
+# reçus sont ignorés (perdus) et les messages JetStream attendent `ack_wait`
+# pour être redistribués. `CtxService.drain`, premier hook d'arrêt de chaque
+# brique, arrête d'abord ses abonnements NATS core pour que le groupe de
+# queue envoie les nouveaux messages aux autres répliques, et refuse (nak)
+# les messages JetStream pour qu'ils soient redistribués aussitôt.
+
+
+class InFlightTracker:
+    """
+    Traitements en cours d'une brique (middleware FastStream, voir
+    `init_esb_app`).
+
+    Pendant l'arrêt (`draining`), un message JetStream encore distribué à la
+    brique est refusé (nak) pour être redistribué aussitôt à une autre
+    réplique; un message NATS core déjà reçu est traité.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.draining = False
+
+    def __call__(self, msg: Any, *, context: ContextRepo) -> BaseMiddleware:
+        return _InFlightMiddleware(msg, context=context, tracker=self)
+
+
+class _InFlightMiddleware(BaseMiddleware):
+    def __init__(self, msg: Any, *, context: ContextRepo, tracker: InFlightTracker):
+        super().__init__(msg, context=context)
+        self.tracker = tracker
+
+    async def consume_scope(self, call_next, msg):
+        reply = getattr(msg.raw_message, "reply", "") or ""
+        if self.tracker.draining and reply.startswith("$JS.ACK."):
+            await msg.nack()
+            return None
+        self.tracker.count += 1
+        try:
+            return await call_next(msg)
+        finally:
+            self.tracker.count -= 1
+
+
+async def _stop_intake(subscriber: Any):
+    """
+    Arrêt d'un abonnement NATS core par FastStream (`subscriber.stop`): les
+    traitements en cours se terminent (`graceful_timeout` du broker), puis
+    l'abonnement est retiré côté serveur. Les messages reçus mais pas encore
+    remis à un handler sont abandonnés, comme tout message NATS core.
+    Les consumers pull JetStream ne sont pas arrêtés: leurs nouveaux
+    messages sont refusés par InFlightTracker et redistribués.
+    """
+    if not isinstance(getattr(subscriber, "subscription", None), Subscription):
+        return
+    await subscriber.stop()
+
+
+def _buffered(subscriber: Any) -> int:
+    """Messages reçus et pas encore pris en charge (abonnement avec max_workers > 1)."""
+    stream = getattr(subscriber, "receive_stream", None)
+    return stream.statistics().current_buffer_used if stream is not None else 0
+
+
+class BatchPublisher:
+    """
+    Publications mises en tampon et envoyées par lots de `size` messages, au
+    plus tard `interval` secondes après la première publication du lot.
+
+    En mode JetStream (`acked`), chaque publication attend l'accusé du
+    serveur: les publications d'un lot partent sans attendre les accusés,
+    collectés en tâche de fond (au plus `max_pending_acks` en attente).
+    L'ordre de publication n'est alors pas garanti. Les publications
+    refusées sont journalisées et conservées dans `failed`.
+    """
+
+    def __init__(
+        self,
+        publisher: Any,
+        size: int = 100,
+        interval: float = 0.05,
+        max_pending_acks: int = 1000,
+        acked: bool = False,
+    ):
+        self.publisher = publisher
+        self.size = size
+        self.interval = interval
+        self.acked = acked
+        self.failed: list[tuple[Any, BaseException]] = []
+        self.published = 0
+        self.flushes = 0
+        self._buffer: list[tuple[Any, dict]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._acks: set[asyncio.Task] = set()
+        # flushs déclenchés par le timer, attendus par `close`
+        self._flushes: set[asyncio.Task] = set()
+        self._slots = asyncio.Semaphore(max_pending_acks)
+
+    async def publish(self, message: Any, **kwargs):
+        """Ajoute une publication au lot (mêmes arguments que `publisher.publish`)."""
+        self._buffer.append((message, kwargs))
+        if len(self._buffer) >= self.size:
+            await self.flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(
+                self.interval, self._flush_later
+            )
+
+    async def flush(self):
+        """Envoie le lot en cours (sans attendre les accusés JetStream)."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._buffer = self._buffer, []
+        if not batch:
+            return
+        for message, kwargs in batch:
+            if not self.acked:
+                await self._publish(message, kwargs)
+                continue
+            # contrôle de flux: attend qu'un accusé se libère
+            await self._slots.acquire()
+            task = asyncio.create_task(self._publish_acked(message, kwargs))
+            self._acks.add(task)
+            task.add_done_callback(self._acks.discard)
+        self.published += len(batch)
+        self.flushes += 1
+
+    def _flush_later(self):
+        task = asyncio.create_task(self.flush())
+        self._flushes.add(task)
+        task.add_done_callback(self._flushes.discard)
+
+    async def _publish(self, message: Any, kwargs: dict):
+        try:
+            await self.publisher.publish(message, **kwargs)
+        except Exception as e:
+            logger.error("Publication refusée: %s", e)
+            self.failed.append((message, e))
+
+    async def _publish_acked(self, message: Any, kwargs: dict):
+        try:
+            await self._publish(message, kwargs)
+        finally:
+            self._slots.release()
+
+    @property
+    def pending_acks(self) -> int:
+        return len(self._acks)
+
+    async def close(self):
+        """Envoie le lot en cours et attend tous les accusés de publication."""
+        await self.flush()
+        while self._flushes:
+            await asyncio.gather(*self._flushes, return_exceptions=True)
+        while self._acks:
+            await asyncio.gather(*self._acks, return_exceptions=True)
 
 
 @dataclass
@@ -27,15 +463,161 @@ class CtxService:
     subject_err: str
     publisher_out: Any
     publisher_err: Any
+    settings: SettingsService = field(default_factory=SettingsService)
+    # None: NATS core (groupe de queue `queue`)
+    jetstream: Optional[JetStreamConfig] = None
+    acks: Optional[AckBatcher] = None
+    # publications par lots vidées à l'arrêt de la brique
+    batches: list[BatchPublisher] = field(default_factory=list)
+    # None: mode mémoire (traitements suivis par le bus)
+    inflight: Optional[InFlightTracker] = None
+    # False dès le début de l'arrêt: la brique ne répond plus au healthcheck
+    ready: bool = True
+
+    def subscriber(self, subject: str, **kwargs):
+        """
+        Abonnement d'un handler de la brique à un canal: groupe de queue en
+        NATS core, consumer pull durable en mode JetStream. Le handler est le
+        même dans les deux modes.
+        """
+        kwargs = {**self.settings.subscriber_options(), **kwargs}
+        if self.jetstream is None:
+            return self.broker.subscriber(subject, self.queue, **kwargs)
+        js = self.jetstream
+        return self.broker.subscriber(
+            subject,
+            stream=JStream(js.stream, declare=False),
+            durable=durable_name(self.prefix, subject),
+            pull_sub=PullSub(js.fetch_batch, timeout=js.fetch_timeout),
+            config=js.consumer_config(),
+            # acquittés par lots (AckBatcher) ou un par un après traitement
+            ack_policy=AckPolicy.MANUAL if self.acks is not None else AckPolicy.NACK_ON_ERROR,
+            **kwargs,
+        )
+
+    def publisher(self, subject: str):
+        """Publisher d'un canal (publication JetStream acquittée en mode JetStream)."""
+        if self.jetstream is None:
+            return self.broker.publisher(subject)
+        return self.broker.publisher(subject, stream=JStream(self.jetstream.stream, declare=False))
+
+    def batch_publisher(
+        self,
+        publisher: Any = None,
+        size: Optional[int] = None,
+        interval: Optional[float] = None,
+    ) -> BatchPublisher:
+        """
+        Publications par lots sur `publisher` (par défaut `publisher_out`),
+        vidées à l'arrêt de la brique.
+        """
+        batch = BatchPublisher(
+            publisher or self.publisher_out,
+            size=size or self.settings.publish_batch,
+            interval=interval or self.settings.publish_batch_interval,
+            max_pending_acks=self.settings.publish_max_pending_acks,
+            acked=self.jetstream is not None,
+        )
+        self.batches.append(batch)
+        return batch
+
+    async def publish_many(
+        self, messages: Iterable[Any], publisher: Any = None, **kwargs
+    ) -> list[tuple[Any, BaseException]]:
+        """
+        Publie `messages` par lots et attend leurs accusés.
+
+        Returns:
+            Publications refusées (message, erreur)
+        """
+        batch = self.batch_publisher(publisher)
+        try:
+            for message in messages:
+                await batch.publish(message, **kwargs)
+            await batch.close()
+        finally:
+            self.batches.remove(batch)
+        return batch.failed
+
+    async def drain(self, timeout: Optional[float] = None):
+        """
+        Arrêt progressif, avant la fermeture de la connexion NATS:
 
+        1. la brique n'est plus prête (healthcheck) et arrête ses abonnements
+           NATS core (`_stop_intake`): les autres répliques reçoivent les
+           nouveaux messages
+        2. les traitements en cours se terminent, au plus `timeout` secondes
+           (ESB_DRAIN_TIMEOUT)
+        3. les publications par lots et les acquittements en attente partent
 
-def init_esb_app(prefix):
-    global broker
+        FastStream ferme ensuite la connexion (drain NATS: les publications
+        encore en tampon sont envoyées).
+        """
+        timeout = self.settings.drain_timeout if timeout is None else timeout
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        self.ready = False
 
-    _broker = NatsBroker(get_nats_url())
+        if self.inflight is None:
+            # mode mémoire: un traitement publie vers les briques suivantes du
+            # même processus, les abonnements restent donc actifs
+            try:
+                await asyncio.wait_for(self.broker.join(), timeout)
+            except TimeoutError:
+                logger.warning("%s: traitements inachevés après %ss", self.prefix, timeout)
+        else:
+            self.inflight.draining = True
+            try:
+                await asyncio.wait_for(
+                    asyncio.gather(*(_stop_intake(s) for s in self.broker.subscribers)),
+                    timeout,
+                )
+            except TimeoutError:
+                pass
+            while self.inflight.count or any(_buffered(s) for s in self.broker.subscribers):
+                if loop.time() >= deadline:
+                    logger.warning(
+                        "%s: %d traitements inachevés après %ss",
+                        self.prefix,
+                        self.inflight.count,
+                        timeout,
+                    )
+                    break
+                await asyncio.sleep(0.05)
 
-    app = FastStream(_broker)
-    _broker.include_router(router)
+        for batch in self.batches:
+            await batch.close()
+        if self.acks is not None:
+            await self.acks.close()
+
+
+def init_esb_app(prefix, settings: Optional[SettingsService] = None):
+    global broker, service
+
+    if settings is None:
+        settings = SettingsService.for_brick(prefix)
+    jetstream = JetStreamConfig.from_settings(settings)
+    acks = (
+        AckBatcher(jetstream.ack_batch, jetstream.ack_interval)
+        if jetstream is not None and jetstream.ack_batch > 1
+        else None
+    )
+
+    inflight = None
+    if settings.mode == "memory":
+        # toutes les briques du processus partagent le même bus
+        _broker = get_local_broker()
+        app = LocalApp(_broker)
+    else:
+        inflight = InFlightTracker()
+        _broker = NatsBroker(
+            get_nats_url(),
+            # inflight d'abord: un message refusé pendant l'arrêt n'est pas acquitté
+            middlewares=[inflight, acks] if acks is not None else [inflight],
+            **settings.broker_options(),
+        )
+        app = FastStream(_broker)
+        _broker.include_router(router)
 
     broker = _broker
 
@@ -50,9 +632,33 @@ def init_esb_app(prefix):
         subject_in=subject_in,
         subject_out=subject_out,
         subject_err=subject_err,
-        publisher_out=_broker.publisher(subject_out),
-        publisher_err=_broker.publisher(subject_err),
+        publisher_out=None,
+        publisher_err=None,
+        settings=settings,
+        jetstream=jetstream,
+        acks=acks,
+        inflight=inflight,
     )
+    services[prefix] = ctx
+    if settings.mode == "memory":
+        # chaque brique répond au healthcheck selon son propre état, comme avec NATS
+        _broker.subscriber("healthcheck")(_local_healthcheck(ctx))
+    else:
+        service = ctx
+    ctx.publisher_out = ctx.publisher(subject_out)
+    ctx.publisher_err = ctx.publisher(subject_err)
+
+    if jetstream is not None:
+
+        @app.on_startup
+        async def setup_stream():
+            # avant le démarrage des consumers
+            await declare_stream(_broker, jetstream)
+
+    # premier hook d'arrêt: avant ceux de la brique et la fermeture du broker
+    @app.on_shutdown
+    async def drain():
+        await ctx.drain()
 
     # You MUST return broker and app separatly
     return ctx, _broker, app
@@ -83,6 +689,580 @@ def init_esb_app_old():
     return broker, app
 
 
+# ====================================================================
+# enveloppe des messages
+#
+# Les métadonnées de routage voyagent dans les en-têtes NATS: une brique qui
+# ne fait que transmettre (gestion_cycle_vie) décide sur les en-têtes et
+# republie le corps tel quel, sans le décoder ni le réencoder.
+# Le corps est encodé en msgpack, les documents y restent en octets bruts;
+# les corps JSON (anciens producteurs) restent lisibles.
+
+HEADER_INVOICE_ID = "Pac0-Invoice-Id"
+HEADER_SENDER_SIREN = "Pac0-Sender-Siren"
+HEADER_RECIPIENT_SIREN = "Pac0-Recipient-Siren"
+HEADER_DOCUMENT_TYPE = "Pac0-Document-Type"
+HEADER_STAGE = "Pac0-Stage"
+HEADER_LOCAL_RECIPIENT = "Pac0-Local-Recipient"
+
+CONTENT_TYPE_MSGPACK = "application/msgpack"
+CONTENT_TYPE_JSON = "application/json"
+
+# en-têtes posés par FastStream à chaque publication
+_TRANSPORT_HEADERS = {"correlation_id", "reply_to"}
+
+
+@dataclass
+class RoutingHeaders:
+    """Métadonnées de routage d'un message (en-têtes NATS)."""
+
+    invoice_id: Optional[str] = None
+    sender_siren: Optional[str] = None
+    recipient_siren: Optional[str] = None
+    document_type: Optional[str] = None
+    stage: Optional[str] = None
+    local_recipient: Optional[bool] = None
+
+    _HEADERS = {
+        "invoice_id": HEADER_INVOICE_ID,
+        "sender_siren": HEADER_SENDER_SIREN,
+        "recipient_siren": HEADER_RECIPIENT_SIREN,
+        "document_type": HEADER_DOCUMENT_TYPE,
+        "stage": HEADER_STAGE,
+        "local_recipient": HEADER_LOCAL_RECIPIENT,
+    }
+
+    def to_headers(self) -> dict[str, str]:
+        """En-têtes NATS (les champs non renseignés sont omis)."""
+        headers = {}
+        for f in fields(self):
+            value = getattr(self, f.name)
+            if value is None:
+                continue
+            if isinstance(value, bool):
+                value = "1" if value else "0"
+            headers[self._HEADERS[f.name]] = value
+        return headers
+
+    @classmethod
+    def from_headers(cls, headers: Optional[Mapping[str, str]]) -> "RoutingHeaders":
+        headers = headers or {}
+        values = {name: headers.get(header) for name, header in cls._HEADERS.items()}
+        if values["local_recipient"] is not None:
+            values["local_recipient"] = values["local_recipient"] == "1"
+        return cls(**values)
+
+
+def _plain(obj: Any) -> Any:
+    """Types sans équivalent msgpack/JSON."""
+    if isinstance(obj, BaseModel):
+        return obj.model_dump()
+    if isinstance(obj, Enum):
+        return obj.value
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    raise TypeError(f"Type non sérialisable: {type(obj).__name__}")
+
+
+def _json_object_hook(obj: dict) -> Any:
+    if len(obj) == 1 and "$bytes" in obj:
+        return base64.b64decode(obj["$bytes"])
+    return obj
+
+
+def encode_body(body: Any) -> tuple[bytes, str]:
+    """
+    Encode le corps d'un message.
+
+    Returns:
+        (octets, content-type)
+    """
+    if isinstance(body, BaseModel):
+        body = body.model_dump()
+    return msgpack.packb(body, default=_plain, use_bin_type=True), CONTENT_TYPE_MSGPACK
+
+
+def decode_body(data: bytes, content_type: str) -> Any:
+    """
+    Décode un corps encodé par `encode_body`.
+
+    Raises:
+        ValueError: content-type non supporté
+    """
+    if content_type == CONTENT_TYPE_MSGPACK:
+        return msgpack.unpackb(data, raw=False)
+    if content_type == CONTENT_TYPE_JSON:
+        return json.loads(data, object_hook=_json_object_hook)
+    raise ValueError(f"Content-type non supporté: {content_type}")
+
+
+async def publish_envelope(
+    publisher: Any,
+    body: Any,
+    routing: Optional[RoutingHeaders] = None,
+    correlation_id: Optional[str] = None,
+    subject: str = "",
+):
+    """
+    Publie un message: métadonnées de routage en en-têtes, corps encodé.
+
+    `subject` remplace le sujet du publisher (partition).
+    """
+    if getattr(publisher, "local", False):
+        # bus en mémoire: l'objet est transmis tel quel
+        headers = (routing or RoutingHeaders()).to_headers()
+        await publisher.publish(
+            body, subject, headers=headers, correlation_id=correlation_id
+        )
+        return
+    data, content_type = encode_body(body)
+    headers = {**(routing or RoutingHeaders()).to_headers(), "content-type": content_type}
+    await publisher.publish(data, subject, headers=headers, correlation_id=correlation_id)
+
+
+async def decode_envelope(message: NatsMessage) -> Any:
+    """Corps d'un message reçu (enveloppe ou message FastStream ordinaire)."""
+    if message.content_type in (CONTENT_TYPE_MSGPACK, CONTENT_TYPE_JSON):
+        return decode_body(message.body, message.content_type)
+    return await message.decode()
+
+
+def routing_headers(message: NatsMessage) -> RoutingHeaders:
+    """Métadonnées de routage d'un message reçu."""
+    return RoutingHeaders.from_headers(message.headers)
+
+
+async def forward(
+    publisher: Any,
+    message: NatsMessage,
+    stage: Optional[str] = None,
+    subject: str = "",
+    routing: Optional[RoutingHeaders] = None,
+):
+    """
+    Republie un message reçu sans décoder son corps.
+
+    Les en-têtes (dont content-type) sont conservés; `routing` complète ou
+    remplace les en-têtes de routage, `stage` l'étape courante, `subject` le
+    sujet du publisher (partition).
+    """
+    headers = {k: v for k, v in (message.headers or {}).items() if k not in _TRANSPORT_HEADERS}
+    if routing is not None:
+        headers.update(routing.to_headers())
+    if stage is not None:
+        headers[HEADER_STAGE] = stage
+    await publisher.publish(
+        message.body, subject, headers=headers, correlation_id=message.correlation_id
+    )
+
+
+# ====================================================================
+# sujets partitionnés par destinataire
+#
+# Une brique partitionnée (`<PREFIX>_SHARDS=N`) consomme `<prefix>-IN.<shard>`
+# en plus de `<prefix>-IN`: les messages d'un même destinataire (SIREN)
+# arrivent toujours sur la même partition, donc sur la même réplique et ses
+# caches. Le publieur choisit la partition.
+
+
+def get_shard_count(prefix: str) -> int:
+    """Nombre de partitions d'une brique (<PREFIX>_SHARDS, 0: non partitionnée)."""
+    name = prefix.upper().replace("-", "_")
+    return int(os.environ.get(f"{name}_SHARDS", "0"))
+
+
+def shard_of(recipient: str, shards: int) -> int:
+    """
+    Partition d'un destinataire.
+
+    Calculée sur le SIREN (un SIRET est dans la partition de son SIREN), par
+    crc32: identique dans tous les processus, contrairement à `hash()`.
+    """
+    return zlib.crc32(recipient.strip()[:9].encode()) % shards
+
+
+def sharded_subject(subject: str, recipient: Optional[str], shards: int) -> str:
+    """Sujet de la partition d'un destinataire (`subject` si non partitionné)."""
+    if shards <= 0 or not recipient:
+        return subject
+    return f"{subject}.{shard_of(recipient, shards)}"
+
+
+# ====================================================================
+# mode mémoire (ESB_MODE=memory)
+#
+# Les briques importées dans un même processus (voir pac0.service.monolith)
+# échangent par un bus en mémoire: les objets publiés sont remis tels quels
+# aux handlers, sans sérialisation ni copie (un handler ne doit donc pas
+# modifier le message reçu). Même sémantique que NATS core: sujets avec
+# jokers `*` et `>`, un seul membre d'un groupe de queue reçoit le message,
+# chaque abonné hors groupe en reçoit une copie. Les buckets KV sont en
+# mémoire, partagés par les briques du processus; JetStream n'est pas
+# disponible (partitions consommées dans le groupe de queue de la brique).
+
+
+def subject_matches(pattern: str, subject: str) -> bool:
+    """Sujet `subject` couvert par l'abonnement `pattern` (jokers NATS)."""
+    tokens = subject.split(".")
+    for i, token in enumerate(pattern.split(".")):
+        if token == ">":
+            return len(tokens) > i
+        if i >= len(tokens) or (token != "*" and token != tokens[i]):
+            return False
+    return len(tokens) == len(pattern.split("."))
+
+
+@dataclass
+class LocalMessage:
+    """Message remis par le bus en mémoire (sous-ensemble de NatsMessage)."""
+
+    body: Any
+    subject: str
+    headers: dict[str, str] = field(default_factory=dict)
+    correlation_id: Optional[str] = None
+    message_id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    committed: Optional[str] = None
+
+    @property
+    def content_type(self) -> Optional[str]:
+        return self.headers.get("content-type")
+
+    async def decode(self) -> Any:
+        return self.body
+
+    async def ack(self):
+        self.committed = "ack"
+
+    async def nack(self):
+        self.committed = "nack"
+
+
+def _wants_message(handler) -> Optional[bool]:
+    """
+    Argument attendu par un handler: le message (annoté NatsMessage), le
+    corps, ou rien (None).
+    """
+    try:
+        parameters = list(inspect.signature(handler, eval_str=True).parameters.values())
+    except (NameError, TypeError, ValueError):
+        parameters = list(inspect.signature(handler).parameters.values())
+    if not parameters:
+        return None
+    # NatsMessage est un alias Annotated de la classe de message
+    annotation = getattr(parameters[0].annotation, "__origin__", parameters[0].annotation)
+    return inspect.isclass(annotation) and issubclass(annotation, (StreamMessage, LocalMessage))
+
+
+class LocalSubscriber:
+    """Abonnement au bus en mémoire (même usage qu'un subscriber FastStream)."""
+
+    def __init__(self, broker: "LocalBroker", subject: str, queue: str = "", max_workers: int = 1):
+        self.broker = broker
+        self.subject = subject
+        self.queue = queue
+        self.handlers: list[tuple[Any, Optional[bool]]] = []
+        self.active = True
+        self._slots = asyncio.Semaphore(max_workers)
+
+    def __call__(self, handler):
+        # handler déjà décoré par un subscriber FastStream (healthcheck)
+        func = getattr(handler, "_original_call", handler)
+        self.handlers.append((func, _wants_message(func)))
+        return handler
+
+    async def start(self):
+        self.active = True
+
+    async def stop(self):
+        self.active = False
+
+    async def consume(self, message: LocalMessage):
+        async with self._slots:
+            for handler, wants_message in self.handlers:
+                try:
+                    if wants_message is None:
+                        await handler()
+                    else:
+                        await handler(message if wants_message else message.body)
+                except Exception as e:
+                    # comme FastStream: le message est refusé et l'erreur journalisée
+                    # avec le sujet, sans interrompre les autres handlers ni le bus
+                    await message.nack()
+                    self.broker.errors.append(e)
+                    logger.exception(
+                        "%s | %s - %s: %s",
+                        self.subject,
+                        message.message_id,
+                        getattr(handler, "__name__", handler),
+                        repr(e),
+                    )
+
+
+class LocalPublisher:
+    """Publisher d'un sujet du bus en mémoire."""
+
+    # publish_envelope transmet l'objet sans l'encoder
+    local = True
+
+    def __init__(self, broker: "LocalBroker", subject: str):
+        self.broker = broker
+        self.subject = subject
+
+    async def publish(self, message: Any, subject: str = "", **kwargs):
+        await self.broker.publish(message, subject or self.subject, **kwargs)
+
+
+@dataclass
+class LocalEntry:
+    """Valeur d'un bucket en mémoire (sous-ensemble de KeyValue.Entry)."""
+
+    key: str
+    value: Optional[bytes]
+    revision: int
+    # None: PUT, "DEL": suppression (comme nats-py)
+    operation: Optional[str] = None
+
+
+class LocalKeyWatcher:
+    """Surveillance d'un bucket en mémoire (itérable comme KeyWatcher)."""
+
+    def __init__(self, bucket: "LocalKeyValue"):
+        self.bucket = bucket
+        self._updates: asyncio.Queue[Optional[LocalEntry]] = asyncio.Queue()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> Optional[LocalEntry]:
+        return await self._updates.get()
+
+    async def stop(self):
+        self.bucket._watchers.discard(self)
+
+
+class LocalKeyValue:
+    """
+    Bucket KV en mémoire, partagé par les briques du processus: même usage
+    qu'un bucket NATS KV (get, put, delete, keys, watchall), mêmes
+    exceptions. Les valeurs expirent après `ttl` secondes (0: jamais).
+    """
+
+    def __init__(self, bucket: str, ttl: float = 0, clock=time.monotonic):
+        self.bucket = bucket
+        self.ttl = ttl
+        self._clock = clock
+        self._data: dict[str, tuple[LocalEntry, float]] = {}
+        self._revision = itertools.count(1)
+        self._watchers: set[LocalKeyWatcher] = set()
+
+    def _entry(self, key: str) -> Optional[LocalEntry]:
+        item = self._data.get(key)
+        if item is None:
+            return None
+        entry, expires_at = item
+        if expires_at and expires_at <= self._clock():
+            del self._data[key]
+            return None
+        return entry
+
+    def _notify(self, entry: LocalEntry):
+        for watcher in self._watchers:
+            watcher._updates.put_nowait(entry)
+
+    async def get(self, key: str) -> LocalEntry:
+        entry = self._entry(key)
+        if entry is None:
+            raise KeyNotFoundError()
+        return entry
+
+    async def put(self, key: str, value: bytes) -> int:
+        entry = LocalEntry(key, value, next(self._revision))
+        self._data[key] = (entry, self._clock() + self.ttl if self.ttl else 0)
+        self._notify(entry)
+        return entry.revision
+
+    async def delete(self, key: str) -> bool:
+        self._data.pop(key, None)
+        self._notify(LocalEntry(key, None, next(self._revision), "DEL"))
+        return True
+
+    async def keys(self, filters: Optional[list[str]] = None, **kwargs) -> list[str]:
+        keys = [
+            key
+            for key in list(self._data)
+            if self._entry(key) is not None
+            and (not filters or any(subject_matches(f, key) for f in filters))
+        ]
+        if not keys:
+            raise NoKeysError()
+        return keys
+
+    async def watchall(self, **kwargs) -> LocalKeyWatcher:
+        """Valeurs actuelles, puis None, puis chaque modification."""
+        watcher = LocalKeyWatcher(self)
+        for key in list(self._data):
+            if (entry := self._entry(key)) is not None:
+                watcher._updates.put_nowait(entry)
+        watcher._updates.put_nowait(None)
+        self._watchers.add(watcher)
+        return watcher
+
+
+class LocalBroker:
+    """
+    Bus en mémoire: même interface que NatsBroker pour les usages des
+    briques (subscriber, publisher, publish).
+    """
+
+    def __init__(self):
+        self.subscribers: list[LocalSubscriber] = []
+        self._turns: dict[tuple[str, str], itertools.count] = {}
+        self._tasks: set[asyncio.Task] = set()
+        # exceptions levées par les handlers, dans l'ordre
+        self.errors: list[Exception] = []
+        self.buckets: dict[str, LocalKeyValue] = {}
+
+    def subscriber(self, subject: str, queue: str = "", max_workers: int = 1, **kwargs):
+        # options propres à NATS (pending_msgs_limit...) sans objet ici
+        subscriber = LocalSubscriber(self, subject, queue, max_workers)
+        self.subscribers.append(subscriber)
+        return subscriber
+
+    def publisher(self, subject: str, **kwargs) -> LocalPublisher:
+        return LocalPublisher(self, subject)
+
+    async def publish(
+        self,
+        message: Any,
+        subject: str,
+        headers: Optional[dict[str, str]] = None,
+        correlation_id: Optional[str] = None,
+        **kwargs,
+    ):
+        """Remet `message` aux abonnés de `subject` (traitement en tâche de fond)."""
+        correlation_id = correlation_id or uuid.uuid4().hex
+        groups: dict[tuple[str, str], list[LocalSubscriber]] = {}
+        for subscriber in self.subscribers:
+            if not (subscriber.active and subscriber.handlers):
+                continue
+            if subject_matches(subscriber.subject, subject):
+                groups.setdefault((subscriber.subject, subscriber.queue), []).append(subscriber)
+        for (pattern, queue), members in groups.items():
+            if queue:
+                # un seul membre du groupe, à tour de rôle
+                turn = next(self._turns.setdefault((pattern, queue), itertools.count()))
+                members = [members[turn % len(members)]]
+            for subscriber in members:
+                local = LocalMessage(message, subject, dict(headers or {}), correlation_id)
+                task = asyncio.create_task(subscriber.consume(local))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+
+    async def join(self, raise_errors: bool = False):
+        """
+        Attend la fin des traitements en cours (et de ceux qu'ils publient).
+
+        Args:
+            raise_errors: Lève la première exception d'un handler survenue
+                depuis le dernier appel (comme TestNatsBroker dans les tests)
+        """
+        while self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        if raise_errors and self.errors:
+            error, self.errors = self.errors[0], []
+            raise error
+
+    async def connect(self):
+        return self
+
+    async def ping(self, timeout: Optional[float] = None) -> bool:
+        return True
+
+    async def start(self):
+        # abonnements actifs dès leur déclaration
+        ...
+
+    async def stop(self):
+        await self.join()
+
+    async def key_value(self, bucket: str, ttl: float = 0, **kwargs) -> LocalKeyValue:
+        """Bucket KV en mémoire (créé au premier appel, comme avec NATS)."""
+        if bucket not in self.buckets:
+            self.buckets[bucket] = LocalKeyValue(bucket, ttl=ttl or 0)
+        return self.buckets[bucket]
+
+
+_local_broker: Optional[LocalBroker] = None
+
+
+def get_local_broker() -> LocalBroker:
+    """Bus en mémoire du processus (singleton)."""
+    global _local_broker
+    if _local_broker is None:
+        _local_broker = LocalBroker()
+    return _local_broker
+
+
+class LocalApp:
+    """Hooks de cycle de vie d'une brique en mode mémoire (comme FastStream)."""
+
+    def __init__(self, broker: LocalBroker):
+        self.broker = broker
+        self._hooks: dict[str, list] = {
+            "on_startup": [],
+            "after_startup": [],
+            "on_shutdown": [],
+            "after_shutdown": [],
+        }
+
+    def _hook(self, name: str):
+        def register(func):
+            self._hooks[name].append(func)
+            return func
+
+        return register
+
+    def on_startup(self, func):
+        return self._hook("on_startup")(func)
+
+    def after_startup(self, func):
+        return self._hook("after_startup")(func)
+
+    def on_shutdown(self, func):
+        return self._hook("on_shutdown")(func)
+
+    def after_shutdown(self, func):
+        return self._hook("after_shutdown")(func)
+
+    async def _run(self, name: str):
+        for func in self._hooks[name]:
+            await func()
+
+
+@asynccontextmanager
+async def serve_local(*apps: LocalApp):
+    """
+    Démarre des briques en mode mémoire, dans l'ordre des hooks FastStream:
+    on_startup de toutes les briques, bus, after_startup; l'inverse à l'arrêt.
+    """
+    brokers = list(dict.fromkeys(app.broker for app in apps))
+    for app in apps:
+        await app._run("on_startup")
+    for broker in brokers:
+        await broker.start()
+    for app in apps:
+        await app._run("after_startup")
+    try:
+        yield
+    finally:
+        for app in apps:
+            await app._run("on_shutdown")
+        for broker in brokers:
+            await broker.stop()
+        for app in apps:
+            await app._run("after_shutdown")
+
+
 def get_nats_url():
     url = os.environ.get("NATS_URL", "nats://localhost:4222")
     print(f"Connecting to NATS {url} ...")
@@ -95,6 +1275,10 @@ def get_nats_url():
 router = NatsRouter(prefix="")
 
 broker = None
+# brique du processus en NATS (init_esb_app); None en mode mémoire
+service: Optional[CtxService] = None
+# briques du processus par préfixe: une en NATS, toutes en mode mémoire
+services: dict[str, CtxService] = {}
 
 
 @router.subscriber("healthcheck")
@@ -103,4 +1287,19 @@ async def healthcheck_sub(
     # logger: Logger,
 ):
     # logger.info("Incoming value: %s, depends value: %s" % (message.m, dependency))
+    if service is not None and not service.ready:
+        # arrêt en cours: la brique ne compte plus parmi les répliques actives
+        return
     await broker.publish("I am alive !", "healthcheck_resp")
+
+
+def _local_healthcheck(ctx: CtxService):
+    """Healthcheck d'une brique en mode mémoire (son propre état `ready`)."""
+
+    async def healthcheck():
+        if not ctx.ready:
+            return
+        await ctx.broker.publish("I am alive !", "healthcheck_resp")
+
+    healthcheck.__name__ = f"healthcheck_{ctx.prefix}"
+    return healthcheck
@@ -2,8 +2,10 @@
 #
 # SPDX-License-Identifier: GPL-3.0-or-later
 
-from enum import Enum
+import functools
 import hashlib
+from enum import Enum
+from typing import Iterable
 
 
 class PeppolEnvironment(Enum):
@@ -21,6 +23,34 @@ class PeppolScheme(Enum):
     TVA_FR = "9957"  # FR + 11 caractères
 
 
+class SmlHashScheme(Enum):
+    """Algorithmes de calcul du hostname SML d'un participant."""
+
+    # historique: "B-" + md5 hexadécimal
+    MD5 = "md5"
+    # BDXL / NAPTR: base32 (sans padding) du sha256
+    SHA256 = "sha256"
+
+
+# Scheme d'identifiant des participants (préfixe DNS après l'empreinte)
+PARTICIPANT_ID_SCHEME = "iso6523-actorid-upis"
+
+# Nombre de hostnames mémorisés pour le chemin par facture
+SML_HOSTNAME_CACHE_SIZE = 100_000
+
+# Alphabet base32 (RFC 4648) par paires: une recherche pour 10 bits
+_BASE32_ALPHABET = "ABCDEFGHIJKLMNOPQRSTUVWXYZ234567"
+_BASE32_PAIRS = [a + b for a in _BASE32_ALPHABET for b in _BASE32_ALPHABET]
+# 256 bits complétés à 260 (52 caractères): décalages des 26 paires
+_BASE32_SHIFTS = range(250, -10, -10)
+
+
+def _base32_sha256(digest: bytes) -> str:
+    """Encode un SHA-256 en base32 sans padding (plus rapide que base64.b32encode)."""
+    n = int.from_bytes(digest, "big") << 4
+    return "".join([_BASE32_PAIRS[(n >> shift) & 0x3FF] for shift in _BASE32_SHIFTS])
+
+
 def compute_participant_hash(scheme_id: str, participant_id: str) -> str:
     """
     Calcule le hash MD5 de l'identifiant participant PEPPOL.
@@ -36,26 +66,97 @@ def compute_participant_hash(scheme_id: str, participant_id: str) -> str:
     return hashlib.md5(full_id.encode("utf-8")).hexdigest()
 
 
+def compute_participant_hash_sha256(scheme_id: str, participant_id: str) -> str:
+    """
+    Calcule l'empreinte SHA-256 (BDXL) de l'identifiant participant PEPPOL.
+
+    Args:
+        scheme_id: Scheme ID (ex: "0009" pour SIREN)
+        participant_id: Identifiant (ex: "123456789")
+
+    Returns:
+        SHA-256 de "{scheme_id}:{participant_id}" en minuscules, encodé
+        en base32 majuscule sans padding (52 caractères)
+    """
+    full_id = f"{scheme_id}:{participant_id}".lower()
+    return _base32_sha256(hashlib.sha256(full_id.encode("utf-8")).digest())
+
+
+@functools.lru_cache(maxsize=SML_HOSTNAME_CACHE_SIZE)
 def compute_sml_hostname(
     sml_zone: str,
     scheme_id: str,
     participant_id: str,
+    hash_scheme: SmlHashScheme = SmlHashScheme.MD5,
 ) -> str:
     """
     Génère le hostname SML pour un participant PEPPOL.
 
-    Algorithme:
+    Algorithme MD5 (historique):
     1. Construire l'identifiant: "{scheme_id}::{participant_id}"
     2. Convertir en minuscules
     3. Calculer le hash MD5
     4. Construire: "B-{hash}.iso6523-actorid-upis.{sml_zone}"
 
+    Algorithme SHA256 (NAPTR):
+    1. Construire l'identifiant: "{scheme_id}:{participant_id}"
+    2. Convertir en minuscules
+    3. Calculer le hash SHA-256, encodé en base32 sans padding
+    4. Construire: "{hash}.iso6523-actorid-upis.{sml_zone}"
+
+    Les résultats sont mémorisés (LRU) pour le chemin par facture;
+    utiliser `compute_sml_hostnames` pour des lots.
+
     Args:
+        sml_zone: Zone DNS du SML
         scheme_id: Scheme ID (ex: "0009")
         participant_id: Identifiant (ex: "123456789")
+        hash_scheme: Algorithme de calcul de l'empreinte
 
     Returns:
         Hostname SML complet
     """
+    if hash_scheme == SmlHashScheme.SHA256:
+        hash_value = compute_participant_hash_sha256(scheme_id, participant_id)
+        return f"{hash_value}.{PARTICIPANT_ID_SCHEME}.{sml_zone}"
     hash_value = compute_participant_hash(scheme_id, participant_id)
-    return f"B-{hash_value}.iso6523-actorid-upis.{sml_zone}"
+    return f"B-{hash_value}.{PARTICIPANT_ID_SCHEME}.{sml_zone}"
+
+
+def compute_sml_hostnames(
+    sml_zone: str,
+    scheme_id: str,
+    participant_ids: Iterable[str],
+    hash_scheme: SmlHashScheme = SmlHashScheme.MD5,
+) -> list[str]:
+    """
+    Génère les hostnames SML d'un lot de participants d'un même scheme.
+
+    Destiné au préchauffage (caches, zone du faux DNS) à partir d'extraits
+    de l'annuaire: le préfixe, le suffixe et les fonctions de hash sont
+    préparés une seule fois et le cache LRU n'est pas sollicité.
+
+    Args:
+        sml_zone: Zone DNS du SML
+        scheme_id: Scheme ID commun au lot (ex: "0009")
+        participant_ids: Identifiants (ex: SIREN)
+        hash_scheme: Algorithme de calcul de l'empreinte
+
+    Returns:
+        Hostnames SML, dans l'ordre de `participant_ids`
+    """
+    suffix = f".{PARTICIPANT_ID_SCHEME}.{sml_zone}"
+    if hash_scheme == SmlHashScheme.SHA256:
+        prefix = f"{scheme_id}:".lower()
+        sha256 = hashlib.sha256
+        encode = _base32_sha256
+        return [
+            encode(sha256((prefix + pid.lower()).encode()).digest()) + suffix
+            for pid in participant_ids
+        ]
+    prefix = f"{scheme_id}::".lower()
+    md5 = hashlib.md5
+    return [
+        "B-" + md5((prefix + pid.lower()).encode()).hexdigest() + suffix
+        for pid in participant_ids
+    ]
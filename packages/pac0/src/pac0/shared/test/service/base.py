@@ -170,13 +170,21 @@ class BaseServiceContext:
         await self._terminate()
 
     async def _terminate(self) -> None:
-        """Terminate the subprocess."""
+        """
+        Terminate the subprocess.
+
+        SIGTERM first: an ESB brick drains (ESB_DRAIN_TIMEOUT) before exiting,
+        so it is only killed after `shutdown_timeout`.
+        """
         if self._process:
             logger.info("Stopping service...")
             self._process.terminate()
 
             try:
-                self._process.wait(timeout=self.config.shutdown_timeout)
+                # without blocking the event loop: services of a group drain together
+                await asyncio.to_thread(
+                    self._process.wait, timeout=self.config.shutdown_timeout
+                )
             except subprocess.TimeoutExpired:
                 logger.warning("Service didn't terminate gracefully, killing...")
                 self._process.kill()
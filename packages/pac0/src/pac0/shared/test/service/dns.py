@@ -20,12 +20,13 @@ from pac0.shared.test.service.base import BaseServiceContext, ServiceConfig
 class DNSServiceContext(BaseServiceContext):
     """Test context for a DNS service."""
 
-    def __init__(self) -> None:
+    def __init__(self, env_var_extra: dict[str, str] | None = None) -> None:
         config = ServiceConfig(
             name = "peppol",
             command=["uv", "run", "src/pac0/service/peppol_dns_fake/main.py"],
             port=0,
             allow_ConnectionRefusedError = True,
             health_check_path = None,
+            env_var_extra=env_var_extra,
         )
         super().__init__(config)
@@ -34,4 +34,6 @@ class FastStreamServiceContext(BaseServiceContext):
                 "NATS_URL": nats_url,
             },
         )
+        # the brick drains before _terminate resorts to SIGKILL
+        config.env_var_extra["ESB_DRAIN_TIMEOUT"] = str(max(config.shutdown_timeout - 2, 1))
         super().__init__(config)
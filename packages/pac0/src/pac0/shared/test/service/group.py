@@ -26,12 +26,12 @@ class FastStreamServiceContext(BaseServiceContext):
 
     async def __aexit__(self, exc_type: Any, exc_val: Any, exc_tb: Any) -> None:
         await asyncio.gather(
-            [s.__aexit__(exc_type, exc_val, exc_tb) for s in self.services]
+            *[s.__aexit__(exc_type, exc_val, exc_tb) for s in self.services]
         )
 
     async def _terminate(self) -> None:
         """Terminate all the subprocesses."""
-        await asyncio.gather([s._terminate() for s in self.services])
+        await asyncio.gather(*[s._terminate() for s in self.services])
 
     async def wait_for_ready(self, timeout: float = 30.0) -> bool:
         """Wait for services to be ready via TCP and HTTP health check."""
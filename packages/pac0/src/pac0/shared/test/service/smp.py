@@ -0,0 +1,41 @@
+# SPDX-FileCopyrightText: 2026 Philippe ENTZMANN <philippe@entzmann.name>
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from pac0.shared.test.service.base import BaseServiceContext, ServiceConfig
+
+
+class SmpServiceContext(BaseServiceContext):
+    """Test context for the SMP stand-in (peppol_smp_fake)."""
+
+    def __init__(
+        self,
+        registry: str | None = None,
+        latency: float = 0.0,
+        error_rate: float = 0.0,
+        unavailable_rate: float = 0.0,
+    ) -> None:
+        env_var_extra = {
+            "SMP_LATENCY": str(latency),
+            "SMP_ERROR_RATE": str(error_rate),
+            "SMP_UNAVAILABLE_RATE": str(unavailable_rate),
+        }
+        if registry:
+            env_var_extra["SMP_REGISTRY"] = registry
+        config = ServiceConfig(
+            name="smp",
+            command=[
+                "uv",
+                "run",
+                "fastapi",
+                "run",
+                "src/pac0/service/peppol_smp_fake/main.py",
+            ],
+            port=0,
+            allow_ConnectionRefusedError=True,
+            health_check_path="/healthcheck",
+            # the registry may take a while to load
+            startup_timeout=120.0,
+            env_var_extra=env_var_extra,
+        )
+        super().__init__(config)
@@ -7,7 +7,8 @@ WorldContext for managing test environments with multiple services.
 
 The world consists of:
 - An instance of a NATS service (shared ESB)
-- An instance of a Peppol service (for routing)
+- An instance of a Peppol service (for routing): fake DNS (SML), and an
+  SMP stand-in sharing its participant registry file when one is given
 - Multiple instances of PA services
 
 All services implement the ServiceProtocol for consistent lifecycle management.
@@ -23,9 +24,13 @@ from dataclasses import dataclass
 from typing import Any, AsyncContextManager, Self
 
 import pytest
+from pac0.service.routage.peppol import PeppolLookupService
+from pac0.shared.peppol import PeppolEnvironment
 from pac0.shared.test.service.dns import DNSServiceContext
 from pac0.shared.test.service.nats import NatsServiceContext
 from pac0.shared.test.service.pac import PacServiceContext
+from pac0.shared.test.service.smp import SmpServiceContext
+from pac0.shared.tools.api import find_available_port
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
@@ -33,12 +38,22 @@ logger.setLevel(logging.DEBUG)
 @dataclass
 class WorldContext:
     peppol: DNSServiceContext
+    smp: SmpServiceContext | None
     pas: list[PacServiceContext]
 
     def __init__(
         self,
+        peppol_registry: str | None = None,
     ):
+        """
+        Args:
+            peppol_registry: participants registry file (see peppol_smp_fake)
+                served by the SMP stand-in and published in the fake DNS;
+                without it, no SMP stand-in is started
+        """
+        self.peppol_registry = peppol_registry
         self.peppol = DNSServiceContext()
+        self.smp = SmpServiceContext(registry=peppol_registry) if peppol_registry else None
         self.pas = []
         super().__init__()
 
@@ -60,6 +75,18 @@ class WorldContext:
             raise IndexError("pa instance not found")
         return self.pas[1]
 
+    def peppol_lookup_service(self, **kwargs) -> PeppolLookupService:
+        """
+        PeppolLookupService resolving participants through the world's fake
+        DNS, hence reaching the SMP stand-in for registry participants.
+        """
+        return PeppolLookupService(
+            environment=PeppolEnvironment.TEST,
+            dns_nameservers=["127.0.0.1"],
+            dns_port=self.peppol.config.port,
+            **kwargs,
+        )
+
     async def pa_new(self, count:int = 1) -> PacServiceContext:
         '''
         Add `count` new PA instances to the world context
@@ -77,14 +104,26 @@ class WorldContext:
         self.pas.extend(pas_new)
         return self.pas[-1]
 
-    async def __aenter__(self) -> Self:
+    def _services(self) -> list[AsyncContextManager]:
         services: list[AsyncContextManager] = [self.peppol, *self.pas]
-        await asyncio.gather(*[s.__aenter__() for s in services])
+        if self.smp is not None:
+            services.append(self.smp)
+        return services
+
+    async def __aenter__(self) -> Self:
+        if self.smp is not None:
+            # the fake DNS points the registry participants to the SMP stand-in
+            self.smp.config.port = await find_available_port()
+            self.peppol.config.env_var_extra = {
+                "PEPPOL_REGISTRY": self.peppol_registry,
+                "PEPPOL_SMP_URL": self.smp.url,
+            }
+        await asyncio.gather(*[s.__aenter__() for s in self._services()])
         logger.info("WorldContext: enter context ...")
         return self
 
     async def __aexit__(self, exc_type: Any, exc_val: Any, exc_tb: Any) -> None:
-        services: list[AsyncContextManager] = [self.peppol, *self.pas]
+        services = self._services()
         await asyncio.gather(
             *[s.__aexit__(exc_type, exc_val, exc_tb) for s in services]
         )
@@ -0,0 +1,32 @@
+# SPDX-FileCopyrightText: 2026 Philippe ENTZMANN <philippe@entzmann.name>
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+"""Stand-ins shared by the routage tests (SMP, clock, polling)."""
+
+import asyncio
+
+SMP_URL = "https://smp.example.com"
+HOST = "smp.example.com"
+
+
+async def no_service_group(smp_url, scheme_id, participant_id):
+    """SMP without ServiceGroup listing: one request per document type"""
+    return None, None
+
+
+class FakeClock:
+    """Clock moved by hand: `clock.now += seconds`"""
+
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+async def wait_until(predicate, timeout: float = 5.0):
+    """Poll `predicate` until it holds; TimeoutError after `timeout` seconds"""
+    async with asyncio.timeout(timeout):
+        while not predicate():
+            await asyncio.sleep(0.001)
@@ -0,0 +1,209 @@
+# SPDX-FileCopyrightText: 2026 Philippe ENTZMANN <philippe@entzmann.name>
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import httpx
+import pytest
+from faststream.nats import NatsMessage
+
+from pac0.service.api_gateway.lib.invoices import SUBJECT_OUT, publish_invoice
+from pac0.service.as4_fake.main import create_app
+from pac0.service.routage import lib
+from pac0.service.routage.as4 import As4Transmitter
+from pac0.service.routage.models import InvoiceMessage, RoutingStatus
+from pac0.service.routage.peppol import PeppolEndpoint, PeppolLookupResult
+from pac0.shared.blob import (
+    BlobIntegrityError,
+    BlobNotFoundError,
+    BlobStore,
+    LocalBlobStore,
+    blob_ref,
+    check_in,
+    check_out,
+)
+from pac0.shared.esb import LocalBroker, routing_headers
+
+DOCUMENT = b"%PDF-1.7 Factur-X " + b"x" * 100_000
+
+
+async def test_local_blob_store(tmp_path):
+    store = LocalBlobStore(tmp_path)
+    ref = await store.put(DOCUMENT, "application/pdf")
+
+    assert ref == blob_ref(DOCUMENT, "application/pdf")
+    assert await store.exists(ref)
+    assert await store.get(ref) == DOCUMENT
+    # adressé par contenu: un second dépôt ne réécrit rien
+    assert await store.put(DOCUMENT, "application/pdf") == ref
+    assert len(list(tmp_path.rglob("*"))) == 2
+
+    await store.delete(ref)
+    assert not await store.exists(ref)
+    with pytest.raises(BlobNotFoundError):
+        await store.get(ref)
+
+
+def test_blob_store_is_abstract():
+    class Incomplete(BlobStore):
+        async def exists(self, ref):
+            return False
+
+    with pytest.raises(TypeError):
+        Incomplete()
+
+
+async def test_corrupted_blob(tmp_path):
+    store = LocalBlobStore(tmp_path)
+    ref = await store.put(DOCUMENT)
+    store._path(ref.sha256).write_bytes(b"tampered")
+    with pytest.raises(BlobIntegrityError):
+        await store.get(ref)
+
+
+async def test_check_in_check_out(tmp_path):
+    store = LocalBlobStore(tmp_path)
+    message = {"invoice_id": "INV-1", "payload": DOCUMENT.decode()}
+
+    checked = await check_in(store, message)
+    assert checked["payload"] is None
+    assert checked["payload_ref"]["sha256"] == blob_ref(DOCUMENT).sha256
+    assert message["payload"] == DOCUMENT.decode()
+    assert await check_out(store, checked) == DOCUMENT
+
+    # petits documents laissés en ligne
+    small = {"invoice_id": "INV-2", "payload": "<Invoice/>"}
+    assert await check_in(store, small, min_size=1024) is small
+    assert await check_out(store, small) == b"<Invoice/>"
+
+
+async def test_routage_fetches_payload_only_when_needed(tmp_path):
+    store = LocalBlobStore(tmp_path)
+    message = InvoiceMessage(
+        **await check_in(
+            store,
+            {
+                "invoice_id": "INV-1",
+                "sender_siren": "111111111",
+                "recipient_siren": "123456789",
+                "payload": "<Invoice/>",
+            },
+        )
+    )
+    assert message.payload is None
+    assert lib.recipient_key(message) == "123456789"
+
+    lib.set_blob_store(store)
+    try:
+        assert (await lib.with_payload(message)).payload == b"<Invoice/>"
+    finally:
+        lib.set_blob_store(None)
+
+
+async def test_route_binary_payload_ref(tmp_path):
+    """a non-UTF-8 document stays bytes from the store to the AS4 receiver"""
+    store = LocalBlobStore(tmp_path)
+    document = b"%PDF-1.7\n\xe2\xe3\xcf\xd3\n" + bytes(range(256))
+    message = InvoiceMessage(
+        **await check_in(
+            store,
+            {
+                "invoice_id": "INV-1",
+                "sender_siren": "111111111",
+                "recipient_siren": "123456789",
+                "payload": document,
+            },
+            content_type="application/pdf",
+        )
+    )
+    endpoint = PeppolEndpoint(
+        address="http://ap.example.com/as4",
+        certificate="ZmFrZQ==",
+        transport_profile="peppol-transport-as4-v2_0",
+    )
+
+    class Lookup:
+        async def lookup_by_siren(self, siren, document_type="invoice_ubl"):
+            return PeppolLookupResult(success=True, endpoint=endpoint)
+
+    app = create_app()
+    lib.set_blob_store(store)
+    lib.set_peppol_service(Lookup())
+    lib.set_as4_transmitter(
+        As4Transmitter(
+            "POP000001", transport=httpx.ASGITransport(app=app), allow_plaintext=True
+        )
+    )
+    try:
+        result = await lib.route_invoice(message)
+    finally:
+        await lib.get_as4_transmitter().close()
+        lib.set_as4_transmitter(None)
+        lib.set_peppol_service(None)
+        lib.set_blob_store(None)
+
+    assert result.status == RoutingStatus.ROUTED, result.error_message
+    [received] = app.state.received
+    assert received.payload == document
+
+
+async def test_api_gateway_checks_documents_in(tmp_path):
+    """api-gateway-OUT only carries the document ref, in the InvoiceMessage shape"""
+    store = LocalBlobStore(tmp_path)
+    bus = LocalBroker()
+    received = []
+
+    @bus.subscriber(SUBJECT_OUT)
+    async def out(message: NatsMessage):
+        received.append(message)
+
+    invoice = InvoiceMessage(
+        invoice_id="INV-1",
+        sender_siren="111111111",
+        recipient_siren="123456789",
+        payload=DOCUMENT,
+    )
+    await publish_invoice(
+        bus.publisher(SUBJECT_OUT),
+        invoice,
+        store,
+        correlation_id="c-1",
+        content_type="application/pdf",
+    )
+    await bus.join(raise_errors=True)
+
+    [message] = received
+    assert message.correlation_id == "c-1"
+    assert message.body["payload"] is None
+    assert message.body["payload_ref"]["content_type"] == "application/pdf"
+    # validé tel quel par les briques suivantes
+    checked = InvoiceMessage(**message.body)
+    assert checked.payload_ref.sha256 == blob_ref(DOCUMENT).sha256
+    assert await check_out(store, message.body) == DOCUMENT
+    routing = routing_headers(message)
+    assert (routing.invoice_id, routing.recipient_siren) == ("INV-1", "123456789")
+
+
+def test_invoice_requires_payload_or_ref():
+    with pytest.raises(ValueError):
+        InvoiceMessage(invoice_id="INV-1", sender_siren="1", recipient_siren="2")
+
+
+async def test_nats_blob_store():
+    """JetStream object store backend"""
+    from faststream.nats import NatsBroker
+    from nats.server import run
+
+    from pac0.shared.blob import NatsBlobStore
+
+    async with await run(port=0, jetstream=True) as server:
+        broker = NatsBroker(f"nats://127.0.0.1:{server.port}")
+        await broker.connect()
+        try:
+            store = NatsBlobStore(broker, "test-blobs")
+            ref = await store.put(DOCUMENT)
+            assert await store.exists(ref)
+            assert await store.get(ref) == DOCUMENT
+            await store.delete(ref)
+            assert not await store.exists(ref)
+        finally:
+            await broker.stop()
@@ -0,0 +1,96 @@
+# SPDX-FileCopyrightText: 2026 Philippe ENTZMANN <philippe@entzmann.name>
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import asyncio
+
+from pac0.shared.esb import BatchPublisher, SettingsService, init_esb_app
+
+
+class Publisher:
+    """Stand-in for a FastStream publisher, with a JetStream-like ack delay"""
+
+    def __init__(self, delay=0.0, reject=()):
+        self.delay = delay
+        self.reject = reject
+        self.published = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def publish(self, message, **kwargs):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.delay)
+            if message in self.reject:
+                raise TimeoutError("no ack")
+            self.published.append((message, kwargs))
+        finally:
+            self.in_flight -= 1
+
+
+async def test_flush_on_size_and_interval():
+    publisher = Publisher()
+    batch = BatchPublisher(publisher, size=3, interval=0.05)
+    for i in range(4):
+        await batch.publish(i, correlation_id=f"c-{i}")
+
+    assert [m for m, _ in publisher.published] == [0, 1, 2]
+    # le lot incomplet part après `interval`
+    await asyncio.sleep(0.1)
+    assert publisher.published[3] == (3, {"correlation_id": "c-3"})
+    assert batch.flushes == 2
+
+
+async def test_close_waits_for_timer_flush():
+    publisher = Publisher(delay=0.05)
+    batch = BatchPublisher(publisher, size=10, interval=0.01)
+    await batch.publish(0)
+    # le timer a lancé le flush, encore en cours de publication
+    await asyncio.sleep(0.02)
+    assert publisher.in_flight == 1
+
+    await batch.close()
+    assert publisher.published == [(0, {})]
+
+
+async def test_acks_collected_in_background():
+    publisher = Publisher(delay=0.05, reject={7})
+    batch = BatchPublisher(publisher, size=10, interval=1, max_pending_acks=4, acked=True)
+    for i in range(10):
+        await batch.publish(i)
+
+    # le lot est parti sans attendre les accusés
+    assert batch.pending_acks > 0
+    await batch.close()
+    assert batch.pending_acks == 0
+    assert sorted(m for m, _ in publisher.published) == [0, 1, 2, 3, 4, 5, 6, 8, 9]
+    assert publisher.max_in_flight == 4
+    assert [m for m, _ in batch.failed] == [7]
+
+
+async def test_publish_many():
+    ctx, broker, app = init_esb_app("demo", SettingsService(_env_file=None, mode="memory"))
+    received = []
+
+    @broker.subscriber(ctx.subject_out)
+    async def handler(message: int):
+        received.append(message)
+
+    failed = await ctx.publish_many(range(250))
+    await broker.join()
+
+    assert failed == []
+    assert sorted(received) == list(range(250))
+    assert ctx.batches == []
+
+
+async def test_batches_flushed_on_shutdown():
+    ctx, broker, app = init_esb_app("demo", SettingsService(_env_file=None, mode="memory"))
+    publisher = Publisher()
+    batch = ctx.batch_publisher(publisher, size=100, interval=60)
+    await batch.publish("last")
+    assert publisher.published == []
+
+    await app._run("on_shutdown")
+    assert publisher.published == [("last", {})]
@@ -0,0 +1,90 @@
+# SPDX-FileCopyrightText: 2026 Philippe ENTZMANN <philippe@entzmann.name>
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import base64
+import json
+
+import pytest
+from faststream.nats import NatsBroker, NatsMessage, TestNatsBroker
+
+from pac0.service.routage.models import RoutingResult, RoutingStatus
+from pac0.shared import esb
+from pac0.shared.esb import (
+    HEADER_LOCAL_RECIPIENT,
+    HEADER_STAGE,
+    RoutingHeaders,
+    decode_body,
+    decode_envelope,
+    encode_body,
+    forward,
+    publish_envelope,
+    routing_headers,
+)
+
+DOCUMENT = b"%PDF-1.7\x00\xff" + b"x" * 1000
+ROUTING = RoutingHeaders(
+    invoice_id="INV-1",
+    sender_siren="111111111",
+    recipient_siren="123456789",
+    document_type="invoice_ubl",
+    stage="annuaire-local-OUT",
+    local_recipient=False,
+)
+
+
+def test_routing_headers():
+    headers = ROUTING.to_headers()
+    assert headers[HEADER_LOCAL_RECIPIENT] == "0"
+    assert RoutingHeaders.from_headers(headers) == ROUTING
+    assert RoutingHeaders().to_headers() == {}
+    assert RoutingHeaders.from_headers(None) == RoutingHeaders()
+
+
+def test_body_round_trip():
+    body = {"invoice_id": "INV-1", "document": DOCUMENT, "lines": [1, 2.5, None]}
+    data, content_type = encode_body(body)
+    assert content_type == esb.CONTENT_TYPE_MSGPACK
+    assert decode_body(data, content_type) == body
+
+    result = RoutingResult(invoice_id="INV-1", status=RoutingStatus.ROUTED_TO_PPF)
+    assert decode_body(*encode_body(result))["status"] == RoutingStatus.ROUTED_TO_PPF.value
+
+
+def test_json_body_still_decoded():
+    """bodies published as JSON by older producers remain readable"""
+    data = json.dumps({"document": {"$bytes": base64.b64encode(DOCUMENT).decode()}})
+    assert decode_body(data.encode(), esb.CONTENT_TYPE_JSON) == {"document": DOCUMENT}
+
+
+def test_unsupported_content_type():
+    with pytest.raises(ValueError):
+        decode_body(b"", "text/plain")
+
+
+async def test_forward_keeps_body_and_headers():
+    """a forwarding stage reads the headers only and republishes the body as is"""
+    broker = NatsBroker()
+    publisher_in = broker.publisher("routage-IN")
+    received = []
+
+    @broker.subscriber("annuaire-local-OUT")
+    async def route(message: NatsMessage):
+        assert routing_headers(message).local_recipient is False
+        await forward(publisher_in, message, stage="routage-IN")
+
+    @broker.subscriber("routage-IN")
+    async def routage(message: NatsMessage):
+        received.append((message, await decode_envelope(message)))
+
+    async with TestNatsBroker(broker) as br:
+        body = {"invoice_id": "INV-1", "document": DOCUMENT}
+        await publish_envelope(
+            br.publisher("annuaire-local-OUT"), body, ROUTING, correlation_id="c-1"
+        )
+
+    [(message, decoded)] = received
+    assert decoded == body
+    assert message.correlation_id == "c-1"
+    assert message.headers[HEADER_STAGE] == "routage-IN"
+    assert routing_headers(message).invoice_id == "INV-1"
@@ -0,0 +1,158 @@
+# SPDX-FileCopyrightText: 2026 Philippe ENTZMANN <philippe@entzmann.name>
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import asyncio
+
+import pytest
+from faststream import AckPolicy
+
+from pac0.shared.esb import (
+    AckBatcher,
+    JetStreamConfig,
+    SettingsService,
+    _AckBatchMiddleware,
+    declare_stream,
+    durable_name,
+    init_esb_app,
+)
+
+
+class Message:
+    """Stand-in for a FastStream NatsMessage"""
+
+    def __init__(self, reply="$JS.ACK.pac0.demo.1.1.1.0.0"):
+        self.raw_message = type("Raw", (), {"reply": reply})()
+        self.committed = None
+
+    async def ack(self):
+        self.committed = "ack"
+
+    async def nack(self):
+        self.committed = "nack"
+
+
+def test_config_from_settings(monkeypatch):
+    assert JetStreamConfig.from_settings(SettingsService()) is None
+
+    monkeypatch.setenv("ESB_MODE", "jetstream")
+    monkeypatch.setenv("ESB_FETCH_BATCH", "500")
+    monkeypatch.setenv("ESB_ACK_WAIT", "2.5")
+    config = JetStreamConfig.from_settings(SettingsService())
+    assert config.fetch_batch == 500
+    assert config.ack_wait == 2.5
+    assert config.consumer_config().max_deliver == config.max_deliver
+
+
+def test_core_subscriber_by_default():
+    ctx, broker, _ = init_esb_app("demo")
+    assert ctx.jetstream is None
+
+    @ctx.subscriber(ctx.subject_in)
+    async def handler(message): ...
+
+    [subscriber] = [s for s in broker.subscribers if s._subject == "demo-IN"]
+    assert subscriber.queue == "q"
+
+
+def test_jetstream_pull_subscriber(monkeypatch):
+    monkeypatch.setenv("ESB_MODE", "jetstream")
+    monkeypatch.setenv("ESB_FETCH_BATCH", "200")
+    monkeypatch.setenv("ESB_ACK_BATCH", "50")
+    ctx, broker, _ = init_esb_app("demo")
+    assert ctx.acks is not None
+
+    @ctx.subscriber(ctx.subject_in)
+    async def handler(message): ...
+
+    [subscriber] = [s for s in broker.subscribers if s._subject == "demo-IN"]
+    assert subscriber.pull_sub.batch_size == 200
+    assert subscriber.extra_options["durable"] == durable_name("demo", "demo-IN")
+    assert subscriber.extra_options["stream"] == "pac0"
+    assert subscriber.ack_policy is AckPolicy.MANUAL
+
+
+def test_durable_name():
+    assert durable_name("routage", "routage-IN.3") == "routage__routage-IN_3"
+
+
+async def test_ack_batcher():
+    batcher = AckBatcher(size=3, interval=0.05)
+    messages = [Message() for _ in range(4)]
+    for message in messages:
+        await batcher.add(message)
+
+    assert [m.committed for m in messages] == ["ack", "ack", "ack", None]
+    # le reste part après `interval`
+    await asyncio.sleep(0.1)
+    assert messages[3].committed == "ack"
+    assert batcher.flushes == 2
+
+
+async def test_ack_batcher_close_waits_for_timer_flush():
+    class SlowMessage(Message):
+        async def ack(self):
+            await asyncio.sleep(0.05)
+            await super().ack()
+
+    batcher = AckBatcher(size=10, interval=0.01)
+    message = SlowMessage()
+    await batcher.add(message)
+    # le timer a lancé le flush, acquittement en cours
+    await asyncio.sleep(0.02)
+    assert message.committed is None
+
+    await batcher.close()
+    assert message.committed == "ack"
+
+
+async def test_ack_middleware():
+    batcher = AckBatcher(size=10, interval=10)
+
+    async def ok(msg):
+        return "done"
+
+    async def fail(msg):
+        raise ValueError("boom")
+
+    processed, failed, core = Message(), Message(), Message(reply="_INBOX.1")
+    middleware = _AckBatchMiddleware(None, context=None, batcher=batcher)
+
+    assert await middleware.consume_scope(ok, processed) == "done"
+    with pytest.raises(ValueError):
+        await middleware.consume_scope(fail, failed)
+    await middleware.consume_scope(ok, core)
+
+    # échec refusé aussitôt, succès en attente du lot, NATS core ignoré
+    assert (processed.committed, failed.committed, core.committed) == (None, "nack", None)
+    await batcher.flush()
+    assert processed.committed == "ack"
+
+
+async def test_jetstream_brick(monkeypatch):
+    """durable pull consumer against a real nats-server"""
+    from nats.server import run
+
+    async with await run(port=0, jetstream=True) as server:
+        monkeypatch.setenv("NATS_URL", f"nats://127.0.0.1:{server.port}")
+        monkeypatch.setenv("ESB_MODE", "jetstream")
+        monkeypatch.setenv("ESB_ACK_BATCH", "20")
+        ctx, broker, _ = init_esb_app("demo")
+        received = []
+
+        @ctx.subscriber(ctx.subject_in)
+        async def handler(message: str):
+            received.append(message)
+
+        publisher = ctx.publisher(ctx.subject_in)
+        await declare_stream(broker, ctx.jetstream)
+        async with broker:
+            for i in range(100):
+                await publisher.publish(f"m{i}")
+            for _ in range(50):
+                if len(received) == 100:
+                    break
+                await asyncio.sleep(0.1)
+            await ctx.acks.flush()
+
+        assert sorted(received) == sorted(f"m{i}" for i in range(100))
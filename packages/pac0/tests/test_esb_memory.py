@@ -0,0 +1,340 @@
+# SPDX-FileCopyrightText: 2026 Philippe ENTZMANN <philippe@entzmann.name>
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import importlib
+
+import pytest
+from faststream.nats import NatsMessage
+from nats.js.errors import KeyNotFoundError, NoKeysError
+
+from pac0.service.api_gateway.lib.invoices import publish_invoice
+from pac0.service.routage import lib
+from pac0.service.routage.decisions import DEFAULT_BUCKET
+from pac0.service.routage.models import InvoiceMessage, RoutingResult, RoutingStatus
+from pac0.service.routage.peppol import PeppolLookupResult
+from pac0.shared import esb
+from pac0.shared.esb import (
+    LocalBroker,
+    LocalEntry,
+    LocalKeyValue,
+    RoutingHeaders,
+    SettingsService,
+    init_esb_app,
+    publish_envelope,
+    routing_headers,
+    sharded_subject,
+    subject_matches,
+)
+
+
+def test_subject_matches():
+    assert subject_matches("routage-IN", "routage-IN")
+    assert subject_matches("routage-IN.*", "routage-IN.3")
+    assert subject_matches("*", "healthcheck")
+    assert subject_matches("routage-IN.>", "routage-IN.3.x")
+    assert not subject_matches("*", "routage-IN.3")
+    assert not subject_matches("routage-IN.>", "routage-IN")
+    assert not subject_matches("routage-IN", "routage-IN.3")
+
+
+async def test_queue_groups():
+    broker = LocalBroker()
+    received = []
+
+    for name in ("a", "b"):
+
+        @broker.subscriber("demo-IN", "q")
+        async def member(message: str, name=name):
+            received.append(name)
+
+    @broker.subscriber("demo-IN")
+    async def observer(message: str):
+        received.append("observer")
+
+    for _ in range(4):
+        await broker.publish("m", "demo-IN")
+    await broker.join()
+
+    # un membre du groupe par message, l'observateur reçoit tout
+    assert sorted(received) == ["a", "a", "b", "b"] + ["observer"] * 4
+
+
+async def test_objects_passed_as_is():
+    broker = LocalBroker()
+    body = {"invoice_id": "INV-1", "payload": b"<Invoice/>"}
+    received = []
+
+    @broker.subscriber("demo-OUT")
+    async def handler(message: NatsMessage):
+        received.append((message.body, routing_headers(message), message.correlation_id))
+
+    await publish_envelope(
+        broker.publisher("demo-OUT"),
+        body,
+        RoutingHeaders(invoice_id="INV-1"),
+        correlation_id="c-1",
+    )
+    await broker.join()
+
+    [(got, routing, correlation_id)] = received
+    # ni sérialisé ni copié
+    assert got is body
+    assert routing.invoice_id == "INV-1"
+    assert correlation_id == "c-1"
+
+
+async def test_handler_error_does_not_stop_the_bus():
+    broker = LocalBroker()
+    received = []
+
+    @broker.subscriber("demo-IN")
+    async def handler(message: int):
+        if message == 1:
+            raise ValueError("boom")
+        received.append(message)
+
+    await broker.publish(1, "demo-IN")
+    await broker.publish(2, "demo-IN")
+    await broker.join()
+    assert received == [2]
+    assert [str(e) for e in broker.errors] == ["boom"]
+
+
+async def test_handler_error_nacks_and_can_be_raised(caplog):
+    broker = LocalBroker()
+    received = []
+
+    @broker.subscriber("demo-IN")
+    async def failing(message: NatsMessage):
+        received.append(message)
+        raise ValueError("boom")
+
+    await broker.publish(1, "demo-IN")
+    with pytest.raises(ValueError, match="boom"):
+        await broker.join(raise_errors=True)
+
+    [message] = received
+    assert message.committed == "nack"
+    assert "demo-IN" in caplog.text and "failing" in caplog.text
+    # erreur remontée une seule fois
+    await broker.join(raise_errors=True)
+
+
+def test_init_memory_mode():
+    ctx, broker, app = init_esb_app("demo", SettingsService(_env_file=None, mode="memory"))
+    assert isinstance(broker, LocalBroker)
+    assert ctx.publisher_out.local
+    assert esb.services["demo"] is ctx
+
+
+async def test_healthcheck_per_brick(monkeypatch):
+    """each in-memory brick answers the healthcheck from its own state"""
+    broker = LocalBroker()
+    monkeypatch.setattr(esb, "get_local_broker", lambda: broker)
+    settings = SettingsService(_env_file=None, mode="memory")
+    ctx_a, _, _ = init_esb_app("brick-a", settings)
+    ctx_b, _, _ = init_esb_app("brick-b", settings)
+    assert esb.services["brick-a"] is ctx_a
+    assert esb.services["brick-b"] is ctx_b
+    answers = []
+
+    @broker.subscriber("healthcheck_resp")
+    async def response(message: str):
+        answers.append(message)
+
+    await broker.publish("ping", "healthcheck")
+    await broker.join(raise_errors=True)
+    assert answers == ["I am alive !"] * 2
+
+    # arrêt d'une seule brique: l'autre répond toujours
+    ctx_a.ready = False
+    answers.clear()
+    await broker.publish("ping", "healthcheck")
+    await broker.join(raise_errors=True)
+    assert answers == ["I am alive !"]
+
+
+async def test_monolith_pipeline(monkeypatch):
+    """all bricks in one process: api-gateway-OUT to transmission-fiscale-OUT"""
+    monkeypatch.setenv("ESB_MODE", "memory")
+    monolith = importlib.import_module("pac0.service.monolith.main")
+    monkeypatch.setattr(monolith.bricks["annuaire-local"], "LOCAL_SIRENS", {"123456789"})
+    bus = monolith.bus
+    invoice = {"invoice_id": "INV-1", "recipient_siren": "123456789"}
+    done = []
+
+    @bus.subscriber("transmission-fiscale-OUT")
+    async def transmitted(message: NatsMessage):
+        done.append(message)
+
+    async with monolith.app.router.lifespan_context(monolith.app):
+        await publish_envelope(
+            bus.publisher("api-gateway-OUT"),
+            invoice,
+            RoutingHeaders(invoice_id="INV-1", recipient_siren="123456789"),
+            correlation_id="c-1",
+        )
+        await bus.join(raise_errors=True)
+
+    [message] = done
+    assert message.body is invoice
+    assert message.correlation_id == "c-1"
+    assert routing_headers(message).stage == "transmission-fiscale-IN"
+
+
+async def test_non_local_recipient_routed_to_shard(monkeypatch):
+    """annuaire-local flags the recipient, gestion_cycle_vie sends non-local ones to routage"""
+    monkeypatch.setenv("ESB_MODE", "memory")
+    monolith = importlib.import_module("pac0.service.monolith.main")
+    monkeypatch.setattr(monolith.bricks["annuaire-local"], "LOCAL_SIRENS", {"123456789"})
+    monkeypatch.setattr(monolith.bricks["gestion_cycle_vie"], "ROUTAGE_SHARDS", 4)
+    bus = monolith.bus
+    routed, transmitted = [], []
+
+    @bus.subscriber("routage-IN.*")
+    async def routage(message: NatsMessage):
+        routed.append(message)
+
+    @bus.subscriber("transmission-fiscale-IN")
+    async def transmission(message: NatsMessage):
+        transmitted.append(message)
+
+    # directement en entrée de l'annuaire local, sans démarrer les briques
+    publisher = bus.publisher("annuaire-local-IN")
+    for invoice_id, recipient in (("INV-1", "123456789"), ("INV-2", "987654321")):
+        await publish_envelope(
+            publisher,
+            {"invoice_id": invoice_id, "recipient_siren": recipient},
+            RoutingHeaders(invoice_id=invoice_id, recipient_siren=recipient),
+        )
+    await bus.join(raise_errors=True)
+
+    [local] = transmitted
+    assert routing_headers(local).invoice_id == "INV-1"
+    assert routing_headers(local).local_recipient is True
+    [remote] = routed
+    assert remote.subject == sharded_subject("routage-IN", "987654321", 4)
+    assert routing_headers(remote).local_recipient is False
+    assert routing_headers(remote).stage == "routage-IN"
+
+
+async def test_recipient_headers_required(monkeypatch):
+    """annuaire-local fills the recipient headers, gestion_cycle_vie has no default"""
+    monkeypatch.setenv("ESB_MODE", "memory")
+    monolith = importlib.import_module("pac0.service.monolith.main")
+    monkeypatch.setattr(monolith.bricks["annuaire-local"], "LOCAL_SIRENS", {"555555555"})
+    bus = monolith.bus
+    out = []
+
+    @bus.subscriber("annuaire-local-OUT")
+    async def annuaire(message: NatsMessage):
+        out.append(message)
+
+    # destinataire lu dans le corps quand l'en-tête manque
+    await bus.publish({"invoice_id": "INV-3", "recipient_siren": "555555555"}, "annuaire-local-IN")
+    await bus.join(raise_errors=True)
+    [message] = out
+    assert routing_headers(message).recipient_siren == "555555555"
+    assert routing_headers(message).local_recipient is True
+
+    # ni en-tête ni corps: refusé plutôt que considéré local
+    await bus.publish({"invoice_id": "INV-4"}, "annuaire-local-IN")
+    with pytest.raises(ValueError):
+        await bus.join(raise_errors=True)
+    await bus.publish({"invoice_id": "INV-4"}, "annuaire-local-OUT")
+    with pytest.raises(ValueError):
+        await bus.join(raise_errors=True)
+
+
+class NotOnPeppol:
+    """PEPPOL lookup service stand-in: no recipient is registered"""
+
+    def __init__(self):
+        self.calls = 0
+
+    async def start(self): ...
+
+    async def close(self): ...
+
+    async def lookup_by_siren(self, siren, document_type="invoice_ubl"):
+        self.calls += 1
+        return PeppolLookupResult(success=False, error_code="PARTICIPANT_NOT_FOUND")
+
+    def is_cached(self, scheme, identifier, document_type="invoice_ubl"):
+        return False
+
+    def cached_smp_host(self, scheme, identifier):
+        return None
+
+    async def forget(self, scheme, identifier): ...
+
+
+async def test_monolith_routage(monkeypatch):
+    """a non-local invoice goes through routage, its decision kept in an in-memory bucket"""
+    monkeypatch.setenv("ESB_MODE", "memory")
+    monkeypatch.setenv("ROUTAGE_DECISIONS", "nats")
+    monolith = importlib.import_module("pac0.service.monolith.main")
+    monkeypatch.setattr(monolith.bricks["annuaire-local"], "LOCAL_SIRENS", set())
+    lookup = NotOnPeppol()
+    lib.set_peppol_service(lookup)
+    lib.set_decision_cache(None)
+    bus = monolith.bus
+    results, transmitted = [], []
+
+    @bus.subscriber("routage-OUT")
+    async def routed(result: RoutingResult):
+        results.append(result)
+
+    @bus.subscriber("transmission-fiscale-OUT")
+    async def transmission(message: NatsMessage):
+        transmitted.append(message)
+
+    try:
+        async with monolith.app.router.lifespan_context(monolith.app):
+            for invoice_id in ("INV-5", "INV-6"):
+                invoice = InvoiceMessage(
+                    invoice_id=invoice_id,
+                    sender_siren="111111111",
+                    recipient_siren="222222222",
+                    payload=b"<Invoice/>",
+                )
+                await publish_invoice(bus.publisher("api-gateway-OUT"), invoice)
+                await bus.join(raise_errors=True)
+                await monolith.bricks["routage"].worker.join()
+                await bus.join(raise_errors=True)
+    finally:
+        lib.set_decision_cache(None)
+        lib.set_peppol_service(None)
+
+    assert [r.status for r in results] == [RoutingStatus.ROUTED_TO_PPF] * 2
+    assert len(transmitted) == 2
+    # seconde facture: décision lue dans le bucket, sans nouveau lookup
+    assert lookup.calls == 1
+    assert await bus.buckets[DEFAULT_BUCKET].keys()
+
+
+async def test_local_key_value():
+    """in-memory buckets: same errors, expiry and watch as NATS KV"""
+    now = [0.0]
+    kv = LocalKeyValue("demo", ttl=10, clock=lambda: now[0])
+    with pytest.raises(KeyNotFoundError):
+        await kv.get("a.1")
+    with pytest.raises(NoKeysError):
+        await kv.keys()
+    await kv.put("a.1", b"x")
+    watcher = await kv.watchall(meta_only=True)
+    await kv.put("b.1", b"y")
+    await kv.delete("a.1")
+
+    assert [await anext(watcher) for _ in range(4)] == [
+        LocalEntry("a.1", b"x", 1),
+        None,
+        LocalEntry("b.1", b"y", 2),
+        LocalEntry("a.1", None, 3, "DEL"),
+    ]
+    await watcher.stop()
+    assert await kv.keys(filters=["b.>"]) == ["b.1"]
+    now[0] = 10
+    with pytest.raises(KeyNotFoundError):
+        await kv.get("b.1")
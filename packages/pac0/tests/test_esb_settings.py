@@ -0,0 +1,53 @@
+# SPDX-FileCopyrightText: 2026 Philippe ENTZMANN <philippe@entzmann.name>
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from nats.errors import SlowConsumerError
+
+from pac0.shared.esb import SettingsService, SlowConsumerLogger, init_esb_app
+
+
+def test_defaults():
+    settings = SettingsService(_env_file=None)
+    assert settings.max_workers == 1
+    assert settings.mode == "core"
+    assert settings.subscriber_options() == {}
+
+
+def test_brick_overrides(monkeypatch, tmp_path):
+    env = tmp_path / ".env"
+    env.write_text("ESB_MAX_WORKERS=4\nESB_PENDING_MSGS_LIMIT=1000\n")
+    # une brique I/O (routage) plus concurrente qu'une brique CPU
+    monkeypatch.setenv("ROUTAGE_ESB_MAX_WORKERS", "64")
+
+    routage = SettingsService.for_brick("routage", env_file=env)
+    controle = SettingsService.for_brick("controle-formats", env_file=env)
+
+    assert routage.max_workers == 64
+    assert controle.max_workers == 4
+    assert routage.pending_msgs_limit == controle.pending_msgs_limit == 1000
+
+
+def test_applied_to_subscribers_and_broker():
+    settings = SettingsService(
+        _env_file=None, max_workers=8, pending_msgs_limit=500, publish_flush_timeout=0.5
+    )
+    ctx, broker, _ = init_esb_app("demo", settings)
+
+    @ctx.subscriber(ctx.subject_in)
+    async def handler(message): ...
+
+    [subscriber] = [s for s in broker.subscribers if s._subject == "demo-IN"]
+    assert subscriber.max_workers == 8
+    assert subscriber.extra_options["pending_msgs_limit"] == 500
+    assert broker._connection_kwargs["flush_timeout"] == 0.5
+
+
+async def test_slow_consumer_logger(caplog):
+    log = SlowConsumerLogger(interval=60)
+    for _ in range(3):
+        await log(SlowConsumerError("routage-IN", reply="", sid=1, sub=None))
+
+    assert log.dropped == {"routage-IN": 3}
+    # une seule alerte par intervalle
+    assert len([r for r in caplog.records if "Slow consumer" in r.message]) == 1
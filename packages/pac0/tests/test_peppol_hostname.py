@@ -0,0 +1,55 @@
+# SPDX-FileCopyrightText: 2026 Philippe ENTZMANN <philippe@entzmann.name>
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import base64
+import hashlib
+
+from pac0.shared.peppol import (
+    SmlHashScheme,
+    compute_participant_hash_sha256,
+    compute_sml_hostname,
+    compute_sml_hostnames,
+)
+
+ZONE = "acc.edelivery.tech.ec.europa.eu"
+
+
+def test_sml_hostname_md5():
+    """legacy form, as in docs/briques/07-routage/peppol.feature"""
+    assert (
+        compute_sml_hostname(ZONE, "SIREN", "222222222")
+        == f"B-3ddb2999105b666703fc700e14885016.iso6523-actorid-upis.{ZONE}"
+    )
+
+
+def test_sml_hostname_sha256():
+    digest = hashlib.sha256(b"0009:123456789").digest()
+    expected = base64.b32encode(digest).decode().rstrip("=")
+
+    assert compute_participant_hash_sha256("0009", "123456789") == expected
+    assert len(expected) == 52
+    assert (
+        compute_sml_hostname(ZONE, "0009", "123456789", SmlHashScheme.SHA256)
+        == f"{expected}.iso6523-actorid-upis.{ZONE}"
+    )
+    # case insensitive identifiers
+    assert compute_participant_hash_sha256("0009", "ABC") == (
+        compute_participant_hash_sha256("0009", "abc")
+    )
+
+
+def test_sml_hostname_memoized():
+    compute_sml_hostname.cache_clear()
+    compute_sml_hostname(ZONE, "0009", "123456789")
+    compute_sml_hostname(ZONE, "0009", "123456789")
+    assert compute_sml_hostname.cache_info().hits == 1
+
+
+def test_sml_hostnames_batch():
+    """the batch function matches the per-participant one"""
+    ids = [f"{i:09d}" for i in range(500)] + ["AbC"]
+    for hash_scheme in SmlHashScheme:
+        assert compute_sml_hostnames(ZONE, "0009", ids, hash_scheme) == [
+            compute_sml_hostname(ZONE, "0009", pid, hash_scheme) for pid in ids
+        ]
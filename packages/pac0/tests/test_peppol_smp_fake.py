@@ -0,0 +1,84 @@
+# SPDX-FileCopyrightText: 2026 Philippe ENTZMANN <philippe@entzmann.name>
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import httpx
+
+from pac0.service.peppol_smp_fake.main import (
+    FaultConfig,
+    SmpRegistry,
+    create_app,
+    write_registry,
+)
+from pac0.service.routage.peppol import PEPPOL_DOCUMENT_TYPES, PeppolLookupService
+from pac0.shared.peppol import PeppolEnvironment
+
+SMP_URL = "http://smp.test"
+
+
+def lookup_service(app) -> PeppolLookupService:
+    """lookup service whose SMP requests reach the stand-in in process"""
+    service = PeppolLookupService(
+        environment=PeppolEnvironment.TEST,
+        dns_resolver=lambda hostname: SMP_URL,
+    )
+    service._client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app))
+    return service
+
+
+def test_registry_load(tmp_path):
+    path = tmp_path / "registry.csv"
+    participants = [("0009", f"{i:09d}") for i in range(1000)]
+    assert write_registry(path, participants, ["invoice_ubl"]) == 1000
+    with open(path, "a") as f:
+        f.write("0002,12345678900012,,https://other-ap.example.com/as4\n")
+
+    registry = SmpRegistry()
+    assert registry.load(path) == 1001
+    doc_types, endpoint = registry.get("iso6523-actorid-upis::0009::000000042")
+    assert doc_types == {PEPPOL_DOCUMENT_TYPES["invoice_ubl"]}
+    # document type sets are shared between participants
+    assert registry.get("iso6523-actorid-upis::0009:000000043")[0] is doc_types
+    assert registry.get("iso6523-actorid-upis::0002::12345678900012") == (
+        frozenset(PEPPOL_DOCUMENT_TYPES.values()),
+        "https://other-ap.example.com/as4",
+    )
+    assert registry.get("iso6523-actorid-upis::0009::999999999") is None
+
+
+async def test_lookup_against_stand_in():
+    """ServiceGroup + ServiceMetadata served as real XML"""
+    registry = SmpRegistry()
+    registry.add("0009", "123456789", ["invoice_ubl", "credit_note"])
+    app = create_app(registry)
+
+    async with lookup_service(app) as service:
+        ubl = await service.lookup_by_siren("123456789", "invoice_ubl")
+        cii = await service.lookup_by_siren("123456789", "invoice_cii")
+        unknown = await service.lookup_by_siren("999999999")
+
+    assert ubl.success
+    assert ubl.endpoint.address == "https://ap.example.com/as4"
+    assert cii.error_code == "DOCUMENT_TYPE_NOT_SUPPORTED"
+    assert unknown.error_code == "DOCUMENT_TYPE_NOT_SUPPORTED"
+    # 1 ServiceGroup + 2 ServiceMetadata for the known participant
+    assert app.state.requests == 3 + 2
+
+
+async def test_fault_injection():
+    registry = SmpRegistry()
+    registry.add("0009", "123456789")
+    app = create_app(registry, FaultConfig(unavailable_rate=1.0), seed=1)
+
+    async with lookup_service(app) as service:
+        result = await service.lookup_by_siren("123456789")
+        assert result.error_code == "SMP_UNAVAILABLE"
+
+        async with httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=app), base_url=SMP_URL
+        ) as client:
+            response = await client.put("/_admin/faults", json={"error_rate": 1.0})
+            assert response.json()["unavailable_rate"] == 0.0
+
+        result = await service.lookup_by_siren("123456789")
+        assert result.error_code == "SMP_ERROR"
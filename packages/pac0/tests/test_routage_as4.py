@@ -0,0 +1,204 @@
+# SPDX-FileCopyrightText: 2026 Philippe ENTZMANN <philippe@entzmann.name>
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import base64
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import replace
+
+import httpx
+import pytest
+
+from pac0.service.as4_fake.main import create_app, signal_xml
+from pac0.service.routage import lib
+from pac0.service.routage.as4 import (
+    As4Transmitter,
+    build_message,
+    parse_certificate,
+    parse_receipt,
+)
+from pac0.service.routage.models import InvoiceMessage, RoutingStatus
+from pac0.service.routage.peppol import (
+    PEPPOL_DOCUMENT_TYPES,
+    PeppolEndpoint,
+    PeppolLookupResult,
+)
+
+CERTIFICATE = base64.b64encode(b"fake partner certificate").decode()
+
+ENDPOINT = PeppolEndpoint(
+    address="http://ap.example.com/as4",
+    certificate=CERTIFICATE,
+    transport_profile="peppol-transport-as4-v2_0",
+)
+
+
+def invoice(invoice_id: str = "INV-1", recipient: str = "123456789") -> InvoiceMessage:
+    return InvoiceMessage(
+        invoice_id=invoice_id,
+        sender_siren="111111111",
+        recipient_siren=recipient,
+        payload="<Invoice>" + "x" * 1000 + "</Invoice>",
+    )
+
+
+def transmitter(app, **kwargs) -> As4Transmitter:
+    kwargs.setdefault("allow_plaintext", True)
+    return As4Transmitter("POP000001", transport=httpx.ASGITransport(app=app), **kwargs)
+
+
+def test_plaintext_refused_by_default():
+    with pytest.raises(ValueError, match="AS4_SECURITY"):
+        As4Transmitter("POP000001")
+    assert As4Transmitter("POP000001", security=lambda message, certificate: message)
+
+
+async def test_send_to_as4_receiver():
+    """the stand-in accepts the message and answers with a receipt"""
+    app = create_app()
+    async with transmitter(app) as as4:
+        result = await as4.send(invoice(), ENDPOINT)
+
+    assert result.success, result.error_message
+    [received] = app.state.received
+    assert received.message_id == result.message_id
+    assert received.conversation_id == "INV-1"
+    assert received.final_recipient == "0009:123456789"
+    assert received.action == PEPPOL_DOCUMENT_TYPES["invoice_ubl"].partition("::")[2]
+    assert received.payload == invoice().payload
+
+
+async def test_send_rejected_by_receiver():
+    """an ebMS error is a final failure, not retried"""
+    app = create_app()
+    app.state.faults.error_rate = 1.0
+    async with transmitter(app) as as4:
+        result = await as4.send(invoice(), ENDPOINT)
+
+    assert not result.success
+    assert not result.retryable
+    assert "EBMS:0004" in result.error_message
+
+
+async def test_send_http_errors_are_retryable():
+    def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.host == "down.example.com":
+            raise httpx.ConnectError("connection refused")
+        return httpx.Response(int(request.url.path.strip("/")))
+
+    as4 = As4Transmitter(
+        "POP000001", transport=httpx.MockTransport(handler), allow_plaintext=True
+    )
+    results = {}
+    async with as4:
+        for status in (503, 429, 400, 404):
+            endpoint = replace(ENDPOINT, address=f"http://ap.example.com/{status}")
+            results[status] = await as4.send(invoice(), endpoint)
+        down = await as4.send(
+            invoice(), replace(ENDPOINT, address="http://down.example.com/500")
+        )
+
+    assert results[503].error_message == "HTTP 503"
+    # 5xx et 429: transitoire; autres 4xx: refus définitif
+    assert {status: r.retryable for status, r in results.items()} == {
+        503: True,
+        429: True,
+        400: False,
+        404: False,
+    }
+    assert not any(r.success for r in results.values())
+    assert (down.success, down.retryable) == (False, True)
+
+
+async def test_invalid_certificate():
+    async with transmitter(create_app()) as as4:
+        result = await as4.send(invoice(), replace(ENDPOINT, certificate="MIIC..."))
+
+    assert not result.success
+    assert not result.retryable
+    assert "Certificat invalide" in result.error_message
+
+
+async def test_one_pool_per_access_point():
+    """clients are reused per AP origin; the least recently used are closed"""
+    app = create_app()
+    async with transmitter(app, max_access_points=2) as as4:
+        for host in ("ap1", "ap1", "ap2", "ap1"):
+            endpoint = replace(ENDPOINT, address=f"http://{host}.example.com/as4")
+            assert (await as4.send(invoice(), endpoint)).success
+        first = as4._client("http://ap1.example.com/as4")
+        assert as4._client("http://ap1.example.com/other") is first
+        assert list(as4._clients) == ["http://ap2.example.com", "http://ap1.example.com"]
+
+        as4._client("http://ap3.example.com/as4")
+        assert list(as4._clients) == ["http://ap1.example.com", "http://ap3.example.com"]
+    assert as4._clients == {}
+    assert len(app.state.received) == 4
+
+
+async def test_message_prepared_off_the_event_loop():
+    loop_thread = threading.get_ident()
+    threads = []
+
+    def security(message, certificate):
+        threads.append(threading.get_ident())
+        assert certificate == parse_certificate(CERTIFICATE)
+        return message
+
+    async with transmitter(create_app(), security=security) as as4:
+        assert (await as4.send(invoice(), ENDPOINT)).success
+
+    assert threads and threads[0] != loop_thread
+
+
+async def test_process_pool_executor():
+    app = create_app()
+    with ProcessPoolExecutor(1) as executor:
+        async with transmitter(app, executor=executor) as as4:
+            assert (await as4.send(invoice(), ENDPOINT)).success
+    assert len(app.state.received) == 1
+
+
+def test_certificate_parsed_once():
+    parse_certificate.cache_clear()
+    pem = f"-----BEGIN CERTIFICATE-----\n{CERTIFICATE}\n-----END CERTIFICATE-----"
+    first = parse_certificate(CERTIFICATE)
+    assert parse_certificate(CERTIFICATE) is first
+    assert parse_certificate.cache_info().hits == 1
+    assert parse_certificate(pem) == first
+    assert first.der == b"fake partner certificate"
+
+
+def test_receipt_must_reference_message():
+    certificate = parse_certificate(CERTIFICATE)
+    message = build_message(invoice(), "POP000001", "POP000002", certificate)
+    assert parse_receipt(signal_xml(message.message_id).encode(), message.message_id).success
+    other = parse_receipt(signal_xml("other@pac0").encode(), message.message_id)
+    assert not other.success
+    assert not parse_receipt(b"not xml", message.message_id).success
+
+
+async def test_route_invoice_transmits_via_as4():
+    app = create_app()
+
+    class Lookup:
+        async def lookup_by_siren(self, siren, document_type="invoice_ubl"):
+            return PeppolLookupResult(success=True, endpoint=ENDPOINT)
+
+    lib.set_peppol_service(Lookup())
+    lib.set_as4_transmitter(transmitter(app))
+    try:
+        routed = await lib.route_invoice(invoice())
+        app.state.faults.error_rate = 1.0
+        rejected = await lib.route_invoice(invoice("INV-2"))
+    finally:
+        await lib.get_as4_transmitter().close()
+        lib.set_as4_transmitter(None)
+        lib.set_peppol_service(None)
+
+    assert routed.status == RoutingStatus.ROUTED
+    assert routed.destination == ENDPOINT.address
+    assert rejected.status == RoutingStatus.ERROR
+    assert rejected.error_code == "AS4_TRANSMISSION_FAILED"
+    assert [m.conversation_id for m in app.state.received] == ["INV-1"]
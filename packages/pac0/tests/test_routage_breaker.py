@@ -0,0 +1,204 @@
+# SPDX-FileCopyrightText: 2026 Philippe ENTZMANN <philippe@entzmann.name>
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import asyncio
+
+import httpx
+
+from pac0.service.routage import lib
+from pac0.service.routage.breaker import CircuitState, SmpHealthTracker
+from pac0.service.routage.models import InvoiceMessage, RoutingStatus
+from pac0.service.routage.peppol import (
+    PeppolEndpoint,
+    PeppolLookupService,
+    SmpResponseTooLarge,
+)
+from pac0.shared.peppol import PeppolEnvironment
+from routage_helpers import HOST, SMP_URL, FakeClock, no_service_group
+
+
+ENDPOINT = PeppolEndpoint(
+    address="https://ap.example.com/as4",
+    certificate="MIIC...",
+    transport_profile="peppol-transport-as4-v2_0",
+)
+
+
+def test_breaker_opens_and_recovers():
+    """closed -> open after N failures -> half-open single probe -> closed"""
+    clock = FakeClock()
+    tracker = SmpHealthTracker(failure_threshold=3, reset_timeout=10, clock=clock)
+
+    for _ in range(3):
+        assert tracker.allow(HOST)
+        tracker.record_failure(HOST)
+    assert tracker.state(HOST) == CircuitState.OPEN
+    assert not tracker.allow(HOST)
+
+    clock.now += 11
+    assert tracker.allow(HOST)
+    assert tracker.state(HOST) == CircuitState.HALF_OPEN
+    # only one probe at a time
+    assert not tracker.allow(HOST)
+
+    tracker.record_success(HOST, 0.1)
+    assert tracker.state(HOST) == CircuitState.CLOSED
+    assert tracker.allow(HOST)
+
+
+def test_breaker_failed_probe_reopens():
+    clock = FakeClock()
+    tracker = SmpHealthTracker(failure_threshold=1, reset_timeout=10, clock=clock)
+    tracker.record_failure(HOST)
+    clock.now += 11
+    assert tracker.allow(HOST)
+    tracker.record_failure(HOST)
+    assert tracker.state(HOST) == CircuitState.OPEN
+    assert not tracker.allow(HOST)
+
+
+def test_adaptive_timeout():
+    """the timeout follows the host latencies once enough samples exist"""
+    tracker = SmpHealthTracker(
+        latency_window=10, min_samples=10, timeout_factor=3, max_timeout=30
+    )
+    assert tracker.timeout_for(HOST) == 30
+    assert tracker.hedge_delay(HOST) is None
+
+    for _ in range(10):
+        tracker.record_success(HOST, 0.5)
+    assert tracker.timeout_for(HOST) == 1.5
+    assert tracker.hedge_delay(HOST) == 0.5
+
+    for _ in range(10):
+        tracker.record_success(HOST, 0.01)
+    assert tracker.timeout_for(HOST) == tracker.min_timeout
+
+
+def _service(fetch) -> PeppolLookupService:
+    service = PeppolLookupService(
+        environment=PeppolEnvironment.TEST,
+        dns_resolver=lambda hostname: SMP_URL,
+        smp_health=SmpHealthTracker(failure_threshold=2, reset_timeout=60),
+    )
+    service._fetch_smp_metadata = fetch
+    service._fetch_service_group = no_service_group
+    return service
+
+
+async def test_lookup_circuit_open():
+    """failing SMP requests open the breaker, later lookups skip the SMP"""
+    calls = []
+
+    async def fetch(*args):
+        calls.append(args)
+        raise httpx.ConnectError("connection refused")
+
+    service = _service(fetch)
+    # the ServiceGroup request fails too: two failures in one cold lookup
+    service._fetch_service_group = fetch
+    result = await service.lookup_by_siren("123456789")
+    assert result.error_code == "SMP_ERROR"
+
+    result = await service.lookup_by_siren("123456789")
+    assert result.error_code == "SMP_CIRCUIT_OPEN"
+    assert len(calls) == 2
+
+
+async def test_lookup_client_error_does_not_open_circuit():
+    """a 4xx answer proves the SMP is alive"""
+
+    async def fetch(*args):
+        response = httpx.Response(400, request=httpx.Request("GET", SMP_URL))
+        raise httpx.HTTPStatusError("bad request", request=response.request, response=response)
+
+    service = _service(fetch)
+    for _ in range(3):
+        assert (await service.lookup_by_siren("123456789")).error_code == "SMP_ERROR"
+    assert service.smp_health.state(HOST) == CircuitState.CLOSED
+
+
+async def test_lookup_oversized_response_does_not_open_circuit():
+    """an answer over max_smp_response_size is refused, the SMP is not failing"""
+
+    async def service_group(*args):
+        raise SmpResponseTooLarge("too large")
+
+    service = _service(no_service_group)
+    service._fetch_service_group = service_group
+    for participant in ("123456789", "987654321", "111111111"):
+        await service.lookup_by_siren(participant)
+    assert service.smp_health.state(HOST) == CircuitState.CLOSED
+    assert service.smp_health.get(HOST).consecutive_failures == 0
+
+
+async def test_half_open_cold_lookup_sends_one_probe():
+    """a half-open breaker admits the metadata request, not the ServiceGroup too"""
+    calls = []
+
+    async def fetch(*args):
+        calls.append("metadata")
+        # requête de test encore en cours quand le ServiceGroup est demandé
+        await asyncio.sleep(0.01)
+        return ENDPOINT, 60.0
+
+    async def service_group(*args):
+        calls.append("service_group")
+        return None, None
+
+    clock = FakeClock()
+    service = _service(fetch)
+    service._fetch_service_group = service_group
+    service.smp_health = SmpHealthTracker(failure_threshold=1, reset_timeout=10, clock=clock)
+    service.smp_health.record_failure(HOST)
+    clock.now += 11
+
+    result = await service.lookup_by_siren("123456789")
+    assert result.success
+    assert calls == ["metadata"]
+    assert service.smp_health.state(HOST) == CircuitState.CLOSED
+
+
+async def test_lookup_hedged_request():
+    """a request slower than p95 is duplicated; the first answer wins"""
+    calls = []
+
+    async def fetch(*args):
+        calls.append(args)
+        await asyncio.sleep(1.0 if len(calls) == 1 else 0.001)
+        return ENDPOINT, 60.0
+
+    service = _service(fetch)
+    service.hedge_requests = True
+    for _ in range(10):
+        service.smp_health.record_success(HOST, 0.01)
+
+    result = await asyncio.wait_for(service.lookup_by_siren("123456789"), 0.5)
+    assert result.success
+    assert len(calls) == 2
+    assert service.hedged_requests == 1
+
+
+async def test_route_invoice_pending_when_circuit_open():
+    async def fetch(*args):
+        raise AssertionError("the SMP must not be called")
+
+    service = _service(fetch)
+    for _ in range(2):
+        service.smp_health.record_failure(HOST)
+    lib.set_peppol_service(service)
+    try:
+        result = await lib.route_invoice(
+            InvoiceMessage(
+                invoice_id="INV-1",
+                sender_siren="111111111",
+                recipient_siren="123456789",
+                payload="<Invoice/>",
+            )
+        )
+    finally:
+        lib.set_peppol_service(None)
+
+    assert result.status == RoutingStatus.PENDING
+    assert result.error_code == "SMP_CIRCUIT_OPEN"
@@ -0,0 +1,231 @@
+# SPDX-FileCopyrightText: 2026 Philippe ENTZMANN <philippe@entzmann.name>
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import asyncio
+
+from pac0.service.routage.cache import TTLCache
+from pac0.service.routage.peppol import (
+    LookupManyStats,
+    PeppolEndpoint,
+    PeppolLookupService,
+    parse_cache_ttl,
+    participant_key,
+)
+from pac0.shared.peppol import PeppolEnvironment, compute_sml_hostname
+from routage_helpers import SMP_URL, FakeClock, no_service_group
+
+def test_ttl_cache_expiration():
+    """an entry is served until its ttl elapses"""
+    clock = FakeClock()
+    cache = TTLCache(maxsize=10, clock=clock)
+    cache.set("a", 1, ttl=10)
+
+    assert cache.get("a") == 1
+    clock.now += 11
+    assert cache.get("a") is None
+
+    stats = cache.stats()
+    assert (stats.hits, stats.misses, stats.expirations) == (1, 1, 1)
+
+
+def test_ttl_cache_lru_eviction():
+    """the least recently used entry is evicted first"""
+    cache = TTLCache(maxsize=2)
+    cache.set("a", 1, ttl=10)
+    cache.set("b", 2, ttl=10)
+    cache.get("a")
+    cache.set("c", 3, ttl=10)
+
+    assert "a" in cache
+    assert "b" not in cache
+    assert cache.stats().evictions == 1
+
+
+def test_ttl_cache_disabled():
+    """maxsize=0 disables the cache"""
+    cache = TTLCache(maxsize=0)
+    cache.set("a", 1, ttl=10)
+    assert len(cache) == 0
+
+
+def test_parse_cache_ttl():
+    assert parse_cache_ttl({}) is None
+    assert parse_cache_ttl({"cache-control": "public, max-age=600"}) == 600
+    assert parse_cache_ttl({"cache-control": "max-age=600, s-maxage=60"}) == 60
+    assert parse_cache_ttl({"cache-control": "no-store"}) == 0
+    assert (
+        parse_cache_ttl(
+            {
+                "date": "Wed, 21 Oct 2026 07:28:00 GMT",
+                "expires": "Wed, 21 Oct 2026 08:28:00 GMT",
+            }
+        )
+        == 3600
+    )
+    assert parse_cache_ttl({"expires": "0"}) == 0
+
+
+def _service(dns: dict[str, str | None]) -> tuple[PeppolLookupService, list]:
+    """service with a fake DNS and a fake SMP counting its calls"""
+    calls = []
+
+    def resolver(hostname: str):
+        calls.append(("dns", hostname))
+        return dns.get("smp_url")
+
+    service = PeppolLookupService(
+        environment=PeppolEnvironment.TEST,
+        dns_resolver=resolver,
+    )
+
+    async def fetch(smp_url, scheme_id, participant_id, document_type_id):
+        calls.append(("smp", participant_id, document_type_id))
+        endpoint = PeppolEndpoint(
+            address="https://ap.example.com/as4",
+            certificate="MIIC...",
+            transport_profile="peppol-transport-as4-v2_0",
+        )
+        return endpoint, 60.0
+
+    service._fetch_smp_metadata = fetch
+    service._fetch_service_group = no_service_group
+    return service, calls
+
+
+async def test_lookup_cache_hit():
+    """a second lookup of the same participant is served from the cache"""
+    service, calls = _service({"smp_url": SMP_URL})
+
+    first = await service.lookup_by_siren("123456789")
+    second = await service.lookup_by_siren("123456789")
+
+    assert first.success and second.success
+    assert second is first
+    assert [c[0] for c in calls] == ["dns", "smp"]
+    assert service.cache_stats()["lookup"].hits == 1
+
+
+async def test_lookup_cache_shares_smp_url_across_document_types():
+    """the SML resolution is reused for another document type"""
+    service, calls = _service({"smp_url": SMP_URL})
+
+    await service.lookup_by_siren("123456789", document_type="invoice_ubl")
+    await service.lookup_by_siren("123456789", document_type="credit_note")
+
+    assert [c[0] for c in calls] == ["dns", "smp", "smp"]
+    assert service.cache_stats()["smp_url"].hits == 1
+
+
+async def test_lookup_negative_cache():
+    """PARTICIPANT_NOT_FOUND is cached for negative_cache_ttl"""
+    service, calls = _service({"smp_url": None})
+
+    first = await service.lookup_by_siren("999999999")
+    second = await service.lookup_by_siren("999999999")
+
+    assert first.error_code == "PARTICIPANT_NOT_FOUND"
+    assert second.error_code == "PARTICIPANT_NOT_FOUND"
+    assert calls == [("dns", calls[0][1])]
+
+    await service.clear_cache()
+    await service.lookup_by_siren("999999999")
+    assert len(calls) == 2
+
+
+async def test_lookup_single_flight():
+    """concurrent lookups of the same participant share one SML+SMP lookup"""
+    service, calls = _service({"smp_url": SMP_URL})
+    service._lookup_cache = TTLCache(maxsize=0)
+    service._smp_url_cache = TTLCache(maxsize=0)
+    fetch = service._fetch_smp_metadata
+
+    async def slow_fetch(*args):
+        await asyncio.sleep(0.05)
+        return await fetch(*args)
+
+    service._fetch_smp_metadata = slow_fetch
+
+    results = await asyncio.gather(
+        *[service.lookup_by_siren("123456789") for _ in range(20)],
+        service.lookup_by_siren("123456789", document_type="credit_note"),
+    )
+
+    assert all(r.success for r in results)
+    assert [c[0] for c in calls].count("smp") == 2
+    assert service.coalesced_lookups == 19
+    assert service._inflight == {}
+
+
+async def test_lookup_single_flight_cancel():
+    """cancelling one waiter does not cancel the shared lookup"""
+    service, calls = _service({"smp_url": SMP_URL})
+    fetch = service._fetch_smp_metadata
+
+    async def slow_fetch(*args):
+        await asyncio.sleep(0.05)
+        return await fetch(*args)
+
+    service._fetch_smp_metadata = slow_fetch
+
+    first = asyncio.create_task(service.lookup_by_siren("123456789"))
+    second = asyncio.create_task(service.lookup_by_siren("123456789"))
+    await asyncio.sleep(0.01)
+    first.cancel()
+
+    assert (await second).success
+    assert first.cancelled()
+
+
+async def test_lookup_many():
+    """bulk lookups stream one result per participant with stats"""
+    service, calls = _service({"smp_url": SMP_URL})
+    stats = LookupManyStats()
+    participants = [f"{i:09d}" for i in range(100)] + [("0002", "12345678900012")]
+
+    results = [
+        item
+        async for item in service.lookup_many(participants, concurrency=8, stats=stats)
+    ]
+
+    assert len(results) == 101
+    assert {key for key, _ in results} == {participant_key(p) for p in participants}
+    assert all(result.success for _, result in results)
+    assert stats.total == 101 and stats.success == 101 and stats.errors == {}
+    assert stats.throughput > 0
+
+
+async def test_lookup_many_per_smp_fairness():
+    """a slow SMP never holds more than per_smp_concurrency slots"""
+    service, calls = _service({"smp_url": SMP_URL})
+    fast_smp = "https://fast-smp.example.com"
+    service._dns_resolver = lambda hostname: (
+        SMP_URL if hostname in slow_hostnames else fast_smp
+    )
+    slow = [f"1{i:08d}" for i in range(20)]
+    fast = [f"2{i:08d}" for i in range(20)]
+    slow_hostnames = {
+        compute_sml_hostname(service.sml_zone, "0009", siren) for siren in slow
+    }
+    in_flight = {SMP_URL: 0, fast_smp: 0}
+    max_in_flight = {SMP_URL: 0, fast_smp: 0}
+
+    async def fetch(smp_url, scheme_id, participant_id, document_type_id):
+        in_flight[smp_url] += 1
+        max_in_flight[smp_url] = max(max_in_flight[smp_url], in_flight[smp_url])
+        await asyncio.sleep(0.05 if smp_url == SMP_URL else 0.001)
+        in_flight[smp_url] -= 1
+        return None, None
+
+    service._fetch_smp_metadata = fetch
+
+    order = []
+    async for (_, participant_id), result in service.lookup_many(
+        slow + fast, concurrency=8, per_smp_concurrency=2
+    ):
+        assert result.error_code == "DOCUMENT_TYPE_NOT_SUPPORTED"
+        order.append(participant_id)
+
+    assert max_in_flight[SMP_URL] == 2
+    # the fast SMP is not stuck behind the slow one
+    assert set(order[:20]) == set(fast)
@@ -0,0 +1,251 @@
+# SPDX-FileCopyrightText: 2026 Philippe ENTZMANN <philippe@entzmann.name>
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import asyncio
+import fnmatch
+from dataclasses import dataclass
+from typing import Optional
+
+from nats.js.errors import KeyNotFoundError, NoKeysError
+
+from pac0.service.routage import lib
+from pac0.service.routage.decisions import (
+    RoutingDecisionCache,
+    decision_key,
+    key_recipient,
+)
+from pac0.service.routage.models import InvoiceMessage, RoutingStatus
+from pac0.service.routage.peppol import (
+    PEPPOL_DOCUMENT_TYPES,
+    PeppolEndpoint,
+    PeppolLookupResult,
+    PeppolLookupService,
+)
+
+ENDPOINT = PeppolEndpoint(
+    address="https://ap.example.com/as4",
+    certificate="cert",
+    transport_profile="peppol-transport-as4-v2_0",
+)
+FOUND = PeppolLookupResult(success=True, endpoint=ENDPOINT, smp_url="http://smp")
+NOT_FOUND = PeppolLookupResult(success=False, error_code="PARTICIPANT_NOT_FOUND")
+TIMEOUT = PeppolLookupResult(success=False, error_code="SMP_TIMEOUT")
+
+
+@dataclass
+class Entry:
+    key: str
+    value: Optional[bytes]
+    operation: Optional[str] = None
+
+
+class Watcher:
+    def __init__(self):
+        self.queue = asyncio.Queue()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        entry = await self.queue.get()
+        if entry is StopAsyncIteration:
+            raise StopAsyncIteration
+        return entry
+
+    async def stop(self):
+        self.queue.put_nowait(StopAsyncIteration)
+
+
+class KeyValue:
+    """In-memory bucket with the subset of the nats-py KeyValue API in use"""
+
+    def __init__(self):
+        self.data = {}
+        self.watchers = []
+
+    def _publish(self, entry):
+        for watcher in self.watchers:
+            watcher.queue.put_nowait(entry)
+
+    async def get(self, key):
+        if key not in self.data:
+            raise KeyNotFoundError
+        return Entry(key, self.data[key])
+
+    async def put(self, key, value):
+        self.data[key] = value
+        self._publish(Entry(key, value))
+
+    async def delete(self, key):
+        self.data.pop(key, None)
+        self._publish(Entry(key, None, "DEL"))
+
+    async def keys(self, filters):
+        pattern = filters[0].replace(">", "*")
+        keys = [key for key in self.data if fnmatch.fnmatch(key, pattern)]
+        if not keys:
+            raise NoKeysError
+        return keys
+
+    async def watchall(self, **kwargs):
+        watcher = Watcher()
+        self.watchers.append(watcher)
+        watcher.queue.put_nowait(None)
+        return watcher
+
+
+class Broker:
+    def __init__(self):
+        self.kv = KeyValue()
+
+    async def key_value(self, bucket, **kwargs):
+        return self.kv
+
+
+class Lookup:
+    def __init__(self, result):
+        self.result = result
+        self.calls = 0
+        self.forgotten = []
+
+    async def lookup_by_siren(self, siren, document_type="invoice_ubl"):
+        self.calls += 1
+        return self.result
+
+    lookup_by_siret = lookup_by_siren
+
+    def is_cached(self, scheme_id, participant_id, document_type="invoice_ubl"):
+        return False
+
+    async def forget(self, scheme_id, participant_id):
+        self.forgotten.append(participant_id)
+
+
+def invoice(siren="123456789", siret=None) -> InvoiceMessage:
+    return InvoiceMessage(
+        invoice_id="INV-1",
+        sender_siren="111111111",
+        recipient_siren=siren,
+        recipient_siret=siret,
+        payload="<Invoice/>",
+    )
+
+
+def test_keys():
+    key = decision_key("12345678900011", "urn:oasis:names::Invoice##UBL-2.1")
+    assert key.startswith("123456789.00011.")
+    assert key_recipient(key) == "12345678900011"
+    assert key_recipient(decision_key("123456789", "invoice_ubl")) == "123456789"
+
+
+async def test_shared_between_replicas():
+    broker = Broker()
+    a, b = RoutingDecisionCache(broker), RoutingDecisionCache(broker)
+
+    await a.put("123456789", "invoice_ubl", FOUND)
+    await a.put("987654321", "invoice_ubl", NOT_FOUND)
+    # erreur transitoire: pas une décision
+    await a.put("111111111", "invoice_ubl", TIMEOUT)
+
+    assert await b.get("123456789", "invoice_ubl") == FOUND
+    assert (await b.get("987654321", "invoice_ubl")).error_code == "PARTICIPANT_NOT_FOUND"
+    assert await b.get("111111111", "invoice_ubl") is None
+    assert b.stats.shared_hits == 2
+
+    # lecture suivante servie par la couche locale
+    await b.get("123456789", "invoice_ubl")
+    assert b.stats.local_hits == 1
+
+
+async def test_expired_decision():
+    now = [1000.0]
+    broker = Broker()
+    a = RoutingDecisionCache(broker, ppf_ttl=60, clock=lambda: now[0])
+    b = RoutingDecisionCache(broker, ppf_ttl=60, clock=lambda: now[0])
+    await a.put("987654321", "invoice_ubl", NOT_FOUND)
+    now[0] += 61
+    assert await b.get("987654321", "invoice_ubl") is None
+
+
+async def test_invalidation_reaches_other_replicas():
+    broker = Broker()
+    forgotten = []
+
+    async def forget(recipient):
+        forgotten.append(recipient)
+
+    a = RoutingDecisionCache(broker)
+    b = RoutingDecisionCache(broker, on_invalidate=forget)
+    await b.start()
+    try:
+        await a.put("12345678900011", "invoice_ubl", FOUND)
+        await a.put("123456789", "invoice_ubl", FOUND)
+        await a.put("999999999", "invoice_ubl", FOUND)
+        for recipient in ("12345678900011", "123456789", "999999999"):
+            assert await b.get(recipient, "invoice_ubl") == FOUND
+
+        # un SIREN couvre ses SIRET
+        assert await a.invalidate("123456789") == 2
+        await asyncio.sleep(0)
+
+        assert await b.get("12345678900011", "invoice_ubl") is None
+        assert await b.get("123456789", "invoice_ubl") is None
+        assert await b.get("999999999", "invoice_ubl") == FOUND
+        assert sorted(forgotten) == ["123456789", "12345678900011"]
+    finally:
+        await b.close()
+
+
+async def test_route_invoice_uses_decisions():
+    lookup = Lookup(NOT_FOUND)
+    lib.set_peppol_service(lookup)
+    lib.set_decision_cache(RoutingDecisionCache(Broker()))
+    try:
+        first = await lib.route_invoice(invoice())
+        second = await lib.route_invoice(invoice())
+        assert first.status == second.status == RoutingStatus.ROUTED_TO_PPF
+        assert lookup.calls == 1
+
+        # l'annuaire local signale un changement
+        await lib.invalidate_decisions({"recipient": "123456789"})
+        assert lookup.forgotten == ["123456789"]
+        await lib.route_invoice(invoice())
+        assert lookup.calls == 2
+    finally:
+        lib.set_decision_cache(None)
+        lib.set_peppol_service(None)
+
+
+async def test_route_invoice_prefers_local_lookup_cache():
+    """a lookup cached by this replica is used without reading the shared bucket"""
+    service = PeppolLookupService(cache_ttl=60)
+    doc_type_id = PEPPOL_DOCUMENT_TYPES["invoice_ubl"]
+    service._store_result(("0009", "123456789", doc_type_id), NOT_FOUND, 60)
+    service.set_mock_smp_response("0009", "999999999", None, error_code="PARTICIPANT_NOT_FOUND")
+    decisions = RoutingDecisionCache(Broker())
+    lib.set_peppol_service(service)
+    lib.set_decision_cache(decisions)
+    try:
+        result = await lib.route_invoice(invoice())
+        assert result.status == RoutingStatus.ROUTED_TO_PPF
+        assert decisions.stats.local_hits == decisions.stats.shared_hits == 0
+        assert decisions.stats.misses == 0
+
+        # absent du cache de lookup: la décision partagée est consultée
+        await lib.route_invoice(invoice("999999999"))
+        assert decisions.stats.misses == 1
+    finally:
+        lib.set_decision_cache(None)
+        lib.set_peppol_service(None)
+
+
+async def test_forget_participant():
+    service = PeppolLookupService(cache_ttl=60)
+    service._store_result(("0009", "123456789", "doc-a"), FOUND, 60)
+    service._store_result(("0009", "123456789", "doc-b"), FOUND, 60)
+    service._store_result(("0009", "999999999", "doc-a"), FOUND, 60)
+
+    await service.forget("0009", "123456789")
+
+    assert service.cache_stats()["lookup"].size == 1
@@ -0,0 +1,362 @@
+# SPDX-FileCopyrightText: 2026 Philippe ENTZMANN <philippe@entzmann.name>
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import asyncio
+import socket
+import threading
+from contextlib import closing
+from urllib.parse import quote, unquote
+
+import httpx
+import pytest
+
+from pac0.service.peppol_dns_fake.main import (
+    QCLASS_IN,
+    QTYPE_NAPTR,
+    DNSResourceRecord,
+    DNSServer,
+)
+from pac0.service.routage.cache import TTLCache
+from pac0.service.routage.peppol import (
+    PEPPOL_DOCUMENT_TYPES,
+    PeppolLookupService,
+    SmpEndpointParser,
+    SmpResponseTooLarge,
+    parse_service_group,
+    parse_smp_endpoint,
+    smp_url_from_naptr,
+)
+from pac0.shared.peppol import (
+    PeppolEnvironment,
+    SmlHashScheme,
+    compute_sml_hostname,
+)
+from routage_helpers import SMP_URL
+
+SMP_RESPONSE = """<?xml version="1.0" encoding="UTF-8"?>
+<SignedServiceMetadata xmlns="http://busdox.org/serviceMetadata/publishing/1.0/">
+  <ServiceMetadata>
+    <ServiceInformation>
+      <ProcessList>
+        <Process>
+          <ServiceEndpointList>
+            <Endpoint transportProfile="peppol-transport-as4-v2_0">
+              <EndpointReference xmlns="http://www.w3.org/2005/08/addressing">
+                <Address>https://ap.example.com/as4</Address>
+              </EndpointReference>
+              <Certificate>MIIC...</Certificate>
+              <ServiceDescription>Example AP</ServiceDescription>
+            </Endpoint>
+          </ServiceEndpointList>
+        </Process>
+      </ProcessList>
+    </ServiceInformation>
+  </ServiceMetadata>
+</SignedServiceMetadata>
+"""
+
+
+def service_group(*document_types: str) -> str:
+    references = "".join(
+        f'<ServiceMetadataReference href="{SMP_URL}/iso6523-actorid-upis%3A%3A0009%3A%3A123456789'
+        f'/services/{quote(doc_type, safe="")}"/>'
+        for doc_type in document_types
+    )
+    return (
+        '<ServiceGroup xmlns="http://busdox.org/serviceMetadata/publishing/1.0/">'
+        "<ParticipantIdentifier>0009:123456789</ParticipantIdentifier>"
+        f"<ServiceMetadataReferenceCollection>{references}"
+        "</ServiceMetadataReferenceCollection></ServiceGroup>"
+    )
+
+
+def smp_transport(
+    requests: list[httpx.Request], document_types: tuple[str, ...] | None = None
+) -> httpx.MockTransport:
+    """
+    fake SMP answering every ServiceMetadata request; its ServiceGroup lists
+    `document_types` (404 if None)
+    """
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        if "/services/" not in request.url.path:
+            if document_types is None:
+                return httpx.Response(404)
+            return httpx.Response(200, text=service_group(*document_types))
+        return httpx.Response(
+            200,
+            text=SMP_RESPONSE,
+            headers={"cache-control": "max-age=600"},
+        )
+
+    return httpx.MockTransport(handler)
+
+
+def peppol_service(transport: httpx.MockTransport) -> PeppolLookupService:
+    service = PeppolLookupService(
+        environment=PeppolEnvironment.TEST,
+        dns_resolver=lambda hostname: SMP_URL,
+        cache_size=0,
+    )
+    service._client = httpx.AsyncClient(transport=transport)
+    return service
+
+
+async def test_lookup_smp_shared_client():
+    """every lookup goes through the same pooled client"""
+    requests = []
+    async with peppol_service(smp_transport(requests)) as service:
+        client = service._client
+        first = await service.lookup_by_siren("123456789")
+        second = await service.lookup_by_siret("12345678900012")
+        assert service._client is client
+
+    assert service._client is None
+    assert first.success and second.success
+    assert first.endpoint.address == "https://ap.example.com/as4"
+    assert first.endpoint.service_description == "Example AP"
+    smp_requests = [r for r in requests if "/services/" in r.url.path]
+    assert len(smp_requests) == 2
+    assert smp_requests[0].url.path.startswith(
+        "/iso6523-actorid-upis::0009::123456789/services/"
+    )
+
+
+async def test_lookup_service_group():
+    """one ServiceGroup and the known document types fetched together"""
+    requests = []
+    invoice_ubl = PEPPOL_DOCUMENT_TYPES["invoice_ubl"]
+    credit_note = PEPPOL_DOCUMENT_TYPES["credit_note"]
+    transport = smp_transport(requests, (invoice_ubl, credit_note, "other-doc"))
+    async with peppol_service(transport) as service:
+        service._lookup_cache = TTLCache()
+        service._service_group_cache = TTLCache()
+
+        ubl = await service.lookup_by_siren("123456789", "invoice_ubl")
+        credit = await service.lookup_by_siren("123456789", "credit_note")
+        cii = await service.lookup_by_siren("123456789", "invoice_cii")
+
+    assert ubl.success and credit.success
+    # not listed in the ServiceGroup: answered without requesting the SMP
+    assert cii.error_code == "DOCUMENT_TYPE_NOT_SUPPORTED"
+    paths = sorted(unquote(r.url.path) for r in requests)
+    assert paths == sorted(
+        [
+            "/iso6523-actorid-upis::0009::123456789",
+            f"/iso6523-actorid-upis::0009::123456789/services/{invoice_ubl}",
+            f"/iso6523-actorid-upis::0009::123456789/services/{credit_note}",
+        ]
+    )
+
+
+async def test_lookup_without_service_group():
+    """an SMP without ServiceGroup falls back to one request per document type"""
+    requests = []
+    async with peppol_service(smp_transport(requests)) as service:
+        service._service_group_cache = TTLCache()
+        await service.lookup_by_siren("123456789", "invoice_ubl")
+        await service.lookup_by_siren("123456789", "credit_note")
+
+    assert len(requests) == 3
+    assert sorted(r.url.path.count("/services/") for r in requests) == [0, 1, 1]
+
+
+async def test_lookup_cold_parallel():
+    """a cold lookup sends the ServiceGroup and requested ServiceMetadata together"""
+    requests = []
+    started = asyncio.Event()
+    invoice_ubl = PEPPOL_DOCUMENT_TYPES["invoice_ubl"]
+    credit_note = PEPPOL_DOCUMENT_TYPES["credit_note"]
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        if len(requests) == 2:
+            started.set()
+        # neither request answers before both are in flight
+        await asyncio.wait_for(started.wait(), 1)
+        if "/services/" not in request.url.path:
+            return httpx.Response(200, text=service_group(invoice_ubl, credit_note))
+        return httpx.Response(200, text=SMP_RESPONSE)
+
+    async with peppol_service(httpx.MockTransport(handler)) as service:
+        service._lookup_cache = TTLCache()
+        service._service_group_cache = TTLCache()
+        result = await service.lookup_by_siren("123456789", "invoice_ubl")
+        assert result.success
+        # the other announced document type is prefetched in the background
+        await asyncio.gather(*service._prefetches)
+        credit = await service.lookup_by_siren("123456789", "credit_note")
+
+    assert credit.success
+    assert len(requests) == 3
+
+
+def test_parse_service_group():
+    xml = service_group(PEPPOL_DOCUMENT_TYPES["invoice_ubl"])
+    assert parse_service_group(xml) == {PEPPOL_DOCUMENT_TYPES["invoice_ubl"]}
+    assert parse_service_group(service_group()) == frozenset()
+    assert parse_service_group(SMP_RESPONSE) is None
+    assert parse_service_group(b"not xml") is None
+
+
+async def test_lookup_lazy_client():
+    """the pool is created on first use when start() was not called"""
+    service = PeppolLookupService(environment=PeppolEnvironment.TEST)
+    client = await service._get_client()
+    assert client is await service._get_client()
+    await service.close()
+    assert service._client is None
+
+
+# =============================================================================
+# SML resolution against the fake DNS service
+# =============================================================================
+
+
+@pytest.fixture
+def dns_server():
+    """peppol_dns_fake DNS server running in a background thread"""
+    server = DNSServer(host="127.0.0.1", port=0)
+    server.start()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.running = False
+    thread.join()
+    server.stop()
+
+
+def add_naptr(server: DNSServer, hostname: str, smp_url: str, ttl: int = 120):
+    server.records[hostname] = [
+        DNSResourceRecord(
+            name=hostname,
+            rtype=QTYPE_NAPTR,
+            rclass=QCLASS_IN,
+            ttl=ttl,
+            rdata=server._build_naptr_data(
+                order=100,
+                preference=10,
+                flags="U",
+                services="Meta:SMP",
+                regexp=f"!^.*$!{smp_url}!",
+                replacement=".",
+            ),
+        )
+    ]
+
+
+def test_smp_url_from_naptr():
+    assert smp_url_from_naptr("!^.*$!https://smp.example.com!") == SMP_URL
+    assert smp_url_from_naptr("!.*!https://smp.example.com!") == SMP_URL
+    assert smp_url_from_naptr("") is None
+    assert smp_url_from_naptr("!^(.*)$!\\1!") is None
+
+
+async def test_resolve_smp_url_async(dns_server):
+    """NAPTR answer of the fake DNS, with its TTL"""
+    service = PeppolLookupService(
+        environment=PeppolEnvironment.TEST,
+        dns_nameservers=["127.0.0.1"],
+        dns_port=dns_server.port,
+    )
+    hostname = compute_sml_hostname(service.sml_zone, "0009", "123456789")
+    add_naptr(dns_server, hostname, SMP_URL, ttl=120)
+
+    assert await service._resolve_smp_url_async(hostname) == (SMP_URL, 120)
+    assert await service._resolve_smp_url_async("unknown.example.com") == (
+        None,
+        None,
+    )
+
+
+async def test_resolve_smp_url_bulk_zone(dns_server):
+    """participants bulk-loaded in the fake DNS, with base32/SHA-256 hostnames"""
+    service = PeppolLookupService(
+        environment=PeppolEnvironment.TEST,
+        dns_nameservers=["127.0.0.1"],
+        dns_port=dns_server.port,
+        sml_hash_scheme=SmlHashScheme.SHA256,
+    )
+    sirens = [f"{i:09d}" for i in range(1000)]
+    added = dns_server.add_peppol_participants(
+        service.sml_zone, "0009", sirens, SMP_URL, SmlHashScheme.SHA256
+    )
+    assert added == 1000
+
+    hostname = compute_sml_hostname(
+        service.sml_zone, "0009", sirens[42], SmlHashScheme.SHA256
+    )
+    assert await service._resolve_smp_url_async(hostname) == (SMP_URL, 300)
+
+
+async def test_resolve_smp_url_timeout():
+    """an unresponsive SML gives SML_TIMEOUT, which is not cached"""
+    with closing(socket.socket(socket.AF_INET, socket.SOCK_DGRAM)) as sock:
+        sock.bind(("127.0.0.1", 0))
+        service = PeppolLookupService(
+            environment=PeppolEnvironment.TEST,
+            dns_nameservers=["127.0.0.1"],
+            dns_port=sock.getsockname()[1],
+            dns_timeout=0.2,
+        )
+        result = await service.lookup_by_siren("123456789")
+
+    assert result.error_code == "SML_TIMEOUT"
+    assert len(service._smp_url_cache) == 0
+    assert len(service._lookup_cache) == 0
+
+
+async def test_resolve_smp_url_async_hook():
+    """the dns_resolver hook may also be a coroutine"""
+
+    async def resolver(hostname: str):
+        return SMP_URL
+
+    service = PeppolLookupService(dns_resolver=resolver)
+    assert await service._resolve_smp_url("any") == SMP_URL
+
+
+# =============================================================================
+# SMP ServiceMetadata parser
+# =============================================================================
+
+
+def test_parse_smp_endpoint():
+    endpoint = parse_smp_endpoint(SMP_RESPONSE.encode("utf-8"))
+    assert endpoint.address == "https://ap.example.com/as4"
+    assert endpoint.certificate == "MIIC..."
+    assert endpoint.service_description == "Example AP"
+    assert parse_smp_endpoint(SMP_RESPONSE) == endpoint
+
+
+def test_parse_smp_endpoint_without_namespace():
+    xml = SMP_RESPONSE.replace(' xmlns="http://busdox.org/serviceMetadata/publishing/1.0/"', "")
+    assert parse_smp_endpoint(xml).address == "https://ap.example.com/as4"
+
+
+def test_parse_smp_endpoint_other_profile():
+    xml = SMP_RESPONSE.replace("peppol-transport-as4-v2_0", "busdox-transport-as2-ver1p0")
+    assert parse_smp_endpoint(xml) is None
+
+
+def test_parse_smp_endpoint_invalid():
+    assert parse_smp_endpoint(b"<ServiceMetadata><Endpoint") is None
+    assert parse_smp_endpoint(b"not xml") is None
+
+
+def test_parse_smp_endpoint_stops_early():
+    """trailing content after the endpoint (signature, ...) is not parsed"""
+    head, _, _ = SMP_RESPONSE.partition("</ServiceEndpointList>")
+    parser = SmpEndpointParser()
+    assert parser.feed(head.encode("utf-8")) is True
+    assert parser.feed(b"<<< not parsed") is True
+    assert parser.close().address == "https://ap.example.com/as4"
+
+
+def test_parse_smp_endpoint_max_size():
+    padding = "<Extension>" + "x" * 2048 + "</Extension>"
+    xml = SMP_RESPONSE.replace("<ServiceMetadata>", "<ServiceMetadata>" + padding)
+    with pytest.raises(SmpResponseTooLarge):
+        parse_smp_endpoint(xml, max_size=1024)
@@ -0,0 +1,110 @@
+# SPDX-FileCopyrightText: 2026 Philippe ENTZMANN <philippe@entzmann.name>
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import asyncio
+import time
+
+import httpx
+
+from pac0.service.ppf_fake.main import create_app
+from pac0.service.routage import lib
+from pac0.service.routage.models import InvoiceMessage, RoutingStatus
+from pac0.service.routage.peppol import PeppolLookupResult
+from pac0.service.routage.ppf import PpfSubmitter
+
+PPF_URL = "http://ppf.example.com"
+
+
+def invoice(i: int, payload: str = "<Invoice>" + "x" * 200 + "</Invoice>") -> InvoiceMessage:
+    return InvoiceMessage(
+        invoice_id=f"INV-{i}",
+        sender_siren="111111111",
+        recipient_siren=f"{i:09d}",
+        payload=payload,
+    )
+
+
+def submitter(app, **kwargs) -> PpfSubmitter:
+    return PpfSubmitter(PPF_URL, transport=httpx.ASGITransport(app=app), **kwargs)
+
+
+async def test_batches_by_size():
+    """250 invoices with batches of 100: 3 uploads, one result per invoice"""
+    app = create_app()
+    async with submitter(app, max_batch_size=100, max_wait=0.05) as ppf:
+        results = await asyncio.wait_for(
+            asyncio.gather(*(ppf.submit(invoice(i)) for i in range(250))), 1
+        )
+
+    assert all(r.success for r in results)
+    assert [count for _, count, _ in app.state.batches] == [100, 100, 50]
+    assert len({r.batch_id for r in results}) == 3
+    assert len(app.state.invoices) == 250
+    # compressé: bien moins que les factures en clair
+    assert ppf.bytes_sent < sum(size for _, _, size in app.state.batches) / 5
+
+
+async def test_batches_by_time_window():
+    app = create_app()
+    async with submitter(app, max_batch_size=100, max_wait=0.05) as ppf:
+        start = time.monotonic()
+        results = await asyncio.gather(*(ppf.submit(invoice(i)) for i in range(3)))
+        elapsed = time.monotonic() - start
+
+    assert all(r.success for r in results)
+    assert [count for _, count, _ in app.state.batches] == [3]
+    assert 0.04 <= elapsed < 1
+
+
+async def test_batches_by_bytes():
+    app = create_app()
+    async with submitter(app, max_batch_bytes=1000, max_wait=0.05) as ppf:
+        await asyncio.gather(*(ppf.submit(invoice(i, "x" * 400)) for i in range(5)))
+    assert [count for _, count, _ in app.state.batches] == [2, 2, 1]
+
+
+async def test_results_per_invoice():
+    """a rejected invoice does not fail the rest of its batch"""
+    app = create_app()
+    async with submitter(app, max_wait=0.01) as ppf:
+        ok, rejected = await asyncio.gather(ppf.submit(invoice(1)), ppf.submit(invoice(2, "")))
+
+    assert ok.success
+    assert not rejected.success
+    assert not rejected.retryable
+    assert rejected.error_message == "empty payload"
+    assert ok.batch_id == rejected.batch_id
+
+
+async def test_unavailable_ppf_is_retryable():
+    app = create_app()
+    app.state.faults.unavailable_rate = 1.0
+    async with submitter(app, max_wait=0.01) as ppf:
+        results = await asyncio.gather(*(ppf.submit(invoice(i)) for i in range(3)))
+    assert all(not r.success and r.retryable for r in results)
+
+
+async def test_route_invoice_submits_to_ppf():
+    app = create_app()
+
+    class Lookup:
+        async def lookup_by_siren(self, siren, document_type="invoice_ubl"):
+            return PeppolLookupResult(success=False, error_code="PARTICIPANT_NOT_FOUND")
+
+    lib.set_peppol_service(Lookup())
+    lib.set_ppf_submitter(submitter(app, max_wait=0.01))
+    try:
+        routed, rejected = await asyncio.gather(
+            lib.route_invoice(invoice(1)), lib.route_invoice(invoice(2, ""))
+        )
+    finally:
+        await lib.get_ppf_submitter().close()
+        lib.set_ppf_submitter(None)
+        lib.set_peppol_service(None)
+
+    assert routed.status == RoutingStatus.ROUTED_TO_PPF
+    assert routed.destination == PPF_URL
+    assert rejected.status == RoutingStatus.ERROR
+    assert rejected.error_code == "PPF_SUBMISSION_FAILED"
+    assert len(app.state.batches) == 1
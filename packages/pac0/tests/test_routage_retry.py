@@ -0,0 +1,203 @@
+# SPDX-FileCopyrightText: 2026 Philippe ENTZMANN <philippe@entzmann.name>
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import asyncio
+import random
+import threading
+import time
+from types import SimpleNamespace
+
+from pac0.service.routage import lib
+from pac0.service.routage.models import RoutingStatus
+from pac0.service.routage.peppol import PeppolLookupResult
+from pac0.service.routage.retry import (
+    RetryPolicy,
+    RetryScheduler,
+    RetryStore,
+    TokenBucket,
+)
+from routage_helpers import wait_until
+
+MESSAGE = {
+    "invoice_id": "INV-1",
+    "sender_siren": "111111111",
+    "recipient_siren": "123456789",
+    "payload": "<Invoice/>",
+}
+
+
+class Publisher:
+    def __init__(self):
+        self.messages = []
+
+    async def publish(self, message, correlation_id=None):
+        self.messages.append((message, correlation_id))
+
+
+class EnvelopePublisher(Publisher):
+    """brick publisher: publish_envelope hands the object over as is"""
+
+    local = True
+
+    async def publish(self, message, subject="", headers=None, correlation_id=None):
+        self.messages.append((message, correlation_id))
+
+
+def test_backoff_with_jitter():
+    policy = RetryPolicy(base_delay=1, max_delay=30, multiplier=2)
+    rnd = random.Random(0)
+    for attempt, cap in [(0, 1), (1, 2), (3, 8), (10, 30)]:
+        delays = [policy.delay(attempt, rnd) for _ in range(100)]
+        assert all(cap / 2 <= d <= cap for d in delays)
+        assert len(set(delays)) > 1
+
+
+def test_token_bucket():
+    now = [0.0]
+    bucket = TokenBucket(rate=10, burst=2, clock=lambda: now[0])
+    assert bucket.delay() == bucket.delay() == 0
+    assert bucket.delay() == 0.1
+    now[0] += 0.1
+    assert bucket.delay() == 0
+
+
+async def test_retries_reinjected_in_due_order():
+    out = Publisher()
+    scheduler = RetryScheduler(
+        out.publish, policy=RetryPolicy(base_delay=0.02, multiplier=1), rate=1000
+    )
+    await scheduler.start()
+    try:
+        assert await scheduler.schedule(
+            {**MESSAGE, "invoice_id": "INV-1"}, "c1", attempt=0
+        )
+        scheduler.policy.base_delay = 0.01
+        assert await scheduler.schedule(
+            {**MESSAGE, "invoice_id": "INV-2"}, "c2", attempt=3
+        )
+        assert out.messages == []
+        await wait_until(lambda: len(out.messages) == 2, 1)
+    finally:
+        await scheduler.stop()
+
+    assert [(m["invoice_id"], m["attempt"], c) for m, c in out.messages] == [
+        ("INV-2", 4, "c2"),
+        ("INV-1", 1, "c1"),
+    ]
+    assert scheduler.reinjected == 2
+
+
+async def test_max_attempts():
+    scheduler = RetryScheduler(Publisher().publish, policy=RetryPolicy(max_attempts=3))
+    assert await scheduler.schedule(MESSAGE, attempt=1)
+    assert not await scheduler.schedule(MESSAGE, attempt=2)
+    assert (scheduler.scheduled, scheduler.exhausted) == (1, 1)
+
+
+async def test_retries_survive_restart(tmp_path):
+    """pending retries are reloaded from the store at startup"""
+    path = tmp_path / "retry.db"
+    first = RetryScheduler(Publisher().publish, store=RetryStore(path))
+    await first.start()
+    for i in range(3):
+        await first.schedule({**MESSAGE, "invoice_id": f"INV-{i}"}, f"c{i}")
+    await first.stop()
+
+    out = Publisher()
+    # horloge avancée: tous les réessais sont échus
+    second = RetryScheduler(
+        out.publish, store=RetryStore(path), clock=lambda: time.time() + 3600, rate=1000
+    )
+    await second.start()
+    assert len(second) == 3
+    await wait_until(lambda: len(out.messages) == 3, 1)
+    assert len(second.store) == 0
+    await second.stop()
+    assert sorted(c for _, c in out.messages) == ["c0", "c1", "c2"]
+
+
+async def test_reinjection_rate_limited():
+    out = Publisher()
+    scheduler = RetryScheduler(
+        out.publish,
+        policy=RetryPolicy(base_delay=0.0),
+        rate=100,
+        burst=5,
+    )
+    for i in range(15):
+        await scheduler.schedule({**MESSAGE, "invoice_id": f"INV-{i}"})
+    start = time.monotonic()
+    await scheduler.start()
+    await wait_until(lambda: len(out.messages) == 15, 2)
+    elapsed = time.monotonic() - start
+    await scheduler.stop()
+    # 5 at once, then 10 at 100/s
+    assert elapsed >= 0.08
+
+
+async def test_failed_reinjection_is_kept():
+    calls = []
+
+    async def publish(message, correlation_id):
+        calls.append(message)
+        if len(calls) == 1:
+            raise ConnectionError("NATS down")
+
+    scheduler = RetryScheduler(
+        publish, policy=RetryPolicy(base_delay=0.01, multiplier=1), rate=1000
+    )
+    await scheduler.start()
+    await scheduler.schedule(MESSAGE)
+    await wait_until(lambda: scheduler.reinjected == 1, 1)
+    await scheduler.stop()
+    assert len(calls) == 2
+
+
+async def test_store_io_off_event_loop():
+    loop_thread = threading.get_ident()
+    threads = []
+
+    class Store(RetryStore):
+        def put(self, *args):
+            threads.append(threading.get_ident())
+            super().put(*args)
+
+    scheduler = RetryScheduler(Publisher().publish, store=Store())
+    assert await scheduler.schedule(MESSAGE)
+    assert threads and loop_thread not in threads
+    await scheduler.stop()
+
+
+def test_in_memory_store_warns(monkeypatch, caplog):
+    monkeypatch.delenv("ROUTAGE_RETRY_DB", raising=False)
+    lib.create_retry_scheduler(Publisher().publish)
+    assert "perdus au redémarrage" in caplog.text
+
+
+async def test_process_schedules_pending_invoices():
+    """SMP timeouts and 503 are retried instead of going to routage-ERR"""
+    errors = iter(["SMP_TIMEOUT", "SMP_UNAVAILABLE", "DOCUMENT_TYPE_NOT_SUPPORTED"])
+
+    class Lookup:
+        async def lookup_by_siren(self, siren, document_type="invoice_ubl"):
+            return PeppolLookupResult(success=False, error_code=next(errors))
+
+    out, err = EnvelopePublisher(), EnvelopePublisher()
+    ctx = SimpleNamespace(publisher_out=out, publisher_err=err)
+    scheduler = RetryScheduler(Publisher().publish)
+    lib.set_peppol_service(Lookup())
+    try:
+        await lib.process(ctx, MESSAGE, "c1", retry=scheduler)
+        await lib.process(ctx, {**MESSAGE, "attempt": 9}, "c2", retry=scheduler)
+        await lib.process(ctx, MESSAGE, "c3", retry=scheduler)
+    finally:
+        lib.set_peppol_service(None)
+
+    assert scheduler.scheduled == 1
+    assert scheduler.exhausted == 1
+    assert [(m.status, m.error_code, c) for m, c in err.messages] == [
+        (RoutingStatus.PENDING, "SMP_UNAVAILABLE", "c2"),
+        (RoutingStatus.ERROR, "DOCUMENT_TYPE_NOT_SUPPORTED", "c3"),
+    ]
+    assert out.messages == []
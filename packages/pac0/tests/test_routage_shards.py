@@ -0,0 +1,120 @@
+# SPDX-FileCopyrightText: 2026 Philippe ENTZMANN <philippe@entzmann.name>
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from types import SimpleNamespace
+
+from nats.js.errors import NoKeysError
+
+from pac0.service.routage import lib
+from pac0.service.routage.shards import ShardAssigner, assigned_shards
+from pac0.shared import esb
+from pac0.shared.esb import JetStreamConfig, get_shard_count, shard_of, sharded_subject
+
+SHARDS = 16
+
+
+class KeyValue:
+    """In-memory bucket with the subset of the nats-py KeyValue API in use"""
+
+    def __init__(self):
+        self.data = {}
+
+    async def put(self, key, value):
+        self.data[key] = value
+
+    async def delete(self, key):
+        self.data.pop(key, None)
+
+    async def keys(self, filters):
+        prefix = filters[0].removesuffix(">")
+        keys = [key for key in self.data if key.startswith(prefix)]
+        if not keys:
+            raise NoKeysError
+        return keys
+
+
+class Broker:
+    def __init__(self):
+        self.kv = KeyValue()
+
+    async def key_value(self, bucket, **kwargs):
+        return self.kv
+
+
+def test_shard_of_recipient():
+    assert shard_of("123456789", SHARDS) == shard_of("123456789", SHARDS)
+    # un SIRET est dans la partition de son SIREN
+    assert shard_of("12345678900011", SHARDS) == shard_of("123456789", SHARDS)
+    assert len({shard_of(f"{i:09d}", SHARDS) for i in range(1000)}) == SHARDS
+
+    assert sharded_subject("routage-IN", "123456789", 0) == "routage-IN"
+    assert sharded_subject("routage-IN", None, SHARDS) == "routage-IN"
+    assert sharded_subject("routage-IN", "123456789", SHARDS) == (
+        f"routage-IN.{shard_of('123456789', SHARDS)}"
+    )
+
+
+def test_shard_count(monkeypatch):
+    assert get_shard_count("routage") == 0
+    monkeypatch.setenv("ROUTAGE_SHARDS", "8")
+    assert get_shard_count("routage") == 8
+
+
+def test_shards_require_jetstream(monkeypatch):
+    """core NATS would drop a crashed replica's shards: no assigner there"""
+    monkeypatch.setenv("ROUTAGE_SHARDS", "8")
+    core = SimpleNamespace(jetstream=None)
+    assert lib.create_shard_assigner(core, None, None) is None
+
+    jetstream = SimpleNamespace(jetstream=JetStreamConfig())
+    monkeypatch.setattr(esb, "broker", Broker())
+    assigner = lib.create_shard_assigner(jetstream, None, None)
+    assert assigner.shards == 8
+
+
+def test_rendezvous_assignment():
+    members = [f"replica-{i}" for i in range(4)]
+    owned = [assigned_shards(SHARDS, members, m) for m in members]
+    # chaque partition a exactement un propriétaire
+    assert sorted(s for shards in owned for s in shards) == list(range(SHARDS))
+
+    # un départ ne déplace que les partitions du membre parti
+    remaining = members[1:]
+    for member, before in zip(members[1:], owned[1:]):
+        after = assigned_shards(SHARDS, remaining, member)
+        assert before <= after
+        assert after - before <= owned[0]
+
+
+async def test_assigners_share_shards():
+    broker = Broker()
+    events = []
+
+    def assigner(name):
+        async def assign(shard):
+            events.append((name, "+", shard))
+
+        async def revoke(shard):
+            events.append((name, "-", shard))
+
+        return ShardAssigner(broker, SHARDS, assign, revoke, member_id=name)
+
+    a, b = assigner("a"), assigner("b")
+    await a.start()
+    assert a.owned == set(range(SHARDS))
+
+    await b.start()
+    await a.rebalance()
+    assert a.owned | b.owned == set(range(SHARDS))
+    assert not a.owned & b.owned
+    # b s'abonne avant que a ne quitte ses partitions
+    for shard in b.owned:
+        assert events.index(("b", "+", shard)) < events.index(("a", "-", shard))
+
+    await b.stop()
+    assert b.owned == set()
+    await a.rebalance()
+    assert a.owned == set(range(SHARDS))
+    await a.stop()
+    assert broker.kv.data == {}
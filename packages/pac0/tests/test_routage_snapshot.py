@@ -0,0 +1,108 @@
+# SPDX-FileCopyrightText: 2026 Philippe ENTZMANN <philippe@entzmann.name>
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import threading
+
+from pac0.service.routage.peppol import PeppolEndpoint, PeppolLookupService
+from pac0.service.routage.snapshot import LookupSnapshot
+from pac0.shared.peppol import PeppolEnvironment
+from routage_helpers import SMP_URL, FakeClock, no_service_group
+
+KEY = ("0009", "123456789", "doc")
+
+
+def test_snapshot_roundtrip(tmp_path):
+    """entries survive a close/reopen with their expiry"""
+    clock = FakeClock(now=1_700_000_000.0)
+    snapshot = LookupSnapshot(tmp_path / "cache.db", clock=clock)
+    snapshot.put(KEY, {"success": True}, ttl=60)
+    snapshot.put(("0009", "999999999", "doc"), {"success": False}, ttl=0)
+    snapshot.close()
+
+    clock.now += 20
+    snapshot = LookupSnapshot(tmp_path / "cache.db", clock=clock)
+    assert snapshot.get(KEY) == ({"success": True}, 40)
+    assert snapshot.get(("0009", "999999999", "doc")) is None
+    clock.now += 41
+    assert snapshot.get(KEY) is None
+    assert snapshot.prune() == 1
+    snapshot.close()
+
+
+def test_snapshot_batches_writes(tmp_path):
+    snapshot = LookupSnapshot(tmp_path / "cache.db", flush_size=3)
+    snapshot.put(("a", "1", "doc"), 1, ttl=60)
+    snapshot.put(("a", "2", "doc"), 2, ttl=60)
+    # pending writes are readable before being committed
+    assert snapshot.get(("a", "1", "doc"))[0] == 1
+    assert snapshot._pending
+    snapshot.put(("a", "3", "doc"), 3, ttl=60)
+    assert not snapshot._pending
+    assert len(snapshot) == 3
+    snapshot.close()
+
+
+def _service(path, calls: list) -> PeppolLookupService:
+    service = PeppolLookupService(
+        environment=PeppolEnvironment.TEST,
+        dns_resolver=lambda hostname: SMP_URL,
+        snapshot_path=str(path),
+    )
+
+    async def fetch(smp_url, scheme_id, participant_id, document_type_id):
+        calls.append(participant_id)
+        endpoint = PeppolEndpoint(
+            address="https://ap.example.com/as4",
+            certificate="MIIC...",
+            transport_profile="peppol-transport-as4-v2_0",
+        )
+        return endpoint, 600.0
+
+    service._fetch_smp_metadata = fetch
+    service._fetch_service_group = no_service_group
+    return service
+
+
+async def test_lookup_warm_start(tmp_path):
+    """a restarted service answers from the snapshot without calling the SMP"""
+    calls = []
+    service = _service(tmp_path / "cache.db", calls)
+    first = await service.lookup_by_siren("123456789")
+    await service.close()
+
+    restarted = _service(tmp_path / "cache.db", calls)
+    second = await restarted.lookup_by_siren("123456789")
+    third = await restarted.lookup_by_siren("123456789")
+    await restarted.close()
+
+    assert calls == ["123456789"]
+    assert second == first
+    assert third is second
+    assert restarted.snapshot_hits == 1
+
+
+async def test_snapshot_io_off_event_loop(tmp_path):
+    """snapshot reads and writes never run on the event loop thread"""
+    loop_thread = threading.get_ident()
+    threads = []
+    calls = []
+    service = _service(tmp_path / "cache.db", calls)
+    snapshot = service._snapshot
+
+    def record(method):
+        def call(*args):
+            threads.append(threading.get_ident())
+            return method(*args)
+
+        return call
+
+    for name in ("get", "put", "forget", "clear"):
+        setattr(snapshot, name, record(getattr(snapshot, name)))
+    await service.lookup_by_siren("123456789")
+    await service.forget("0009", "123456789")
+    await service.clear_cache()
+    await service.close()
+
+    assert len(threads) == 4
+    assert loop_thread not in threads
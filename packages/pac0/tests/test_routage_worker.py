@@ -0,0 +1,221 @@
+# SPDX-FileCopyrightText: 2026 Philippe ENTZMANN <philippe@entzmann.name>
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import asyncio
+
+import pytest
+
+from pac0.service.routage import lib
+from pac0.service.routage.models import InvoiceMessage
+from pac0.service.routage.peppol import PeppolLookupService
+from pac0.service.routage.worker import LatencyWindow, RoutageWorker
+from pac0.shared.peppol import PeppolEnvironment
+from routage_helpers import wait_until
+
+
+async def test_worker_max_in_flight():
+    """never more than max_in_flight messages processed at once"""
+    running = 0
+    peak = 0
+
+    async def handler(message, correlation_id):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+
+    worker = RoutageWorker(handler, max_in_flight=3)
+    for i in range(20):
+        await worker.submit(i)
+    await worker.join()
+
+    assert peak == 3
+    assert worker.stats.completed == 20
+    assert worker.stats.pending == 0
+
+
+async def test_worker_slow_destination_does_not_starve_others():
+    """a slow destination only holds its own slots"""
+    slow = asyncio.Event()
+    done = []
+
+    async def handler(message, correlation_id):
+        if message.startswith("slow"):
+            await slow.wait()
+        done.append(message)
+
+    async def destination(message):
+        return message.split("-")[0]
+
+    worker = RoutageWorker(
+        handler, max_in_flight=4, max_per_destination=2, destination=destination
+    )
+    for i in range(10):
+        await worker.submit(f"slow-{i}")
+    for i in range(10):
+        await worker.submit(f"fast-{i}")
+
+    await wait_until(lambda: len(done) == 10, 1)
+    assert sorted(done) == sorted(f"fast-{i}" for i in range(10))
+    assert worker.stats.in_flight == 2
+
+    slow.set()
+    await worker.join()
+    assert len(done) == 20
+
+
+async def test_worker_keeps_recipient_order():
+    """messages of a same recipient are processed one at a time, in order"""
+    processed: dict[str, list[int]] = {}
+    running: set[str] = set()
+
+    async def handler(message, correlation_id):
+        recipient, seq = message
+        assert recipient not in running
+        running.add(recipient)
+        await asyncio.sleep(0.001 * (seq % 3))
+        processed.setdefault(recipient, []).append(seq)
+        running.discard(recipient)
+
+    worker = RoutageWorker(handler, max_in_flight=10, ordering_key=lambda m: m[0])
+    for seq in range(10):
+        for recipient in ("a", "b", "c"):
+            await worker.submit((recipient, seq))
+    await worker.join()
+
+    assert processed == {r: list(range(10)) for r in ("a", "b", "c")}
+
+
+async def test_worker_backpressure_and_failures():
+    """submit() waits beyond max_pending; handler errors are counted"""
+    release = asyncio.Event()
+
+    async def handler(message, correlation_id):
+        await release.wait()
+        if message == "bad":
+            raise ValueError(message)
+
+    worker = RoutageWorker(handler, max_pending=2)
+    await worker.submit("ok", "c1")
+    await worker.submit("bad", "c2")
+    blocked = asyncio.create_task(worker.submit("ok", "c3"))
+    await asyncio.sleep(0.01)
+    assert not blocked.done()
+
+    release.set()
+    await blocked
+    await worker.join()
+    assert worker.stats.as_dict() | {"queue_wait": None, "processing": None} == {
+        "submitted": 3,
+        "completed": 2,
+        "failed": 1,
+        "in_flight": 0,
+        "pending": 0,
+        "queue_wait": None,
+        "processing": None,
+    }
+
+
+async def test_worker_queue_wait_vs_processing():
+    """queue wait and processing time are measured separately"""
+
+    async def handler(message, correlation_id):
+        await asyncio.sleep(0.02)
+
+    worker = RoutageWorker(handler, max_in_flight=1)
+    for i in range(3):
+        await worker.submit(i)
+    await worker.join()
+
+    stats = worker.stats.as_dict()
+    assert stats["processing"]["p50"] >= 0.015
+    # the last message waited for the two previous ones
+    assert max(worker.stats.queue_wait.samples) >= 0.03
+    assert min(worker.stats.queue_wait.samples) < 0.01
+
+
+async def test_worker_process_waits_for_handler():
+    """process() returns once the handler is done and raises its error"""
+    release = asyncio.Event()
+
+    async def handler(message, correlation_id):
+        await release.wait()
+        if message == "bad":
+            raise ValueError(message)
+        return message.upper()
+
+    worker = RoutageWorker(handler)
+    ok = asyncio.create_task(worker.process("ok", "c1"))
+    bad = asyncio.create_task(worker.process("bad", "c2"))
+    await asyncio.sleep(0.01)
+    assert not ok.done() and not bad.done()
+
+    release.set()
+    assert await ok == "OK"
+    with pytest.raises(ValueError):
+        await bad
+    await worker.join()
+    assert worker.stats.completed == 1
+    assert worker.stats.failed == 1
+
+
+def test_latency_window():
+    window = LatencyWindow(size=3)
+    for value in (5.0, 1.0, 2.0, 3.0):
+        window.add(value)
+    assert list(window.samples) == [1.0, 2.0, 3.0]
+    assert window.summary() == {"p50": 2.0, "p95": 3.0, "p99": 3.0}
+
+
+def test_recipient_key():
+    message = InvoiceMessage(
+        invoice_id="INV-1",
+        sender_siren="111111111",
+        recipient_siren="123456789",
+        payload="<Invoice/>",
+    )
+    assert lib.recipient_key(message) == "123456789"
+    assert lib.recipient_key({"recipient_siret": "12345678900012"}) == "12345678900012"
+    assert lib.recipient_key("raw") is None
+
+
+def test_lifecycle_key_opt_in(monkeypatch):
+    """only the configured lifecycle document types are ordered per recipient"""
+    lifecycle = {"recipient_siren": "123456789", "document_type": "cdar"}
+    invoice = {"recipient_siren": "123456789"}
+    assert lib.lifecycle_key(frozenset({"cdar"}), lifecycle) == "123456789"
+    assert lib.lifecycle_key(frozenset({"cdar"}), invoice) is None
+
+    monkeypatch.delenv("ROUTAGE_ORDERED_DOCUMENT_TYPES", raising=False)
+    assert lib.create_worker(None).ordering_key is None
+    monkeypatch.setenv("ROUTAGE_ORDERED_DOCUMENT_TYPES", "cdar")
+    assert lib.create_worker(None).ordering_key(lifecycle) == "123456789"
+
+
+async def test_destination_host_without_dns():
+    """the per-destination limit only reads the SML cache"""
+    resolved = []
+
+    def resolver(hostname):
+        resolved.append(hostname)
+        return "https://smp.example.com"
+
+    async def no_smp(*args):
+        return None, None
+
+    service = PeppolLookupService(
+        environment=PeppolEnvironment.TEST, dns_resolver=resolver
+    )
+    service._fetch_service_group = service._fetch_smp_metadata = no_smp
+    lib.set_peppol_service(service)
+    try:
+        message = {"recipient_siren": "123456789"}
+        assert await lib.destination_host(message) is None
+        await service.lookup_by_siren("123456789")
+        assert await lib.destination_host(message) == "smp.example.com"
+    finally:
+        lib.set_peppol_service(None)
+        await service.close()
+    assert len(resolved) == 1